@@ -0,0 +1,215 @@
+"""End-to-end throughput benchmark for the txtra CLI
+
+Generates a zone of N domains with realistic TXT sets and SPF include
+chains, serves it from the local stub server (benchmarks/stub_dns.py) on
+127.0.0.1 and runs the real CLI modes against it through --resolvers.
+Every run reports its throughput, the p50/p99 latency of a domain (from
+the start of its resolution to the end of its scan, SPF includes
+included) and the peak RSS of the txtra process.
+
+    python benchmarks/bench_e2e.py [--domains N] [--modes stdout,csv,json,jsonl]
+                                   [--concurrency 50,100,200] [--latency-ms MS]
+                                   [--json results.json] [-- TXTRA_ARGS...]
+
+Several --concurrency values sweep the setting. Arguments after -- are
+passed to every txtra run, e.g. ``-- --no-scan``. Per-domain latencies
+are only collected for single-process runs, not with --workers.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+from typing import List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+HERE = Path(__file__).resolve().parent
+LATENCY_ENV = "TXTRA_BENCH_LATENCY_FILE"
+
+MODE_ARGS = {
+    "stdout": [],
+    "csv": ["--csv"],
+    "json": ["--json"],
+    "jsonl": ["--jsonl"],
+}
+
+
+def child(argv: List[str]) -> None:
+    """Run the txtra CLI with per-domain timing, dumping the samples at exit"""
+    import atexit
+
+    sys.path.insert(0, str(ROOT))
+    from txtra import __main__ as cli
+
+    samples: List[float] = []
+    scan_domain = cli.Txtra._scan_domain
+
+    async def timed(self, domain, txt_resolver, no_scan):
+        start = time.perf_counter()
+        try:
+            return await scan_domain(self, domain, txt_resolver, no_scan)
+        finally:
+            samples.append(time.perf_counter() - start)
+
+    def dump() -> None:
+        path = os.environ.get(LATENCY_ENV)
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(samples, f)
+
+    cli.Txtra._scan_domain = timed
+    atexit.register(dump)
+    sys.argv = ["txtra"] + argv
+    cli.main()
+
+
+def percentile(samples: List[float], q: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def run_txtra(argv: List[str], latency_file: str) -> dict:
+    """Run one CLI invocation, returning its wall time, peak RSS and latencies"""
+    env = dict(os.environ, **{LATENCY_ENV: latency_file})
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, str(Path(__file__).resolve()), "--child", *argv],
+        cwd=ROOT, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    # wait4 gives the resource usage of this child alone
+    _, status, usage = os.wait4(proc.pid, 0)
+    wall = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    stderr = proc.stderr.read().decode("utf-8", "replace")
+    proc.stderr.close()
+    if proc.returncode != 0:
+        raise RuntimeError(f"txtra {' '.join(argv)} exited with {proc.returncode}:\n{stderr}")
+    try:
+        with open(latency_file, encoding="utf-8") as f:
+            latencies = json.load(f)
+        os.unlink(latency_file)
+    except OSError:
+        latencies = []
+    return {"wall": wall, "max_rss_kb": usage.ru_maxrss, "latencies": latencies}
+
+
+def start_stub(zone_path: str, latency_ms: float, jitter_ms: float) -> "tuple[subprocess.Popen, int]":
+    proc = subprocess.Popen(
+        [
+            sys.executable, str(HERE / "stub_dns.py"), "--zone", zone_path,
+            "--latency-ms", str(latency_ms), "--jitter-ms", str(jitter_ms),
+        ],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+    )
+    line = proc.stdout.readline()
+    if not line:
+        proc.kill()
+        raise RuntimeError("stub DNS server failed to start")
+    return proc, int(line)
+
+
+def main() -> None:
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        child(sys.argv[2:])
+        return
+
+    argv = sys.argv[1:]
+    extra: List[str] = []
+    if "--" in argv:
+        extra = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--domains", type=int, default=5000, help="Domains in the generated zone")
+    p.add_argument("--seed", type=int, default=0, help="Seed of the generated zone")
+    p.add_argument("--nxdomain-rate", type=float, default=0.1, help="Share of domains that do not exist")
+    p.add_argument("--modes", default="stdout,csv,json,jsonl", help="Comma-separated CLI modes to run")
+    p.add_argument("--concurrency", default="100", help="Comma-separated --concurrency values to sweep")
+    p.add_argument("--runs", type=int, default=1, help="Runs per mode and concurrency, the best one is kept")
+    p.add_argument("--latency-ms", type=float, default=0.0, help="Delay added by the stub server to every response")
+    p.add_argument("--jitter-ms", type=float, default=0.0, help="Random extra delay of the stub server")
+    p.add_argument("--json", help="Also write the results to this file, to compare releases")
+    args = p.parse_args(argv)
+
+    sys.path.insert(0, str(HERE))
+    from stub_dns import generate_zone
+
+    modes = args.modes.split(",")
+    for mode in modes:
+        if mode not in MODE_ARGS:
+            p.error(f"unknown mode: '{mode}'")
+    concurrencies = [int(value) for value in args.concurrency.split(",")]
+
+    zone, domains = generate_zone(args.domains, seed=args.seed, nxdomain_rate=args.nxdomain_rate)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        zone_path = os.path.join(tmp, "zone.json")
+        with open(zone_path, "w", encoding="utf-8") as f:
+            json.dump(zone, f)
+        domains_path = os.path.join(tmp, "domains.txt")
+        with open(domains_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(domains) + "\n")
+
+        stub, port = start_stub(zone_path, args.latency_ms, args.jitter_ms)
+        try:
+            resolvers_path = os.path.join(tmp, "resolvers.txt")
+            with open(resolvers_path, "w", encoding="utf-8") as f:
+                f.write(f"127.0.0.1#{port}\n")
+            # Build the template bundle outside of the measured runs
+            subprocess.run(
+                [sys.executable, "-c", "from txtra.__main__ import Txtra; Txtra().templates"],
+                cwd=ROOT, check=True,
+            )
+
+            print(f"{len(domains)} domains, {len(zone)} names, stub server on 127.0.0.1#{port}")
+            print(f"{'mode':<7} {'conc':>5} {'wall s':>8} {'domains/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'peak RSS MB':>12}")
+            for mode in modes:
+                for concurrency in concurrencies:
+                    cli_args = [
+                        "-f", domains_path, "--resolvers", resolvers_path,
+                        "--concurrency", str(concurrency), *MODE_ARGS[mode],
+                    ]
+                    if mode != "stdout":
+                        cli_args += ["-o", os.path.join(tmp, f"output.{mode}")]
+                    runs = [
+                        run_txtra(cli_args + extra, os.path.join(tmp, "latency.json"))
+                        for _ in range(args.runs)
+                    ]
+                    best = min(runs, key=lambda run: run["wall"])
+                    p50 = percentile(best["latencies"], 0.5)
+                    p99 = percentile(best["latencies"], 0.99)
+                    result = {
+                        "mode": mode,
+                        "concurrency": concurrency,
+                        "domains": len(domains),
+                        "wall_s": best["wall"],
+                        "domains_per_s": len(domains) / best["wall"],
+                        "p50_ms": p50 * 1000 if p50 is not None else None,
+                        "p99_ms": p99 * 1000 if p99 is not None else None,
+                        "peak_rss_mb": best["max_rss_kb"] / 1024,
+                    }
+                    results.append(result)
+                    fmt = lambda value: f"{value:8.1f}" if value is not None else f"{'-':>8}"
+                    print(
+                        f"{mode:<7} {concurrency:>5} {result['wall_s']:8.2f} {result['domains_per_s']:10.0f} "
+                        f"{fmt(result['p50_ms'])} {fmt(result['p99_ms'])} {result['peak_rss_mb']:12.1f}"
+                    )
+        finally:
+            stub.terminate()
+            stub.wait()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "median_domains_per_s": statistics.median(
+                result["domains_per_s"] for result in results), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Matcher microbenchmark for txtra
+
+Scans a synthetic TXT corpus (benchmarks/txt_corpus.py) with the provider
+templates and reports the records/sec of TxtRecord.scan through the
+TemplateIndex and through the plain template list, the recall on the
+positives and the cost of every template in ns per record.
+
+    python benchmarks/bench_matcher.py [-n 50000] [--corpus corpus.jsonl]
+                                       [--runs 3] [--top 15] [--min-rate RATE]
+
+With --min-rate the script exits non-zero when the indexed scan is slower
+than RATE records/sec.
+"""
+import argparse
+import json
+import sys
+import time
+
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+HERE = Path(__file__).resolve().parent
+
+Corpus = List[Tuple[str, Optional[str]]]
+
+
+def best_of(runs: int, func: Callable[[], None]) -> float:
+    """Best wall time of func over runs calls, in seconds"""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def load_corpus(path: str) -> Corpus:
+    with open(path, encoding="utf-8") as f:
+        return [(row["value"], row["template"]) for row in map(json.loads, f)]
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("-n", "--count", type=int, default=50_000, help="Records of the generated corpus")
+    p.add_argument("--positive-rate", type=float, default=0.3, help="Share of positives in the generated corpus")
+    p.add_argument("--seed", type=int, default=0, help="Seed of the generated corpus")
+    p.add_argument("--corpus", help="Corpus file written by txt_corpus.py instead of a generated one")
+    p.add_argument("--runs", type=int, default=3, help="Runs per measurement, the best one is kept")
+    p.add_argument("--top", type=int, default=15, help="Most expensive templates to list")
+    p.add_argument("--min-rate", type=float, help="Fail when the indexed scan is slower than this, in records/sec")
+    args = p.parse_args()
+
+    sys.path[:0] = [str(ROOT), str(HERE)]
+    from txt_corpus import generate, load_templates
+    from txtra.__main__ import TxtRecord
+
+    templates = load_templates()
+    if args.corpus:
+        corpus = load_corpus(args.corpus)
+    else:
+        corpus = list(generate(templates, args.count, args.positive_rate, args.seed))
+    values = [value for value, _ in corpus]
+    plain = list(templates)
+
+    indexed_s = best_of(args.runs, lambda: [TxtRecord(value).scan(templates) for value in values])
+    plain_s = best_of(args.runs, lambda: [TxtRecord(value).scan(plain) for value in values])
+
+    positives = [(value, name) for value, name in corpus if name is not None]
+    found = sum(
+        any(t.name == name for t, _ in templates.matches(value)) for value, name in positives
+    )
+
+    # Per-template cost: the literal prefilter and regex search of one
+    # template alone, the way TemplateIndex.matches runs them
+    costs = []
+    for template, checks in templates._index:
+        def scan_one(checks=checks) -> None:
+            for value in values:
+                for literal, pattern in checks:
+                    if literal in value and pattern.search(value):
+                        break
+
+        def regex_only(patterns=template.patterns) -> None:
+            for value in values:
+                for pattern in patterns:
+                    if pattern.search(value):
+                        break
+
+        hits = sum(1 for value in values if template.match(value))
+        costs.append((
+            template.name,
+            best_of(args.runs, scan_one) / len(values) * 1e9,
+            best_of(args.runs, regex_only) / len(values) * 1e9,
+            hits,
+        ))
+    costs.sort(key=lambda cost: cost[1], reverse=True)
+
+    rate = len(values) / indexed_s
+    print(f"{len(values)} records, {len(positives)} positives, {len(templates)} templates")
+    print(f"scan (TemplateIndex)    {rate:12.0f} records/s")
+    print(f"scan (template list)    {len(values) / plain_s:12.0f} records/s")
+    if positives:
+        print(f"recall                  {found / len(positives):12.2%}")
+    print()
+    print(f"{'template':<32} {'indexed ns':>11} {'regex ns':>9} {'hits':>7}")
+    for name, indexed_ns, regex_ns, hits in costs[:args.top]:
+        print(f"{name[:32]:<32} {indexed_ns:11.1f} {regex_ns:9.1f} {hits:7}")
+    print(f"{'total':<32} {sum(c[1] for c in costs):11.1f} {sum(c[2] for c in costs):9.1f}")
+
+    if args.min_rate is not None and rate < args.min_rate:
+        print(f"FAIL: {rate:.0f} records/s is below the budget of {args.min_rate:.0f}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Startup benchmark for the txtra CLI
+
+Measures the import time of txtra.__main__ (via ``python -X importtime``) and
+the wall-clock time of ``txtra -h`` relative to a bare interpreter.
+
+    python benchmarks/bench_startup.py [--runs N] [--max-ms MS]
+
+With --max-ms the script exits non-zero when the median ``txtra -h``
+overhead over a bare interpreter exceeds the budget.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def wall_times(cmd, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def import_time_us():
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import txtra.__main__"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = [f.strip() for f in line.split("|")]
+        if len(fields) == 3 and fields[2] == "txtra.__main__":
+            return int(fields[1])
+    raise RuntimeError("txtra.__main__ not found in -X importtime output")
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--runs", type=int, default=20, help="Number of runs per command")
+    p.add_argument("--max-ms", type=float, help="Fail when the median `txtra -h` overhead exceeds this")
+    args = p.parse_args()
+
+    bare = wall_times([sys.executable, "-c", "pass"], args.runs)
+    help_ = wall_times([sys.executable, "-m", "txtra", "-h"], args.runs)
+    overhead = statistics.median(help_) - statistics.median(bare)
+
+    print(f"import txtra.__main__   {import_time_us() / 1000:8.2f} ms (cumulative)")
+    print(f"python -c pass          {statistics.median(bare):8.2f} ms (median of {args.runs})")
+    print(f"txtra -h                {statistics.median(help_):8.2f} ms (median of {args.runs})")
+    print(f"txtra -h overhead       {overhead:8.2f} ms")
+
+    if args.max_ms is not None and overhead > args.max_ms:
+        print(f"FAIL: overhead {overhead:.2f} ms exceeds budget {args.max_ms:.2f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""Local authoritative stub DNS server for txtra benchmarks
+
+Serves the TXT records of a generated zone over UDP and TCP on 127.0.0.1.
+Names missing from the zone get NXDOMAIN with an SOA record, and a UDP
+answer too large for the client's payload size is truncated so that the
+client retries over TCP, like a real server.
+
+    python benchmarks/stub_dns.py --domains 1000 [--port 5353] [--latency-ms 5]
+    python benchmarks/stub_dns.py --zone zone.json
+
+The bound port is printed on the first line of stdout. The zone can also
+be built with generate_zone() and served in-process with serve().
+"""
+import argparse
+import asyncio
+import json
+import random
+import string
+import struct
+import sys
+
+from typing import Dict, List, Optional, Tuple
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+import dns.rrset
+
+from dns.rdtypes.ANY.TXT import TXT
+
+Zone = Dict[str, List[str]]
+
+TTL = 300
+NEGATIVE_TTL = 60
+SOA = "ns.bench.invalid. hostmaster.bench.invalid. 1 3600 600 86400 {ttl}"
+# Suffixes of the generated registrable domains, multi-label ones included
+SUFFIXES = ["com", "net", "org", "io", "co.uk", "com.au", "co.jp", "de"]
+THIRD_PARTY_SPF = ["_spf.google.com", "spf.protection.outlook.com", "sendgrid.net", "mail.zendesk.com"]
+
+
+def _token(rng: random.Random, length: int, alphabet: str = string.ascii_letters + string.digits) -> str:
+    return "".join(rng.choice(alphabet) for _ in range(length))
+
+
+def _verifications(rng: random.Random) -> List[str]:
+    """Typical site verification and miscellaneous TXT values"""
+    hexdigits = "0123456789abcdef"
+    choices = [
+        lambda: "google-site-verification=" + _token(rng, 43, string.ascii_letters + string.digits + "-_"),
+        lambda: "MS=ms" + _token(rng, 8, string.digits),
+        lambda: "facebook-domain-verification=" + _token(rng, 30, string.ascii_lowercase + string.digits),
+        lambda: "apple-domain-verification=" + _token(rng, 16),
+        lambda: "atlassian-domain-verification=" + _token(rng, 64, string.ascii_letters + string.digits + "+/"),
+        lambda: "docusign=" + "-".join(_token(rng, n, hexdigits) for n in (8, 4, 4, 4, 12)),
+        lambda: "onetrust-domain-verification=" + _token(rng, 32, hexdigits),
+        lambda: "globalsign-smime-dv=" + _token(rng, 43, string.ascii_letters + string.digits + "+/") + "=",
+        lambda: "stripe-verification=" + _token(rng, 64, hexdigits),
+        lambda: _token(rng, rng.randint(16, 48)),
+    ]
+    return [rng.choice(choices)() for _ in range(rng.randint(1, 6))]
+
+
+def generate_zone(
+    count: int, seed: int = 0, nxdomain_rate: float = 0.1, max_depth: int = 3
+) -> Tuple[Zone, List[str]]:
+    """Generate domains with realistic TXT sets and SPF include chains
+
+    Args:
+        count (int): Number of registrable domains
+        seed (int): Random seed, the same seed gives the same zone
+        nxdomain_rate (float): Share of the domains left out of the zone
+        max_depth (int): Longest chain of same-site SPF includes
+
+    Returns:
+        Tuple[Zone, List[str]]: TXT values by lowercase name, and the input
+        domains, including those that do not exist
+    """
+    rng = random.Random(seed)
+    zone: Zone = {}
+    domains = []
+    for i in range(count):
+        domain = f"site{i}.{rng.choice(SUFFIXES)}"
+        domains.append(domain)
+        if rng.random() < nxdomain_rate:
+            continue
+        values = _verifications(rng)
+        if rng.random() < 0.8:
+            depth = rng.randint(0, max_depth)
+            chain = [f"_spf{level}.{domain}" for level in range(depth)]
+            includes = chain[:1] + rng.sample(THIRD_PARTY_SPF, rng.randint(0, 2))
+            values.append(" ".join(["v=spf1"] + [f"include:{name}" for name in includes] + ["~all"]))
+            for level, name in enumerate(chain):
+                nested = f" include:{chain[level + 1]}" if level + 1 < len(chain) else ""
+                ip = f"192.0.{rng.randint(0, 255)}.0/24"
+                zone[name] = [f"v=spf1 ip4:{ip}{nested} ~all"]
+        zone[domain] = values
+    return zone, domains
+
+
+class StubResolver:
+    """Builds responses from a zone
+
+    Args:
+        zone (Zone): TXT values by name
+        latency (float): Seconds added to every response
+        jitter (float): Random extra seconds, up to this value
+    """
+
+    def __init__(self, zone: Zone, latency: float = 0.0, jitter: float = 0.0) -> None:
+        self.zone = {name.lower(): values for name, values in zone.items()}
+        self.latency = latency
+        self.jitter = jitter
+        self.queries = 0
+
+    def respond(self, wire: bytes, udp: bool = False) -> Optional[bytes]:
+        """Answer a query in wire format, None when it cannot be parsed
+
+        UDP answers larger than 512 bytes, or than the EDNS payload size
+        of the query, are truncated.
+        """
+        try:
+            query = dns.message.from_wire(wire)
+        except dns.exception.DNSException:
+            return None
+        self.queries += 1
+        response = dns.message.make_response(query)
+        response.flags |= dns.flags.AA
+        question = query.question[0]
+        name = question.name.to_text(omit_final_dot=True).lower()
+        values = self.zone.get(name)
+        if values is None:
+            response.set_rcode(dns.rcode.NXDOMAIN)
+            response.authority.append(self._soa(question.name))
+        elif question.rdtype == dns.rdatatype.TXT:
+            rrset = dns.rrset.RRset(question.name, dns.rdataclass.IN, dns.rdatatype.TXT)
+            for value in values:
+                rrset.add(TXT(dns.rdataclass.IN, dns.rdatatype.TXT, [value.encode("utf-8")]), TTL)
+            response.answer.append(rrset)
+        else:
+            response.authority.append(self._soa(question.name))
+        max_size = 65535
+        if udp:
+            max_size = max(query.payload, 512) if query.edns >= 0 else 512
+        try:
+            return response.to_wire(max_size=max_size)
+        except dns.exception.TooBig:
+            truncated = dns.message.make_response(query)
+            truncated.flags |= dns.flags.AA | dns.flags.TC
+            return truncated.to_wire()
+
+    @staticmethod
+    def _soa(name: dns.name.Name) -> dns.rrset.RRset:
+        # Only the TTL and minimum matter to the negative caching of txtra
+        return dns.rrset.from_text(name, NEGATIVE_TTL, "IN", "SOA", SOA.format(ttl=NEGATIVE_TTL))
+
+    async def delay(self) -> None:
+        pause = self.latency + (random.random() * self.jitter if self.jitter else 0)
+        if pause:
+            await asyncio.sleep(pause)
+
+
+class _UdpProtocol(asyncio.DatagramProtocol):
+    def __init__(self, stub: StubResolver) -> None:
+        self.stub = stub
+        self.transport: Optional[asyncio.DatagramTransport] = None
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        if self.stub.latency or self.stub.jitter:
+            asyncio.ensure_future(self._reply_later(data, addr))
+            return
+        reply = self.stub.respond(data, udp=True)
+        if reply is not None:
+            self.transport.sendto(reply, addr)
+
+    async def _reply_later(self, data: bytes, addr) -> None:
+        await self.stub.delay()
+        reply = self.stub.respond(data, udp=True)
+        if reply is not None and not self.transport.is_closing():
+            self.transport.sendto(reply, addr)
+
+
+async def _handle_tcp(stub: StubResolver, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        while True:
+            header = await reader.readexactly(2)
+            data = await reader.readexactly(struct.unpack("!H", header)[0])
+            await stub.delay()
+            reply = stub.respond(data)
+            if reply is None:
+                break
+            writer.write(struct.pack("!H", len(reply)) + reply)
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(stub: StubResolver, port: int = 0, host: str = "127.0.0.1") -> int:
+    """Start the UDP and TCP listeners on the running loop
+
+    Args:
+        stub (StubResolver): Response builder
+        port (int): Port to bind, 0 for a free one
+        host (str): Address to bind
+
+    Returns:
+        int: Bound port, the same for UDP and TCP
+    """
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(lambda: _UdpProtocol(stub), local_addr=(host, port))
+    port = transport.get_extra_info("sockname")[1]
+    await asyncio.start_server(lambda r, w: _handle_tcp(stub, r, w), host, port)
+    return port
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--zone", help="JSON zone file ({name: [txt, ...]}) instead of a generated one")
+    p.add_argument("--domains", type=int, default=1000, help="Domains of the generated zone")
+    p.add_argument("--seed", type=int, default=0, help="Seed of the generated zone")
+    p.add_argument("--port", type=int, default=0, help="Port to listen on (default: a free one)")
+    p.add_argument("--latency-ms", type=float, default=0.0, help="Delay added to every response")
+    p.add_argument("--jitter-ms", type=float, default=0.0, help="Random extra delay, up to this value")
+    args = p.parse_args()
+
+    if args.zone:
+        with open(args.zone, encoding="utf-8") as f:
+            zone = json.load(f)
+    else:
+        zone, _ = generate_zone(args.domains, seed=args.seed)
+    stub = StubResolver(zone, latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000)
+
+    async def run() -> None:
+        port = await serve(stub, args.port)
+        print(port, flush=True)
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    print(f"{stub.queries} queries answered", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""Synthetic TXT corpus generator for txtra matcher benchmarks
+
+Positives are sampled from the regexes of the provider templates in
+txtra/provider/*.yml and checked to match their template. Negatives are
+realistic records no template should recognize: SPF, DKIM, DMARC, BIMI,
+MTA-STS and verification strings of unknown vendors.
+
+    python benchmarks/txt_corpus.py [-n 100000] [--positive-rate 0.3] [--seed 0] [-o corpus.jsonl]
+
+Each output line is {"value": ..., "template": name or null}.
+"""
+import argparse
+import json
+import random
+import re
+import re._parser as sre_parse
+import string
+import sys
+
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Printable characters without whitespace, the alphabet of "." and negated sets
+PRINTABLE = [chr(c) for c in range(33, 127)]
+# Extra repetitions drawn for an unbounded quantifier
+OPEN_REPEAT = 40
+ATTEMPTS = 20
+
+_CATEGORIES = {
+    sre_parse.CATEGORY_DIGIT: set(string.digits),
+    sre_parse.CATEGORY_NOT_DIGIT: set(PRINTABLE) - set(string.digits),
+    sre_parse.CATEGORY_WORD: set(string.ascii_letters + string.digits + "_"),
+    sre_parse.CATEGORY_NOT_WORD: set(PRINTABLE) - set(string.ascii_letters + string.digits + "_"),
+    sre_parse.CATEGORY_SPACE: {" "},
+    sre_parse.CATEGORY_NOT_SPACE: set(PRINTABLE),
+}
+
+
+class RegexSampler:
+    """Draw random strings matching a regular expression
+
+    Covers the syntax used by provider templates: literals, classes,
+    alternations, groups, backreferences and quantifiers. Anchors and
+    lookarounds are ignored, so samples must be checked against the
+    pattern.
+
+    Args:
+        rng (random.Random): Source of randomness
+    """
+
+    def __init__(self, rng: random.Random) -> None:
+        self.rng = rng
+
+    def sample(self, pattern: str) -> str:
+        groups: Dict[int, str] = {}
+        return self._emit(sre_parse.parse(pattern), groups)
+
+    def _emit(self, items, groups: Dict[int, str]) -> str:
+        out = []
+        for op, av in items:
+            out.append(self._node(op, av, groups))
+        return "".join(out)
+
+    def _node(self, op, av, groups: Dict[int, str]) -> str:
+        rng = self.rng
+        if op is sre_parse.LITERAL:
+            return chr(av)
+        if op is sre_parse.NOT_LITERAL:
+            return rng.choice([c for c in PRINTABLE if ord(c) != av])
+        if op is sre_parse.ANY:
+            return rng.choice(PRINTABLE)
+        if op is sre_parse.IN:
+            return rng.choice(self._charset(av))
+        if op is sre_parse.BRANCH:
+            return self._emit(rng.choice(av[1]), groups)
+        if op is sre_parse.SUBPATTERN:
+            group, _, _, items = av
+            text = self._emit(items, groups)
+            if group is not None:
+                groups[group] = text
+            return text
+        if op is sre_parse.ATOMIC_GROUP:
+            return self._emit(av, groups)
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, sre_parse.POSSESSIVE_REPEAT):
+            low, high, items = av
+            if high is sre_parse.MAXREPEAT:
+                high = low + OPEN_REPEAT
+            return "".join(self._emit(items, groups) for _ in range(rng.randint(low, high)))
+        if op is sre_parse.GROUPREF:
+            return groups.get(av, "")
+        # AT (anchors), ASSERT, ASSERT_NOT and anything else emit nothing
+        return ""
+
+    @staticmethod
+    def _charset(items) -> List[str]:
+        allowed: Set[str] = set()
+        negate = False
+        for op, av in items:
+            if op is sre_parse.NEGATE:
+                negate = True
+            elif op is sre_parse.LITERAL:
+                allowed.add(chr(av))
+            elif op is sre_parse.RANGE:
+                low, high = av
+                allowed.update(chr(c) for c in range(low, min(high, 0x7E) + 1))
+            elif op is sre_parse.CATEGORY:
+                allowed |= _CATEGORIES.get(av, set())
+        if negate:
+            allowed = set(PRINTABLE) - allowed
+        return sorted(allowed) or ["x"]
+
+
+def load_templates():
+    """Load the provider templates through the regular txtra loader"""
+    sys.path.insert(0, str(ROOT))
+    from txtra.__main__ import Txtra
+
+    return Txtra().templates
+
+
+def positive(template, sampler: RegexSampler) -> Optional[str]:
+    """Sample a value matching one of the patterns of a template, or None"""
+    patterns: Sequence[re.Pattern] = template.patterns
+    for _ in range(ATTEMPTS):
+        pattern = sampler.rng.choice(patterns)
+        value = sampler.sample(pattern.pattern)
+        if value and template.match(value):
+            return value
+    return None
+
+
+def negative(rng: random.Random) -> str:
+    """Build a realistic record that belongs to no provider"""
+    b64 = string.ascii_letters + string.digits + "+/"
+    word = lambda n: "".join(rng.choice(string.ascii_lowercase) for _ in range(n))
+    token = lambda n, alphabet=string.ascii_letters + string.digits: "".join(rng.choice(alphabet) for _ in range(n))
+    kind = rng.randrange(7)
+    if kind == 0:
+        mechanisms = [f"ip4:{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.0/24" for _ in range(rng.randint(0, 4))]
+        mechanisms += [f"include:_spf.{word(8)}.com" for _ in range(rng.randint(0, 3))]
+        return " ".join(["v=spf1", *mechanisms, rng.choice(["~all", "-all", "?all"])])
+    if kind == 1:
+        return f"v=DKIM1; k=rsa; p={token(rng.randint(180, 230), b64)}"
+    if kind == 2:
+        return f"v=DMARC1; p={rng.choice(['none', 'quarantine', 'reject'])}; rua=mailto:dmarc@{word(10)}.com; pct=100"
+    if kind == 3:
+        return f"v=BIMI1; l=https://{word(8)}.com/logo.svg; a="
+    if kind == 4:
+        return f"v=STSv1; id={rng.randint(10 ** 9, 10 ** 10)}"
+    if kind == 5:
+        return f"{word(rng.randint(4, 12))}-{rng.choice(['verification', 'site-verification', 'domain-verify'])}={token(rng.randint(16, 48))}"
+    return token(rng.randint(16, 64), b64)
+
+
+def generate(
+    templates, count: int, positive_rate: float = 0.3, seed: int = 0
+) -> Iterator[Tuple[str, Optional[str]]]:
+    """Generate a labelled corpus
+
+    Args:
+        templates (TemplateIndex): Provider templates
+        count (int): Number of records
+        positive_rate (float): Share of records sampled from the templates
+        seed (int): Random seed, the same seed gives the same corpus
+
+    Yields:
+        Tuple[str, Optional[str]]: Record value and the name of the template
+        it was sampled from, None for negatives
+    """
+    rng = random.Random(seed)
+    sampler = RegexSampler(rng)
+    regex_templates = [t for t in templates if t.patterns]
+    produced = 0
+    while produced < count:
+        if rng.random() < positive_rate:
+            template = rng.choice(regex_templates)
+            value = positive(template, sampler)
+            if value is None:
+                continue
+            yield value, template.name
+        else:
+            value = negative(rng)
+            if templates.matches(value):
+                # Accidentally recognized, not a negative
+                continue
+            yield value, None
+        produced += 1
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("-n", "--count", type=int, default=100_000, help="Number of records")
+    p.add_argument("--positive-rate", type=float, default=0.3, help="Share of records sampled from templates")
+    p.add_argument("--seed", type=int, default=0, help="Random seed")
+    p.add_argument("-o", "--output", default="-", help="Output file (default: standard output)")
+    args = p.parse_args()
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        for value, template in generate(load_templates(), args.count, args.positive_rate, args.seed):
+            out.write(json.dumps({"value": value, "template": template}) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,43 @@
 from txtra.__main__ import (
     Domain,
+    Template,
     Txtra,
     TxtRecord,
     TxtRecords,
-    get_etldp1
+    get_etldp1,
+    iter_domains,
 )
-
+from txtra import bundle
+from txtra.checkpoint import Checkpoint, CheckpointError
+from txtra.cache import ANSWER, NXDOMAIN, ResolutionCache, TxtCache
+from txtra.engine import AsyncTxtResolver, ScanEngine
+from txtra.output import CsvSink
+from txtra.ratelimit import AdaptiveRateLimiter, TokenBucket
+from txtra.upstream import TimeoutPolicy, UpstreamPool, parse_address, parse_resolvers
+from txtra.pipeline import Deduplicator, ScalableBloomFilter, normalize_domain, parse_shard, shard_of
+from txtra import workers
+from txtra.matcher import TemplateIndex, required_literal
+from txtra.suffix import default_trie, parse_rules
+
+import asyncio
+import csv
+import json
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
-from unittest.mock import MagicMock, patch
+from argparse import Namespace
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
+from dns import resolver
+import dns.message
+import dns.rrset
 
 txtra = Txtra()
 
@@ -23,6 +53,32 @@ class TestDomain(unittest.TestCase):
         self.assertEqual(get_etldp1("example.co.uk"), "example.co.uk")
         # Subdomain of public suffix
         self.assertEqual(get_etldp1("sub.example.co.uk"), "example.co.uk")
+        # Case and trailing dot
+        self.assertEqual(get_etldp1("Sub.Example.COM."), "example.com")
+        # Unknown suffix
+        self.assertEqual(get_etldp1("a.b.localhost"), "localhost")
+
+    def test_suffix_rules(self):
+        trie = parse_rules("\n".join([
+            "// VERSION: test",
+            "// ===BEGIN ICANN DOMAINS===",
+            "jp", "kawasaki.jp", "*.kawasaki.jp", "!city.kawasaki.jp", "ck", "*.ck", "!www.ck",
+            "// ===END ICANN DOMAINS===",
+            "// ===BEGIN PRIVATE DOMAINS===",
+            "blogspot.com",
+            "// ===END PRIVATE DOMAINS===",
+        ]))
+        self.assertEqual(trie.version, "test")
+        self.assertEqual(trie.registered_domain("a.b.kawasaki.jp"), "a.b.kawasaki.jp")
+        self.assertEqual(trie.registered_domain("x.city.kawasaki.jp"), "city.kawasaki.jp")
+        self.assertEqual(trie.registered_domain("a.www.ck"), "www.ck")
+        self.assertEqual(trie.registered_domain("foo.blogspot.com"), "com")
+        self.assertEqual(trie.registered_domain("192.0.2.1"), "192.0.2.1")
+
+    def test_bundled_suffix_list_is_offline(self):
+        with patch("socket.socket", side_effect=AssertionError("network access")):
+            self.assertTrue(default_trie().version)
+            self.assertEqual(default_trie().registered_domain("a.example.xn--p1ai"), "example.xn--p1ai")
 
 class TestApp(unittest.TestCase):
     def mock_resolve(self, test_domain, test_txt_value) -> TxtRecords:
@@ -30,8 +86,8 @@ class TestApp(unittest.TestCase):
         r = TxtRecords(domain=domain)
 
         return_value = [TxtRecord(value=test_txt_value)]
-        r.resolve = MagicMock(return_value=return_value)  # type: ignore
-        r.resolve()
+        with patch.object(TxtRecords, "resolve", return_value=return_value):
+            r.resolve()
         r.records = return_value
         return r
 
@@ -39,8 +95,8 @@ class TestApp(unittest.TestCase):
         domain = Domain("example.com")
         records = TxtRecords(domain=domain)
 
-        records.resolve = MagicMock(return_value=[TxtRecord(value="test")])
-        r = records.resolve()
+        with patch.object(TxtRecords, "resolve", return_value=[TxtRecord(value="test")]):
+            r = records.resolve()
 
         self.assertEqual(r[0].value, TxtRecord(value="test").value)
 
@@ -49,17 +105,17 @@ class TestApp(unittest.TestCase):
         records = TxtRecords(domain=domain)
 
         # メインドメインのSPFレコードをモック
-        records.resolve = MagicMock(return_value=[
+        with patch.object(TxtRecords, "resolve", return_value=[
             TxtRecord(value="v=spf1 include:_spf.example.com include:thirdparty.com ~all")
-        ])
-        records.records = records.resolve()
+        ]):
+            records.records = records.resolve()
 
         # インクルードされたドメインのSPFレコードをモック
         included_records = TxtRecords(Domain("_spf.example.com"))
-        included_records.resolve = MagicMock(return_value=[
+        with patch.object(TxtRecords, "resolve", return_value=[
             TxtRecord(value="v=spf1 ip4:192.0.2.1 ~all", source_domain="_spf.example.com")
-        ])
-        included_records.records = included_records.resolve()  # モックの戻り値をrecordsに設定
+        ]):
+            included_records.records = included_records.resolve()  # モックの戻り値をrecordsに設定
 
 
         # TxtRecordsの作成をパッチ
@@ -819,5 +875,1292 @@ class TestApp(unittest.TestCase):
                 self.assertEqual(records.domain.name, "example.com")
                 self.assertEqual(record.matches[0].template.name, "Zoom")
                 self.assertEqual(record.token, "test")
+
+
+class FakeTxtResolver:
+    """In-memory stand-in for AsyncTxtResolver"""
+
+    def __init__(self, zone):
+        self.zone = zone
+        self.queries = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def resolve(self, name):
+        self.queries.append(name)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0)
+            if name not in self.zone:
+                raise resolver.NXDOMAIN(qnames=[name])
+            return self.zone[name]
+        finally:
+            self.in_flight -= 1
+
+
+class TestEngine(unittest.TestCase):
+    zone = {
+        "example.com": ["v=spf1 include:_spf.example.com include:thirdparty.com ~all", "MS=ABC123"],
+        "_spf.example.com": ["v=spf1 ip4:192.0.2.1 ~all"],
+        "example.org": ["google-site-verification=test"],
+    }
+
+    def collect(self, engine, items, worker):
+        async def run():
+            return [entry async for entry in engine.run(items, worker)]
+        return asyncio.run(run())
+
+    def test_concurrency_limit(self):
+        fake = FakeTxtResolver({f"d{i}.example": ["x"] for i in range(50)})
+        engine = ScanEngine(concurrency=4, resolver=fake)
+        results = self.collect(engine, (f"d{i}.example" for i in range(50)), lambda d, r: r.resolve(d))
+        self.assertEqual(len(results), 50)
+        self.assertTrue(all(error is None for _, _, error in results))
+        self.assertLessEqual(fake.max_in_flight, 4)
+
+    def test_input_is_consumed_lazily(self):
+        fake = FakeTxtResolver({})
+        consumed = []
+
+        def endless():
+            i = 0
+            while True:
+                consumed.append(i)
+                yield f"d{i}.example"
+                i += 1
+
+        async def first_results():
+            results = []
+            async for entry in ScanEngine(concurrency=4, resolver=fake).run(endless(), lambda d, r: r.resolve(d)):
+                results.append(entry)
+                if len(results) == 10:
+                    break
+            return results
+
+        self.assertEqual(len(asyncio.run(first_results())), 10)
+        self.assertLess(len(consumed), 30)
+
+    def test_slow_input_does_not_block_the_loop(self):
+        fake = FakeTxtResolver({"d0.example": ["x"]})
+        received = threading.Event()
+        waited = []
+
+        def slow():
+            yield "d0.example"
+            # Blocks like a read from stdin until the first result is out
+            waited.append(received.wait(timeout=5))
+            yield "d1.example"
+
+        async def run():
+            results = []
+            async for item, _, error in ScanEngine(concurrency=2, resolver=fake).run(slow(), lambda d, r: r.resolve(d)):
+                results.append(item)
+                received.set()
+            return results
+
+        self.assertEqual(asyncio.run(run()), ["d0.example", "d1.example"])
+        self.assertEqual(waited, [True])
+
+    def test_input_errors_are_raised(self):
+        def broken():
+            yield "example.org"
+            raise ValueError("unreadable input")
+
+        engine = ScanEngine(concurrency=2, resolver=FakeTxtResolver(self.zone))
+        with self.assertRaises(ValueError):
+            self.collect(engine, broken(), lambda d, r: r.resolve(d))
+
+    def test_iter_domains(self):
+        def lines():
+            yield "example.com\n"
+            yield "   \n"
+            yield "https://example.org/path\n"
+            raise AssertionError("read past the requested lines")
+
+        domains = iter_domains(lines())
+        self.assertEqual(next(domains).name, "example.com")
+        self.assertEqual(next(domains).name, "example.org")
+
+    def test_errors_are_reported_per_item(self):
+        fake = FakeTxtResolver(self.zone)
+        engine = ScanEngine(concurrency=2, resolver=fake)
+        results = self.collect(engine, ["example.org", "missing.example"], lambda d, r: r.resolve(d))
+        errors = {item: error for item, _, error in results}
+        self.assertIsNone(errors["example.org"])
+        self.assertIsInstance(errors["missing.example"], resolver.NXDOMAIN)
+
+    def test_scan_async_follows_spf_includes(self):
+        fake = FakeTxtResolver(self.zone)
+        records = TxtRecords(Domain("example.com"))
+        asyncio.run(records.scan_async(txtra.templates, fake))
+        self.assertEqual(fake.queries, ["example.com", "_spf.example.com"])
+        self.assertEqual(
+            [(r.source_domain, r.value) for r in records],
+            [
+                ("example.com", "v=spf1 include:_spf.example.com include:thirdparty.com ~all"),
+                ("example.com", "MS=ABC123"),
+                ("_spf.example.com", "v=spf1 ip4:192.0.2.1 ~all"),
+            ],
+        )
+        self.assertEqual(len(records.records[1].matches), 1)
+
+    def test_csv_mode(self):
+        fake = FakeTxtResolver(self.zone)
+        args = Namespace(no_scan=False, concurrency=2)
+        domains = [Domain("example.com"), Domain("example.org"), Domain("missing.example")]
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch("txtra.engine.ScanEngine", lambda concurrency, resolver=None: ScanEngine(concurrency, resolver=fake)), \
+                patch("builtins.print"):
+            path = os.path.join(tmp, "output.csv")
+            txtra.csv_mode(args, domains, path=path)
+            with open(path, newline="", encoding="utf-8") as f:
+                rows = list(csv.reader(f))
+        self.assertEqual(rows[0], ["Domain", "Source Domain", "Template", "Token", "Value"])
+        self.assertEqual(len(rows), 5)
+        self.assertIn(["example.com", "example.com", "Microsoft Office 365", "ABC123", "MS=ABC123"], rows)
+        self.assertIn(["example.org", "example.org", "GMail", "test", "google-site-verification=test"], rows)
+
+    def test_jsonl_mode(self):
+        fake = FakeTxtResolver(self.zone)
+        args = Namespace(no_scan=False, concurrency=2, output=None)
+        domains = [Domain("example.com"), Domain("example.org"), Domain("missing.example")]
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch("txtra.engine.ScanEngine", lambda concurrency, resolver=None: ScanEngine(concurrency, resolver=fake)), \
+                patch("builtins.print"):
+            path = os.path.join(tmp, "output.jsonl")
+            txtra.jsonl_mode(args, domains, path=path)
+            with open(path, encoding="utf-8") as f:
+                lines = [json.loads(line) for line in f]
+        self.assertEqual(sorted(obj["domain"] for obj in lines), ["example.com", "example.org"])
+        obj = next(obj for obj in lines if obj["domain"] == "example.com")
+        self.assertEqual(len(obj["raw_records"]), 3)
+        self.assertEqual(obj["records"], [
+            {"source_domain": "example.com", "name": "Microsoft Office 365", "token": "ABC123", "value": "MS=ABC123"},
+        ])
+
+
+class TestMatcher(unittest.TestCase):
+    values = [
+        "v=spf1 include:_spf.google.com ~all",
+        "v=spf1 include:_spf.activegate-ss.jp ~all",
+        "google-site-verification=abc_DEF-123",
+        "MS=ms12345678",
+        "MS=E4A68B9AB2BB9670BCE15412F62916164C0B20BB",
+        "pardot_12345_*=abcdef",
+        "pardot1234=abcdef",
+        "webexdomainverification.ABC=1234-abcd",
+        "citrix.mobile.ads.otp=abc",
+        "foo.sendgrid.net",
+        "zoho-verification=abc.zmverify.zoho.com",
+        "k=rsa; p=MIGfMA0GCSqGSIb3DQEBAQUAA4GNADCBiQKBgQC",
+        "",
+    ]
+
+    def test_required_literal(self):
+        self.assertEqual(required_literal(re.compile("google-site-verification=(?P<token>[A-Za-z0-9._-]+)")), "google-site-verification=")
+        self.assertEqual(required_literal(re.compile("(?P<token>[a-z0-9.]+)\\.sendgrid\\.net")), ".sendgrid.net")
+        self.assertEqual(required_literal(re.compile("[mMsS]=ms(?P<token>[0-9.]+)")), "=ms")
+        self.assertEqual(required_literal(re.compile("abc{2}def")), "def")
+        self.assertEqual(required_literal(re.compile("ab?cd")), "cd")
+        self.assertEqual(required_literal(re.compile("abc|def")), "")
+        self.assertEqual(required_literal(re.compile("(?i)abc")), "")
+        self.assertEqual(required_literal(re.compile("abc", re.IGNORECASE)), "")
+        # Escapes are decoded, not read as literal text
+        for pattern in ("\\x41BC", "\\u0041BC", "\\U00000041BC", "\\N{LATIN CAPITAL LETTER A}BC", "\\101BC"):
+            self.assertEqual(required_literal(re.compile(pattern)), "ABC", pattern)
+        self.assertEqual(required_literal(re.compile("ab\\dcdef")), "cdef")
+        self.assertEqual(required_literal(re.compile("x(?i:abc)y")), "x")
+        escaped = Template("Escaped")
+        escaped.rule = {"type": "regex", "regex": ["\\x41BC=(?P<token>[0-9]+)"]}
+        escaped.patterns = escaped.compile()
+        self.assertEqual(len(TemplateIndex([escaped]).matches("ABC=123")), 1)
+
+    def test_index_matches_plain_templates(self):
+        self.assertIsInstance(txtra.templates, TemplateIndex)
+        plain = list(txtra.templates)
+        for value in self.values:
+            indexed = TxtRecord(value).scan(txtra.templates)
+            expected = TxtRecord(value).scan(plain)
+            self.assertEqual(
+                [(m.template.name, m.token) for m in indexed],
+                [(m.template.name, m.token) for m in expected],
+                value,
+            )
+
+
+class TestRecordLayout(unittest.TestCase):
+    def test_records_have_no_instance_dict(self):
+        record = TxtRecord("MS=ABC123", source_domain="example.com")
+        record.scan(txtra.templates)
+        self.assertFalse(hasattr(record, "__dict__"))
+        self.assertFalse(hasattr(record.matches[0], "__dict__"))
+        self.assertFalse(hasattr(TxtRecords(Domain("example.com")), "__dict__"))
+        self.assertEqual(record.token, "ABC123")
+        with self.assertRaises(AttributeError):
+            record.provider = "Microsoft Office 365"  # type: ignore
+
+    def test_repeated_strings_are_shared(self):
+        value = "v=spf1 include:_spf.google.com ~all"
+        first = TxtRecord("".join(value), source_domain="".join("a.example"))
+        second = TxtRecord("".join(value), source_domain="".join("a.example"))
+        self.assertIs(first.value, second.value)
+        self.assertIs(first.source_domain, second.source_domain)
+        self.assertIs(first.include_domains[0], second.include_domains[0])
+
+    def test_records_pickle(self):
+        import pickle
+
+        records = TxtRecords(Domain("example.com"))
+        records.records.append(TxtRecord("MS=ABC123", source_domain="example.com"))
+        records.records[0].scan(txtra.templates)
+        workers.detach([records])
+        restored = pickle.loads(pickle.dumps(records))
+        self.assertEqual(str(restored.domain), "example.com")
+        self.assertEqual(restored.records[0].matches[0].token, "ABC123")
+        self.assertEqual(restored.records[0].matches[0].template.name, "Microsoft Office 365")
+
+
+class TestScanMemo(unittest.TestCase):
+    def templates(self):
+        return Txtra.templates_from_bundle(Txtra.bundle_entries(txtra.templates))
+
+    def test_memo_matches_plain_index(self):
+        from txtra.matcher import ScanMemo
+        from txtra.stats import RunStats
+
+        templates = self.templates()
+        memo = ScanMemo()
+        memo.stats = RunStats()
+        templates.use_memo(memo)
+        values = TestMatcher.values * 3
+        for value in values:
+            memoized = TxtRecord(value).scan(templates)
+            expected = TxtRecord(value).scan(txtra.templates)
+            self.assertEqual(
+                [(m.template.name, m.token) for m in memoized],
+                [(m.template.name, m.token) for m in expected],
+                value,
+            )
+        distinct = len(set(values))
+        self.assertEqual((memo.misses, memo.hits), (distinct, len(values) - distinct))
+        self.assertEqual(memo.stats.counters["scan_memo_hits"], memo.hits)
+        self.assertAlmostEqual(memo.hit_rate, 2 / 3)
+
+    def test_memo_is_bounded_and_keyed_by_template_set(self):
+        from txtra.matcher import ScanMemo
+
+        memo = ScanMemo(maxsize=2)
+        for value in ("a", "b", "c"):
+            memo.put("set1", value, ())
+        self.assertEqual(len(memo), 2)
+        self.assertIsNone(memo.get("set1", "a"))
+        self.assertEqual(memo.get("set1", "c"), ())
+        self.assertIsNone(memo.get("set2", "c"))
+
+        templates = self.templates()
+        other = TemplateIndex(list(templates)[1:])
+        self.assertEqual(templates.fingerprint, self.templates().fingerprint)
+        self.assertNotEqual(templates.fingerprint, other.fingerprint)
+
+    def test_cli_options(self):
+        t = Txtra()
+        args = t.argparse_setup(["-d", "example.com", "--scan-memo-size", "10"])
+        t.open_scan_memo(args)
+        self.assertEqual(t.templates.memo.maxsize, 10)
+        t = Txtra()
+        t.open_scan_memo(t.argparse_setup(["-d", "example.com", "--no-scan-memo"]))
+        self.assertIsNone(t.templates.memo)
+
+    def test_templates_load_lazily(self):
+        t = Txtra()
+        t.open_scan_memo(t.argparse_setup(["-d", "example.com"]))
+        t.track_template_costs()
+        # Left to the first scan, inside the --profile region
+        self.assertIsNone(t._templates)
+        self.assertIsNotNone(t.templates.memo)
+        self.assertIsNotNone(next(iter(t.templates)).costs)
+
+
+class TestBundle(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+        self.provider_dir = self.tmp / "provider"
+        self.provider_dir.mkdir()
+        for path in Txtra.provider_paths()[:3]:
+            shutil.copy(path, self.provider_dir)
+        self.bundle_path = self.tmp / "bundle.json"
+        paths = lambda: sorted(self.provider_dir.glob("*.yml"))
+        for p in (
+            patch.object(Txtra, "provider_paths", staticmethod(paths)),
+            patch.dict(os.environ, {bundle.BUNDLE_ENV: str(self.bundle_path)}),
+        ):
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_bundle_is_written_and_reused(self):
+        templates = Txtra().templates
+        self.assertTrue(self.bundle_path.exists())
+        with patch.object(Template, "loads") as loads:
+            cached = Txtra().templates
+            loads.assert_not_called()
+        self.assertEqual([t.name for t in cached], [t.name for t in templates])
+        self.assertEqual(cached.literals(), templates.literals())
+
+    def test_bundle_is_invalidated_by_mtime(self):
+        Txtra().templates
+        path = sorted(self.provider_dir.glob("*.yml"))[0]
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+        with patch.object(Template, "loads", autospec=True, side_effect=Template.loads) as loads:
+            Txtra().templates
+            self.assertEqual(loads.call_count, 3)
+
+    def test_compile_templates(self):
+        out = self.tmp / "compiled.json"
+        self.assertEqual(Txtra.compile_templates(out), out)
+        digest = bundle.fingerprint(Txtra.provider_paths())
+        self.assertEqual(len(bundle.read_bundle(out, digest)), 3)
+        self.assertIsNone(bundle.read_bundle(out, "stale"))
+
+
+class TestStartup(unittest.TestCase):
+    heavy_modules = ["yaml", "tldextract", "dns", "colorama", "asyncio", "csv", "json"]
+
+    def loaded_modules(self, argv):
+        code = (
+            "import sys\n"
+            f"sys.argv = {argv!r}\n"
+            "import txtra.__main__ as m\n"
+            "try:\n"
+            "    m.main()\n"
+            "except SystemExit:\n"
+            "    pass\n"
+            f"print([n for n in {self.heavy_modules!r} if n in sys.modules])\n"
+        )
+        proc = subprocess.run(
+            [sys.executable, "-c", code],
+            capture_output=True,
+            text=True,
+            cwd=Path(__file__).resolve().parent.parent,
+            check=True,
+        )
+        return proc.stdout.strip().splitlines()[-1]
+
+    def test_help_does_not_import_heavy_modules(self):
+        self.assertEqual(self.loaded_modules(["txtra", "-h"]), "[]")
+
+    def test_argument_error_does_not_import_heavy_modules(self):
+        self.assertEqual(self.loaded_modules(["txtra", "--concurrency", "0"]), "[]")
+
+    def test_templates_are_loaded_lazily(self):
+        t = Txtra()
+        self.assertIsNone(t._templates)
+        self.assertIs(t.templates, t.templates)
+
+
+class FakeAnswer:
+    """Minimal dns.resolver.Answer stand-in"""
+
+    def __init__(self, name, ttl, values):
+        self.rrset = dns.rrset.from_text(name, ttl, "IN", "TXT", *[f'"{v}"' for v in values])
+
+    def __iter__(self):
+        return iter(self.rrset)
+
+
+def nxdomain_with_soa(name, ttl, minimum):
+    response = dns.message.make_response(dns.message.make_query(name, "TXT"))
+    response.authority.append(dns.rrset.from_text(
+        "example.", ttl, "IN", "SOA", f"ns.example. admin.example. 1 7200 3600 1209600 {minimum}"
+    ))
+    return resolver.NXDOMAIN(qnames=[dns.name.from_text(name)], responses={dns.name.from_text(name): response})
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "cache", "txt.sqlite3")
+
+    def test_entries_expire_with_ttl(self):
+        cache = TxtCache(self.path)
+        cache.put("Example.COM.", ANSWER, ["a", ""], ttl=60)
+        cache.put("expired.example", ANSWER, ["b"], ttl=-10)
+        self.assertEqual(cache.get("example.com").values, ["a", ""])
+        self.assertIsNone(cache.get("expired.example"))
+        cache.close()
+
+        stale = TxtCache(self.path, max_stale=60)
+        self.assertEqual(stale.get("expired.example").values, ["b"])
+        stale.close()
+
+        refresh = TxtCache(self.path, refresh=True)
+        self.assertIsNone(refresh.get("example.com"))
+        refresh.close()
+
+    def test_caches_share_a_database(self):
+        first, second = TxtCache(self.path), TxtCache(self.path)
+        self.addCleanup(first.close)
+        self.addCleanup(second.close)
+        start = time.monotonic()
+        for i in range(50):
+            first.put(f"a{i}.example", ANSWER, [f"a{i}"], ttl=60)
+            second.put(f"b{i}.example", NXDOMAIN, [], ttl=60)
+        # Every put commits, so neither connection waits on the other
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(second.get("a49.example").values, ["a49"])
+        self.assertEqual(first.get("b49.example").kind, NXDOMAIN)
+        self.assertEqual(first.errors + second.errors, 0)
+
+    def test_locked_database_drops_writes(self):
+        cache = TxtCache(self.path, timeout=0.05)
+        self.addCleanup(cache.close)
+        cache.put("example.com", ANSWER, ["a"], ttl=60)
+        other = sqlite3.connect(self.path)
+        self.addCleanup(other.close)
+        other.execute("BEGIN EXCLUSIVE")
+        cache.put("example.org", ANSWER, ["b"], ttl=60)
+        self.assertEqual(cache.errors, 1)
+        # WAL readers are not blocked by the writer
+        self.assertEqual(cache.get("example.com").values, ["a"])
+        other.rollback()
+        self.assertIsNone(cache.get("example.org"))
+
+    def test_resolver_serves_cached_answers(self):
+        cache = TxtCache(self.path)
+        self.addCleanup(cache.close)
+        txt_resolver = AsyncTxtResolver(cache=cache, shared=ResolutionCache(maxsize=0))
+
+        async def fake_resolve(name, rdtype):
+            if name == "example.com":
+                return FakeAnswer(name, 300, ["v=spf1 -all"])
+            raise nxdomain_with_soa(name, 3600, 120)
+
+        with patch.object(txt_resolver.resolver, "resolve", side_effect=fake_resolve) as resolve:
+            for _ in range(2):
+                self.assertEqual(asyncio.run(txt_resolver.resolve("example.com")), ["v=spf1 -all"])
+                with self.assertRaises(resolver.NXDOMAIN):
+                    asyncio.run(txt_resolver.resolve("missing.example"))
+            self.assertEqual(resolve.call_count, 2)
+
+        entry = cache.get("missing.example")
+        self.assertEqual(entry.kind, NXDOMAIN)
+        self.assertAlmostEqual(entry.expires - time.time(), 120, delta=5)
+
+    def test_resolver_reads_cache_off_the_loop(self):
+        cache = TxtCache(self.path)
+        self.addCleanup(cache.close)
+        cache.put("missing.example", NXDOMAIN, [], ttl=30)
+        shared = ResolutionCache()
+        txt_resolver = AsyncTxtResolver(cache=cache, shared=shared)
+        threads = []
+        get = cache.get
+
+        def tracked_get(name):
+            threads.append(threading.current_thread())
+            return get(name)
+
+        with patch.object(cache, "get", tracked_get):
+            with self.assertRaises(resolver.NXDOMAIN):
+                asyncio.run(txt_resolver.resolve("missing.example"))
+        self.assertNotIn(threading.main_thread(), threads)
+        # The run-wide cache keeps the remaining TTL, not the default negative one
+        expires, kind = shared._entries["missing.example"]
+        self.assertEqual(kind, NXDOMAIN)
+        self.assertAlmostEqual(expires - time.monotonic(), 30, delta=5)
+
+
+class TestRateLimit(unittest.TestCase):
+    def test_token_bucket_paces_queries(self):
+        async def run():
+            bucket = TokenBucket(100, burst=1)
+            start = time.monotonic()
+            for _ in range(21):
+                await bucket.acquire()
+            return time.monotonic() - start
+        self.assertGreaterEqual(asyncio.run(run()), 0.19)
+
+    def test_backoff_and_recovery(self):
+        clock = [0.0]
+        samples = []
+        with patch("txtra.ratelimit.time.monotonic", lambda: clock[0]):
+            limiter = AdaptiveRateLimiter(100, on_sample=samples.append)
+            for ok in [True] * 5 + [False] * 5:
+                limiter.record(ok)
+            clock[0] += 1
+            limiter.record(True)
+            self.assertEqual(limiter.rate, 50)
+            self.assertEqual(samples[-1][2:], (0, 5, 5))
+            for _ in range(3):
+                clock[0] += 1
+                limiter.record(True)
+            self.assertEqual(limiter.rate, 80)
+        self.assertEqual((limiter.succeeded, limiter.failed), (9, 5))
+
+    def test_resolver_reports_failures(self):
+        limiter = AdaptiveRateLimiter(1000)
+        txt_resolver = AsyncTxtResolver(shared=ResolutionCache(), limiter=limiter)
+        txt_resolver.resolver = MagicMock()
+        txt_resolver.resolver.resolve = MagicMock(side_effect=resolver.NoNameservers())
+        with self.assertRaises(resolver.NoNameservers):
+            asyncio.run(txt_resolver.resolve("servfail.example"))
+        txt_resolver.resolver.resolve = MagicMock(side_effect=resolver.NXDOMAIN(qnames=["nx.example"]))
+        with self.assertRaises(resolver.NXDOMAIN):
+            asyncio.run(txt_resolver.resolve("nx.example"))
+        self.assertEqual((limiter.issued, limiter.succeeded, limiter.failed), (2, 1, 1))
+
+
+class TestUpstream(unittest.TestCase):
+    def test_parse_address(self):
+        self.assertEqual(parse_address("192.0.2.1"), ("192.0.2.1", 53))
+        self.assertEqual(parse_address("192.0.2.1:5353"), ("192.0.2.1", 5353))
+        self.assertEqual(parse_address("192.0.2.1#5353"), ("192.0.2.1", 5353))
+        self.assertEqual(parse_address("2001:db8::1"), ("2001:db8::1", 53))
+        self.assertEqual(parse_address("[2001:db8::1]:5353"), ("2001:db8::1", 5353))
+        self.assertEqual(parse_resolvers(["# fleet", "", "192.0.2.1", " 192.0.2.2:53 "]), [("192.0.2.1", 53), ("192.0.2.2", 53)])
+        for value in ("resolver.example", "192.0.2.1:0", "[2001:db8::1]x"):
+            with self.assertRaises(ValueError):
+                parse_address(value)
+
+    def test_least_outstanding(self):
+        pool = UpstreamPool([("192.0.2.1", 53), ("192.0.2.2", 53)])
+        pool.upstreams[0].outstanding = 3
+        self.assertIs(pool.pick(), pool.upstreams[1])
+        self.assertIs(pool.pick(exclude={pool.upstreams[1]}), pool.upstreams[0])
+
+    def test_timeouts_eject_and_probe(self):
+        pool = UpstreamPool([("192.0.2.1", 53), ("192.0.2.2", 53)])
+        bad, good = pool.upstreams
+        bad.resolver.resolve = MagicMock(side_effect=resolver.LifetimeTimeout(timeout=2.0, errors=[]))
+        good.resolver.resolve = AsyncMock(return_value="answer")
+        with patch("builtins.print"):
+            for _ in range(3):
+                self.assertEqual(asyncio.run(pool.resolve("example.com")), "answer")
+            for _ in range(3):
+                bad.timed_out(2.0, time.monotonic())
+            self.assertFalse(bad.available(time.monotonic()))
+            self.assertEqual({pool.pick() for _ in range(20)}, {good})
+
+            # Once the ejection ends, a single probe is let through
+            bad.ejected_until = time.monotonic() - 1
+            bad.resolver.resolve = AsyncMock(return_value="answer")
+            good.outstanding = 1
+            self.assertIs(pool.pick(), bad)
+            asyncio.run(pool.resolve("example.com"))
+        self.assertEqual(bad.ejected_until, 0)
+
+    def test_adaptive_timeout(self):
+        pool = UpstreamPool([("192.0.2.1", 53)], policy=TimeoutPolicy(minimum=0.1, maximum=3.0, factor=2.0))
+        upstream = pool.upstreams[0]
+        self.assertEqual(upstream.timeout(), 3.0)
+        for i in range(100):
+            upstream.observe(0.01 + i * 0.001)
+        self.assertAlmostEqual(upstream.timeout(), 0.218)
+        # Old samples leave the window
+        for _ in range(600):
+            upstream.observe(0.001)
+        self.assertEqual(upstream.timeout(), 0.1)
+
+    def test_system_resolver_fallback(self):
+        system = resolver.Resolver(configure=False)
+        system.nameservers = ["192.0.2.1", "192.0.2.2"]
+        system.nameserver_ports = {"192.0.2.2": 5353}
+        system.port = 5300
+        args = Txtra().argparse_setup(["-d", "example.com"])
+        with patch("txtra.upstream.resolver.Resolver", return_value=system):
+            pool = Txtra().open_upstreams(args)
+        self.assertEqual([u.address for u in pool.upstreams], [("192.0.2.1", 5300), ("192.0.2.2", 5353)])
+        # A lookup keeps dnspython's lifetime rather than two full attempts
+        self.assertEqual(pool.lifetime, 5.0)
+        self.assertIsNone(Txtra().open_upstreams(Namespace(resolvers=[("192.0.2.1", 53)])).lifetime)
+
+    def test_lookups_are_bound_by_the_lifetime(self):
+        pool = UpstreamPool([("192.0.2.1", 53), ("192.0.2.2", 53)], policy=TimeoutPolicy(maximum=3.0), lifetime=0.2)
+
+        async def silent(name, rdtype, lifetime):
+            await asyncio.sleep(lifetime)
+            raise resolver.LifetimeTimeout(timeout=lifetime, errors=[])
+        for upstream in pool.upstreams:
+            upstream.resolver.resolve = silent
+
+        start = time.monotonic()
+        with self.assertRaises(resolver.LifetimeTimeout):
+            asyncio.run(pool.resolve("example.com"))
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(sum(u.outstanding for u in pool.upstreams), 0)
+
+    def test_slow_queries_are_hedged(self):
+        pool = UpstreamPool([("192.0.2.1", 53), ("192.0.2.2", 53)], policy=TimeoutPolicy(minimum=0.01))
+        slow, fast = pool.upstreams
+        for _ in range(50):
+            slow.observe(0.02)
+
+        async def slow_answer(name, rdtype, lifetime):
+            await asyncio.sleep(1)
+            return "slow"
+        slow.resolver.resolve = slow_answer
+        fast.resolver.resolve = AsyncMock(return_value="fast")
+        fast.outstanding = 1
+
+        start = time.monotonic()
+        self.assertEqual(asyncio.run(pool.resolve("example.com")), "fast")
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(pool.hedged, 1)
+
+
+class TestResolutionCache(unittest.TestCase):
+    def test_concurrent_lookups_are_coalesced(self):
+        shared = ResolutionCache()
+        txt_resolver = AsyncTxtResolver(shared=shared)
+
+        async def fake_resolve(name, rdtype):
+            await asyncio.sleep(0.01)
+            if name == "_spf.corp.example":
+                return FakeAnswer(name, 300, ["v=spf1 ip4:192.0.2.0/24 -all"])
+            raise nxdomain_with_soa(name, 300, 60)
+
+        async def run():
+            names = ["_spf.corp.example"] * 20 + ["missing.example"] * 5
+            return await asyncio.gather(*(txt_resolver.resolve(n) for n in names), return_exceptions=True)
+
+        with patch.object(txt_resolver.resolver, "resolve", side_effect=fake_resolve) as resolve:
+            results = asyncio.run(run())
+            self.assertEqual(resolve.call_count, 2)
+            self.assertEqual(results[0], ["v=spf1 ip4:192.0.2.0/24 -all"])
+            self.assertTrue(all(isinstance(r, resolver.NXDOMAIN) for r in results[20:]))
+            self.assertEqual(shared.coalesced, 23)
+
+            # Answers and negative answers stay cached for the rest of the run
+            asyncio.run(txt_resolver.resolve("_SPF.corp.example."))
+            with self.assertRaises(resolver.NXDOMAIN):
+                asyncio.run(txt_resolver.resolve("missing.example"))
+            self.assertEqual(resolve.call_count, 2)
+
+    def test_sync_resolve_uses_shared_cache(self):
+        with patch("txtra.cache._shared", ResolutionCache()), \
+                patch("dns.resolver.resolve", return_value=FakeAnswer("corp.example", 300, ["MS=ABC"])) as resolve:
+            for _ in range(3):
+                records = TxtRecords(Domain("corp.example")).resolve()
+                self.assertEqual([r.value for r in records], ["MS=ABC"])
+            self.assertEqual(resolve.call_count, 1)
+
+    def test_negative_answers_are_cached_compactly(self):
+        shared = ResolutionCache()
+        lookup = MagicMock(side_effect=nxdomain_with_soa("missing.example", 300, 60))
+        errors = []
+        for _ in range(3):
+            with self.assertRaises(resolver.NXDOMAIN) as raised:
+                shared.resolve_sync("missing.example", lookup)
+            errors.append(raised.exception)
+        self.assertEqual(lookup.call_count, 1)
+        # Only the kind is kept, each replay raises a fresh exception
+        self.assertEqual(shared._entries["missing.example"][1], NXDOMAIN)
+        self.assertIsNot(errors[1], errors[2])
+        self.assertEqual(errors[2].responses(), {})
+
+    def test_timeouts_are_not_cached(self):
+        shared = ResolutionCache()
+        lookup = MagicMock(side_effect=resolver.LifetimeTimeout(timeout=1.0, errors=[]))
+        for _ in range(2):
+            with self.assertRaises(resolver.LifetimeTimeout):
+                shared.resolve_sync("slow.example", lookup)
+        self.assertEqual(lookup.call_count, 2)
+
+
+class TestOutput(unittest.TestCase):
+    def records(self, domain, values):
+        records = TxtRecords(Domain(domain))
+        records.records = [TxtRecord(v, source_domain=domain) for v in values]
+        records.scan(txtra.templates)
+        return records
+
+    def read_csv(self, path):
+        with open(path, newline="", encoding="utf-8") as f:
+            return list(csv.reader(f))
+
+    def test_csv_sink_buffers_until_flush(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "out.csv")
+            sink = CsvSink(path, flush_size=1 << 20, flush_interval=3600)
+            sink.write(self.records("example.com", ["MS=ABC", "v=spf1 -all"]), no_scan=False)
+            self.assertEqual(os.path.getsize(path), 0)
+            sink.close()
+            self.assertEqual(self.read_csv(path), [
+                ["Domain", "Source Domain", "Template", "Token", "Value"],
+                ["example.com", "example.com", "Microsoft Office 365", "ABC", "MS=ABC"],
+                ["example.com", "example.com", "", "", "v=spf1 -all"],
+            ])
+
+    def test_csv_sink_flushes_by_size(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "out.csv")
+            with CsvSink(path, flush_size=1, flush_interval=3600) as sink:
+                sink.write(self.records("example.com", ["MS=ABC"]), no_scan=True)
+                self.assertEqual(self.read_csv(path)[1], ["example.com", "", "", "", "MS=ABC"])
+
+    def test_idle_sink_is_flushed_by_the_run(self):
+        from txtra.output import JsonlSink
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "out.jsonl")
+            sizes = []
+
+            class SlowResolver(FakeTxtResolver):
+                async def resolve(self, name):
+                    if name == "slow.example":
+                        # The first domain is done, its line must reach the file meanwhile
+                        await asyncio.sleep(0.5)
+                        sizes.append(os.path.getsize(path))
+                    return await super().resolve(name)
+
+            fake = SlowResolver({"fast.example": ["MS=ABC"], "slow.example": ["MS=DEF"]})
+            args = Namespace(no_scan=False, concurrency=2)
+            with JsonlSink(path, flush_size=1 << 20, flush_interval=0.1) as sink, \
+                    patch("txtra.engine.ScanEngine", lambda concurrency, resolver=None: ScanEngine(concurrency, resolver=fake)):
+                Txtra().run(
+                    args,
+                    [Domain("fast.example"), Domain("slow.example")],
+                    lambda records: sink.write(records, False),
+                    tick=sink.maybe_flush,
+                )
+            self.assertGreater(sizes[0], 0)
+
+    def test_csv_sink_to_stdout(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "stdout")
+            with open(path, "w", encoding="utf-8") as stdout, patch("sys.stdout", stdout):
+                with CsvSink("-") as sink:
+                    sink.write(self.records("example.com", ["MS=ABC"]), no_scan=False)
+                self.assertFalse(stdout.closed)
+            self.assertEqual(len(self.read_csv(path)), 2)
+
+
+class TestWorkers(unittest.TestCase):
+    zone = {f"d{i}.example": [f"MS=D{i}"] for i in range(40)}
+
+    def run_pool(self, order):
+        from concurrent.futures import ThreadPoolExecutor
+
+        fake = FakeTxtResolver(self.zone)
+        args = Namespace(no_scan=False, concurrency=4, workers=3, order=order)
+        domains = [Domain(f"d{i}.example") for i in range(40)] + [Domain("missing.example")]
+        seen, errors = [], []
+        with ThreadPoolExecutor(3, initializer=workers.init_worker, initargs=(workers.worker_args(args),)) as pool, \
+                patch.object(workers, "BATCH_SIZE", 4), \
+                patch("txtra.engine.ScanEngine", lambda concurrency, resolver=None: ScanEngine(concurrency, resolver=fake)), \
+                patch("builtins.print"):
+            checked = workers.run_pool(args, iter(domains), seen.append, errors.append, executor=pool)
+        self.assertEqual(len(errors), 1)
+        self.assertIn("missing.example", errors[0])
+        return checked, seen
+
+    def test_input_order(self):
+        checked, seen = self.run_pool("input")
+        self.assertEqual(checked, 41)
+        self.assertEqual([str(records.domain) for records in seen], [f"d{i}.example" for i in range(40)])
+        self.assertEqual(seen[7].records[0].matches[0].token, "D7")
+
+    def test_completion_order(self):
+        checked, seen = self.run_pool("completion")
+        self.assertEqual(checked, 41)
+        self.assertEqual(sorted(str(records.domain) for records in seen), sorted(self.zone))
+
+    def test_tick_while_waiting_on_workers(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        def slow_batch(batch):
+            time.sleep(0.6)
+            return len(batch), [], [], None
+
+        ticks = []
+        args = Namespace(no_scan=False, concurrency=4, workers=1, order="input")
+        with ThreadPoolExecutor(1) as pool, patch.object(workers, "scan_batch", slow_batch):
+            checked = workers.run_pool(
+                args, iter([Domain("a.example")]), print, print, executor=pool, tick=lambda: ticks.append(1)
+            )
+        self.assertEqual(checked, 1)
+        self.assertGreaterEqual(len(ticks), 1)
+
+    def scan_batches(self, args, count=2):
+        """Run batches in this process as a worker would, returning its Txtra after each"""
+        fake = FakeTxtResolver(self.zone)
+        states = []
+        with patch("txtra.engine.ScanEngine", lambda concurrency, resolver=None: ScanEngine(concurrency, resolver=fake)):
+            workers.init_worker(workers.worker_args(args))
+            for i in range(count):
+                workers.scan_batch([Domain(f"d{i}.example")])
+                states.append((workers._txtra.limiter, workers._txtra._qps_log))
+        return states
+
+    def test_limiter_is_kept_across_batches(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "qps.jsonl")
+            args = Namespace(no_scan=True, concurrency=2, workers=2, qps=100.0, qps_log=path)
+            states = self.scan_batches(args)
+            (limiter, log), (same_limiter, same_log) = states
+            self.assertIsNotNone(limiter)
+            self.assertIs(same_limiter, limiter)
+            self.assertIs(same_log, log)
+            self.assertFalse(log.closed)
+            workers._txtra.close_session()
+            self.assertTrue(log.closed)
+
+    def test_cache_is_opened_once_per_worker(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            args = Namespace(no_scan=True, concurrency=2, workers=2, cache=os.path.join(tmp, "txt.sqlite3"))
+            workers.init_worker(workers.worker_args(args))
+            cache = workers._txtra.cache
+            with patch("txtra.engine.ScanEngine", lambda concurrency, resolver=None: ScanEngine(concurrency, resolver=FakeTxtResolver(self.zone))):
+                for i in range(2):
+                    workers.scan_batch([Domain(f"d{i}.example")])
+                    self.assertIs(workers._txtra.cache, cache)
+            workers._txtra.close_session()
+            self.assertIsNone(workers._txtra.cache)
+
+    def test_upstream_health_is_kept_across_batches(self):
+        from txtra.upstream import EJECT_AFTER
+
+        class Answer(list):
+            rrset = Namespace(ttl=60)
+
+        args = Namespace(no_scan=True, concurrency=1, workers=2, resolvers=[("192.0.2.1", 53), ("192.0.2.2", 53)])
+        workers.init_worker(workers.worker_args(args))
+        pool = workers._txtra.upstreams
+        bad, good = pool.upstreams
+        bad.resolver.resolve = MagicMock(side_effect=resolver.LifetimeTimeout(timeout=2.0, errors=[]))
+        good.resolver.resolve = AsyncMock(return_value=Answer([Namespace(strings=[b"MS=X"])]))
+        # Ties go to the first nameserver, so the bad one is tried until it is ejected
+        with patch("builtins.print"), patch("txtra.upstream.random.choice", lambda candidates: candidates[0]):
+            for i in range(6):
+                checked, results, errors, _ = workers.scan_batch(
+                    [Domain(f"health{i}-{j}.example") for j in range(2)]
+                )
+                self.assertEqual((checked, len(results), errors), (2, 2, []))
+        # Ejected during the first batches and left alone by the later ones
+        self.assertIs(workers._txtra.upstreams, pool)
+        self.assertEqual(bad.resolver.resolve.call_count, EJECT_AFTER)
+        self.assertFalse(bad.available(time.monotonic()))
+
+    def test_adaptive_timeouts_learn_across_batches(self):
+        from txtra.upstream import RTT_MIN_SAMPLES
+
+        class Answer(list):
+            rrset = Namespace(ttl=60)
+
+        args = Namespace(
+            no_scan=True, concurrency=2, workers=2, resolvers=[("192.0.2.1", 53)], timeout_max=3.0, no_hedge=True
+        )
+        workers.init_worker(workers.worker_args(args))
+        upstream = workers._txtra.upstreams.upstreams[0]
+        upstream.resolver.resolve = AsyncMock(return_value=Answer([Namespace(strings=[b"MS=X"])]))
+        self.assertEqual(upstream.timeout(), 3.0)
+        size = RTT_MIN_SAMPLES // 2
+        for i in range(3):
+            workers.scan_batch([Domain(f"rtt{i}-{j}.example") for j in range(size)])
+        # No batch has enough samples alone, together they set the timeout
+        self.assertLess(upstream.timeout(), 3.0)
+
+    def test_results_are_detached_from_templates(self):
+        records = TxtRecords(Domain("example.com"))
+        records.records.append(TxtRecord("MS=ABC123", source_domain="example.com"))
+        records.records[0].scan(txtra.templates)
+        template = records.records[0].matches[0].template
+        workers.detach([records])
+        stub = records.records[0].matches[0].template
+        self.assertEqual(stub.name, template.name)
+        self.assertEqual(stub.patterns, [])
+
+
+class TestPipeline(unittest.TestCase):
+    def test_normalize_domain(self):
+        self.assertEqual(normalize_domain("  Example.COM.\n"), "example.com")
+        self.assertEqual(normalize_domain("HTTPS://Foo.Example:8443/path"), "foo.example")
+        self.assertEqual(normalize_domain("ftp://bar.example"), "bar.example")
+        self.assertEqual(normalize_domain("//baz.example/"), "baz.example")
+        self.assertEqual(normalize_domain("bücher.de"), "xn--bcher-kva.de")
+        self.assertIsNone(normalize_domain(" \t"))
+        self.assertIsNone(normalize_domain("."))
+
+    def test_normalize_domain_keeps_deviation_characters(self):
+        # IDNA 2003 would map these to strasse.de and the σ spelling
+        self.assertEqual(normalize_domain("Straße.de"), "xn--strae-oqa.de")
+        self.assertEqual(normalize_domain("https://www.straße.de/"), "www.xn--strae-oqa.de")
+        self.assertEqual(normalize_domain("σοφός.gr"), "xn--0xagbn4a.gr")
+        self.assertEqual(normalize_domain("münchen-straße.example"), "xn--mnchen-strae-v9a90b.example")
+
+    def test_exact_deduplication(self):
+        dedup = Deduplicator()
+        lines = ["example.com", "EXAMPLE.com.", "https://example.com/", "", "example.org", "example.org"]
+        self.assertEqual([d.name for d in iter_domains(lines, dedup)], ["example.com", "example.org"])
+        self.assertEqual(dedup.dropped, 3)
+        self.assertIsNone(dedup.bloom)
+
+    def test_switches_to_bloom_filter(self):
+        dedup = Deduplicator(exact_limit=100, fp_rate=0.01)
+        names = [f"d{i}.example" for i in range(5000)]
+        kept = list(dedup.unique(names))
+        self.assertIsNotNone(dedup.bloom)
+        self.assertIsNone(dedup.seen)
+        self.assertGreater(len(kept), 5000 * 0.98)
+        self.assertEqual(list(dedup.unique(names)), [])
+
+    def test_scalable_bloom_filter_bound(self):
+        bloom = ScalableBloomFilter(1000, 0.01)
+        false_positives = sum(not bloom.add(f"n{i}") for i in range(20000))
+        self.assertGreater(len(bloom.filters), 1)
+        self.assertLess(false_positives / 20000, 0.01)
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.journal = os.path.join(self.tmp, "run.checkpoint")
+        self.output = os.path.join(self.tmp, "output.csv")
+
+    def records(self, name):
+        records = TxtRecords(Domain(name))
+        records.records.append(TxtRecord(f"v={name}", source_domain=name))
+        return records
+
+    def test_resume_after_crash(self):
+        checkpoint = Checkpoint(self.journal, self.output)
+        sink = CsvSink(self.output, flush_size=1, checkpoint=checkpoint)
+        sink.write(self.records("a.example"), no_scan=True)
+        # b.example reaches the output but the run dies before committing it
+        sink.flush_size = sink.flush_interval = 10 ** 9
+        sink.write(self.records("b.example"), no_scan=True)
+        sink.file.close()
+        checkpoint.close()
+
+        checkpoint = Checkpoint(self.journal, self.output, resume=True)
+        self.assertEqual(checkpoint.done, {"a.example"})
+        domains = [Domain(name) for name in ("a.example", "b.example", "c.example")]
+        with CsvSink(self.output, checkpoint=checkpoint) as sink:
+            for domain in checkpoint.pending(domains):
+                sink.write(self.records(domain.name), no_scan=True)
+        checkpoint.close()
+        self.assertEqual(checkpoint.skipped, 1)
+
+        with open(self.output, newline="", encoding="utf-8") as f:
+            rows = list(csv.reader(f))
+        self.assertEqual([row[0] for row in rows], ["Domain", "a.example", "b.example", "c.example"])
+        checkpoint = Checkpoint(self.journal, self.output, resume=True)
+        checkpoint.close()
+        self.assertEqual(checkpoint.done, {"a.example", "b.example", "c.example"})
+
+    def test_checkpoint_of_another_output(self):
+        Checkpoint(self.journal, self.output).close()
+        with self.assertRaises(CheckpointError):
+            Checkpoint(self.journal, os.path.join(self.tmp, "other.csv"), resume=True)
+
+
+class TestShard(unittest.TestCase):
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard("2/8"), (2, 8))
+        for value in ("0/4", "5/4", "2", "a/b"):
+            with self.assertRaises(ValueError):
+                parse_shard(value)
+
+    def test_shards_partition_the_input(self):
+        lines = [f"Host{i}.Example." for i in range(1000)]
+        shards = [[d.name for d in iter_domains(lines, shard=parse_shard(f"{i}/4"))] for i in range(1, 5)]
+        self.assertEqual(sorted(sum(shards, [])), sorted(f"host{i}.example" for i in range(1000)))
+        self.assertTrue(all(150 < len(names) < 350 for names in shards))
+        # Stable across processes and Python versions
+        self.assertEqual(shard_of("example.com", 1000), 710)
+
+    def test_merge_csv(self):
+        from txtra.__main__ import merge_command
+
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for i, domain in enumerate(["example.com", "example.org"]):
+                paths.append(os.path.join(tmp, f"shard{i}.csv"))
+                with open(paths[-1], "w", newline="", encoding="utf-8") as f:
+                    csv.writer(f).writerows([
+                        ["Domain", "Source Domain", "Template", "Token", "Value"],
+                        [domain, domain, "GMail", "t", "google-site-verification=t"],
+                    ])
+            out = os.path.join(tmp, "merged.csv")
+            with patch("builtins.print"):
+                self.assertEqual(merge_command(paths + ["-o", out]), 0)
+            with open(out, newline="", encoding="utf-8") as f:
+                rows = list(csv.reader(f))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual([row[0] for row in rows[1:]], ["example.com", "example.org"])
+
+    def test_merge_json_unions_shared_names(self):
+        from txtra.__main__ import merge_command
+
+        shared = {"name": "SPF", "token": "", "value": "v=spf1 -all"}
+        outputs = [
+            {"a.example.com": {"raw_records": ["x"], "records": []}, "_spf.example.com": {"raw_records": [], "records": [shared]}},
+            {"b.example.com": {"raw_records": ["y"], "records": []}, "_spf.example.com": {"raw_records": ["z"], "records": [shared]}},
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for i, data in enumerate(outputs):
+                paths.append(os.path.join(tmp, f"shard{i}.json"))
+                with open(paths[-1], "w", encoding="utf-8") as f:
+                    json.dump(data, f)
+            out = os.path.join(tmp, "merged.json")
+            with patch("builtins.print"):
+                self.assertEqual(merge_command(paths + ["-o", out]), 0)
+            with open(out, encoding="utf-8") as f:
+                merged = json.load(f)
+        self.assertEqual(sorted(merged), ["_spf.example.com", "a.example.com", "b.example.com"])
+        self.assertEqual(merged["_spf.example.com"], {"raw_records": ["z"], "records": [shared]})
+
+
+
+class TestStats(unittest.TestCase):
+    zone = TestEngine.zone
+
+    def test_histogram(self):
+        from txtra.stats import Histogram
+
+        histogram = Histogram((1, 2, 5))
+        for value in (0.5, 1.5, 1.5, 4, 9):
+            histogram.observe(value)
+        self.assertEqual(histogram.cumulative(), [1, 3, 4, 5])
+        self.assertEqual(histogram.quantile(0.5), 1.75)
+        self.assertEqual(histogram.quantile(1), 9)
+        other = Histogram((1, 2, 5))
+        other.observe(1)
+        histogram.merge(other)
+        self.assertEqual((histogram.count, histogram.counts[0]), (6, 2))
+
+    def test_resolver_counts_lookups(self):
+        from txtra.stats import RunStats
+
+        stats = RunStats()
+        txt_resolver = AsyncTxtResolver(shared=ResolutionCache(), stats=stats)
+        txt_resolver.resolver = MagicMock()
+        txt_resolver.resolver.resolve = AsyncMock(return_value=FakeAnswer("example.com.", 300, ["MS=ABC"]))
+        for _ in range(3):
+            asyncio.run(txt_resolver.resolve("example.com"))
+        txt_resolver.resolver.resolve = AsyncMock(side_effect=resolver.LifetimeTimeout(timeout=1.0, errors=[]))
+        with self.assertRaises(resolver.LifetimeTimeout):
+            asyncio.run(txt_resolver.resolve("slow.example"))
+        counters = stats.counters
+        self.assertEqual((counters["lookups"], counters["cache_hits"], counters["queries"]), (4, 2, 2))
+        self.assertEqual(counters["query_timeouts"], 1)
+        self.assertEqual(stats.stages["resolve"].count, 4)
+
+    def test_csv_mode_stats(self):
+        from txtra.__main__ import Txtra
+
+        fake = FakeTxtResolver(self.zone)
+        args = Namespace(
+            no_scan=False, concurrency=2, stats=True, stats_format="prometheus", stats_interval=3600
+        )
+        domains = [Domain("example.com"), Domain("example.org"), Domain("missing.example")]
+        app = Txtra()
+        app.templates = txtra.templates
+        with tempfile.TemporaryDirectory() as tmp, \
+                patch("txtra.engine.ScanEngine", lambda concurrency, resolver=None: ScanEngine(concurrency, resolver=fake)), \
+                patch("builtins.print"):
+            args.stats_file = os.path.join(tmp, "txtra.prom")
+            app.open_stats(args)
+            app.csv_mode(args, domains, path=os.path.join(tmp, "output.csv"))
+            app.close_stats(args)
+            with open(args.stats_file, encoding="utf-8") as f:
+                exported = f.read()
+        stats = app.stats
+        self.assertEqual(stats.counters["domains"], 3)
+        self.assertEqual(stats.counters["domains_nxdomain"], 1)
+        self.assertEqual(stats.counters["records"], 4)
+        self.assertEqual(stats.templates["Microsoft Office 365"], 1)
+        self.assertEqual(stats.include_depth.max, 1)
+        self.assertEqual(stats.stages["write"].count, 2)
+        self.assertIn("txtra_domains_total 3", exported)
+        self.assertIn('txtra_template_matches_total{template="GMail"} 1', exported)
+        self.assertIn('txtra_stage_seconds_count{stage="write"} 2', exported)
+
+    def test_stats_file_is_exported_while_no_domain_finishes(self):
+        from txtra.stats import RunStats, StatsExporter
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "stats.json")
+            exported = []
+
+            class SlowResolver(FakeTxtResolver):
+                async def resolve(self, name):
+                    # Longer than the interval, as a lookup waiting on its timeout
+                    await asyncio.sleep(0.5)
+                    exported.append(os.path.exists(path))
+                    return await super().resolve(name)
+
+            fake = SlowResolver(self.zone)
+            t = Txtra()
+            t.stats = RunStats()
+            t.exporter = StatsExporter(t.stats, path, interval=0.1)
+            with patch("txtra.engine.ScanEngine", lambda concurrency, resolver=None: ScanEngine(concurrency, resolver=fake)):
+                t.run(Namespace(no_scan=True, concurrency=1), [Domain("example.org")], lambda records: None)
+        self.assertEqual(exported, [True])
+
+    def test_worker_stats_are_merged(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from txtra.stats import RunStats
+
+        fake = FakeTxtResolver(TestWorkers.zone)
+        args = Namespace(no_scan=False, concurrency=4, workers=2, order="input", stats=True)
+        domains = [Domain(f"d{i}.example") for i in range(10)] + [Domain("missing.example")]
+        stats = RunStats()
+        # Threads share the worker state each process owns, one keeps the batch stats apart
+        with ThreadPoolExecutor(1, initializer=workers.init_worker, initargs=(workers.worker_args(args),)) as pool, \
+                patch.object(workers, "BATCH_SIZE", 4), \
+                patch("txtra.engine.ScanEngine", lambda concurrency, resolver=None: ScanEngine(concurrency, resolver=fake)), \
+                patch("builtins.print"):
+            workers.run_pool(args, iter(domains), lambda records: None, lambda message: None, executor=pool, stats=stats)
+        self.assertEqual(stats.counters["domains"], 11)
+        self.assertEqual(stats.counters["domains_nxdomain"], 1)
+
+
+class TestProfiling(unittest.TestCase):
+    def test_classify(self):
+        import txtra.__main__ as cli
+        from txtra.profiling import classify
+
+        self.assertEqual(classify("/site-packages/txtra/matcher.py", "matches"), "scan")
+        self.assertEqual(classify("/site-packages/dns/name.py", "__hash__"), "resolve")
+        self.assertEqual(classify("~", "<method 'search' of 're.Pattern' objects>"), "scan")
+        lineno = cli.get_etldp1.__wrapped__.__code__.co_firstlineno + 2
+        self.assertEqual(classify(cli.__file__, "", lineno), "etldp1")
+
+    def test_generic_functions_are_charged_to_callers(self):
+        from txtra.profiling import attribute
+
+        callers = {
+            ("/lib/txtra/matcher.py", 1, "matches"): (3, 3, 0.3, 0.3),
+            ("/lib/dns/name.py", 1, "__hash__"): (1, 1, 0.1, 0.1),
+        }
+        shares = dict(attribute(("~", 0, "<method 'get' of 'dict' objects>"), (4, 4, 2.0, 2.0, callers)))
+        self.assertAlmostEqual(shares["scan"], 1.5)
+        self.assertAlmostEqual(shares["resolve"], 0.5)
+
+    def test_profiler_writes_dump_and_report(self):
+        import pstats
+        from txtra.profiling import Profiler
+
+        with tempfile.TemporaryDirectory() as tmp:
+            profiler = Profiler(os.path.join(tmp, "run.pstats"), top=5)
+            with profiler:
+                for _ in range(20):
+                    TxtRecord("MS=ABC123").scan(txtra.templates)
+            self.assertIn("matcher.py", str(pstats.Stats(profiler.path).stats))
+            with open(profiler.report_path, encoding="utf-8") as f:
+                report = f.read()
+        self.assertIn("== CPU time by stage (self time) ==", report)
+        self.assertIn("[scan]", report)
+        self.assertIn("== Live allocations at the end of the run by stage", report)
+
+
+class TestTemplateCosts(unittest.TestCase):
+    def templates(self):
+        return Txtra.templates_from_bundle(Txtra.bundle_entries(txtra.templates))
+
+    def test_index_accounts_patterns(self):
+        templates = self.templates()
+        templates.track_costs()
+        for value in ("MS=ABC123", "MS=ms12345", "v=spf1 -all"):
+            TxtRecord(value).scan(templates)
+        office = next(t for t in templates if t.name == "Microsoft Office 365")
+        by_pattern = {p.pattern: cost for p, cost in zip(office.patterns, office.costs)}
+        cost = by_pattern["[MS]=(?P<token>[A-F0-9]+)"]
+        # "v=spf1 -all" contains the "=" literal, so the pattern is searched
+        self.assertEqual((cost.evaluations, cost.hits), (2, 1))
+        self.assertEqual(by_pattern["[mMsS]=ms(?P<token>[0-9.]+)"].hits, 1)
+        self.assertGreater(sum(c.filtered for c in office.costs), 0)
+        self.assertGreater(cost.seconds, 0)
+
+    def test_template_match_accounts_patterns(self):
+        template = self.templates()[0]
+        template.track_costs()
+        template.match("nothing to see")
+        self.assertEqual(template.costs[0].evaluations, 1)
+        self.assertEqual(template.costs[0].hits, 0)
+
+    def test_report_ranks_templates(self):
+        from txtra.matcher import cost_report
+
+        templates = self.templates()
+        templates.track_costs()
+        TxtRecord("MS=ABC123").scan(templates)
+        templates[0].costs[0].seconds = 1.0
+        templates[0].costs[0].evaluations = 10
+        lines = cost_report(templates)
+        self.assertEqual(lines[0], "== Templates by total match time ==")
+        self.assertTrue(lines[2].startswith(templates[0].name[:32]))
+        ranking = lines[lines.index("== Templates by match time per hit ==") + 2]
+        self.assertTrue(ranking.startswith(templates[0].name[:32]))
+        self.assertIn("[MS]=(?P<token>[A-F0-9]+)", "\n".join(lines))
+
+
+class TestLint(unittest.TestCase):
+    BAD = (
+        "info:\n  name: Bad\n  author: test\n  category: test\n"
+        "rule:\n  type: regex\n  regex:\n    - bad-verification=(?P<token>([a-z0-9]+-?)+)$\n"
+    )
+
+    def checks(self, pattern):
+        from txtra.lint import lint_pattern
+
+        return {(f.severity, f.check) for f in lint_pattern(pattern)}
+
+    def test_nested_quantifiers(self):
+        for pattern in ("x(a+)+y", "x(\\w+\\.?)+$", "x(a|aa)+y", "(?i)x(A+a)+"):
+            self.assertIn(("error", "nested-quantifier"), self.checks(pattern), pattern)
+        for pattern in ("x(\\w+\\.)+y", "x(ab?)+y", "x(?>a+)+y", "x(\\d{1,3}\\.)+"):
+            self.assertNotIn(("error", "nested-quantifier"), self.checks(pattern), pattern)
+
+    def test_warnings(self):
+        self.assertIn(("warning", "adjacent-quantifiers"), self.checks("x\\d+\\s*\\d+"))
+        self.assertNotIn(("warning", "adjacent-quantifiers"), self.checks("x\\d+\\s+\\d+"))
+        self.assertIn(("warning", "leading-wildcard"), self.checks(".*=abc"))
+        self.assertEqual(self.checks("^.*=abc"), set())
+        self.assertEqual(self.checks("(?<![a-z])[a-z]+\\.abc"), set())
+        self.assertIn(("warning", "no-literal"), self.checks("^[a-f0-9]{32}$"))
+        self.assertEqual(self.checks("abc("), {("error", "invalid")})
+
+    def test_provider_templates_have_no_errors(self):
+        from txtra import lint
+
+        for path in Txtra.provider_paths():
+            template = Template()
+            template.loads(path)
+            self.assertEqual(lint.errors(lint.lint_template(template)), [], path.name)
+
+    def test_risky_template_is_rejected(self):
+        from txtra.__main__ import lint_templates_command
+
+        with tempfile.TemporaryDirectory() as tmp:
+            bad = Path(tmp) / "bad.yml"
+            bad.write_text(self.BAD, encoding="utf-8")
+            paths = [Txtra.provider_paths()[0], bad]
+            with patch("sys.stderr") as stderr:
+                templates = Txtra.build_templates(paths)
+            self.assertEqual(len(templates), 1)
+            self.assertIn("Rejected template Bad", "".join(c.args[0] for c in stderr.write.call_args_list))
+            with patch("sys.stdout"), patch("sys.stderr"):
+                self.assertEqual(lint_templates_command([str(bad)]), 1)
+                self.assertEqual(lint_templates_command([str(paths[0])]), 0)
+
+    def test_invalid_template_is_rejected(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            invalid = Path(tmp) / "invalid.yml"
+            invalid.write_text(self.BAD.replace("bad-verification=(?P<token>([a-z0-9]+-?)+)$", "abc(("), encoding="utf-8")
+            paths = [Txtra.provider_paths()[0], invalid]
+            with patch("sys.stderr") as stderr:
+                templates = Txtra.build_templates(paths)
+        self.assertEqual(len(templates), 1)
+        message = "".join(c.args[0] for c in stderr.write.call_args_list)
+        self.assertIn("[ERR] Rejected template Bad (invalid.yml): error: invalid", message)
+
+
 if __name__ == "__main__":
     unittest.main()
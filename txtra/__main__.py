@@ -1,31 +1,116 @@
 import re
 import sys
+import time
 import argparse
-import csv
-import json
 
-from urllib.parse import urlparse
-from typing import List, Optional
+from typing import IO, TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, Optional, Sized, Tuple
 from dataclasses import dataclass
-from dns import resolver
-from colorama import Fore
-from importlib import resources
-import yaml
-import tldextract
+from functools import lru_cache
+
+from txtra.checkpoint import Checkpoint, CheckpointError
+from txtra.matcher import SCAN_MEMO_SIZE, PatternCost, ScanMemo, TemplateIndex
+
+# Heavy dependencies (yaml, dnspython, colorama, asyncio and the
+# output formats) are imported where they are used, so that `txtra -h`,
+# argument errors and subcommands do not pay for them.
+if TYPE_CHECKING:
+    from pathlib import Path
+    from txtra.cache import TxtCache
+    from txtra.engine import AsyncTxtResolver
+    from txtra.pipeline import Deduplicator, Shard
+    from txtra.ratelimit import AdaptiveRateLimiter
+    from txtra.stats import RunStats, StatsExporter
+    from txtra.upstream import UpstreamPool
+
+DEFAULT_CONCURRENCY = 100
+ETLDP1_CACHE_SIZE = 65536
+INTERN_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=INTERN_CACHE_SIZE)
+def intern(value: str) -> str:
+    """Get the shared copy of a string equal to value
+
+    Records of different domains repeat the same SPF values and include
+    domains, and every answer is a new string. Unlike sys.intern, the
+    table is bounded, so unique values such as DKIM keys are not kept.
+    """
+    return value
+
 
+@lru_cache(maxsize=ETLDP1_CACHE_SIZE)
 def get_etldp1(domain: str) -> str:
     """Get eTLD+1 from domain
 
+    Computed offline from the bundled Public Suffix List snapshot, with
+    results kept in a bounded LRU cache.
+
     Args:
         domain (str): Domain name
 
     Returns:
         str: eTLD+1 domain
     """
-    ext = tldextract.extract(domain)
-    if ext.suffix == "":
-        return ext.domain
-    return ext.domain + "." + ext.suffix
+    from txtra.suffix import default_trie
+
+    return default_trie().registered_domain(domain)
+
+
+def positive_int(value: str) -> int:
+    """argparse type for strictly positive integers"""
+    try:
+        number = int(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f"invalid int value: '{value}'") from e
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer: '{value}'")
+    return number
+
+
+def positive_float(value: str) -> float:
+    """argparse type for strictly positive numbers"""
+    try:
+        number = float(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f"invalid float value: '{value}'") from e
+    if not number > 0:
+        raise argparse.ArgumentTypeError(f"must be a positive number: '{value}'")
+    return number
+
+
+def probability(value: str) -> float:
+    """argparse type for rates strictly between 0 and 1"""
+    try:
+        rate = float(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f"invalid float value: '{value}'") from e
+    if not 0 < rate < 1:
+        raise argparse.ArgumentTypeError(f"must be between 0 and 1: '{value}'")
+    return rate
+
+
+def resolvers_file(path: str) -> List[Tuple[str, int]]:
+    """argparse type reading a --resolvers nameserver list"""
+    from txtra.upstream import parse_resolvers
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            addresses = parse_resolvers(f)
+    except (OSError, ValueError) as e:
+        raise argparse.ArgumentTypeError(f"{path}: {e}") from e
+    if not addresses:
+        raise argparse.ArgumentTypeError(f"{path}: no nameserver")
+    return addresses
+
+
+def shard(value: str) -> "Shard":
+    """argparse type for --shard I/N selectors"""
+    from txtra.pipeline import parse_shard
+
+    try:
+        return parse_shard(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e)) from e
 
 
 class Template:
@@ -37,6 +122,8 @@ class Template:
         self.author: str = author
         self.rule: dict
         self.yaml_data: dict
+        self.patterns: List[re.Pattern] = []
+        self.costs: Optional[List[PatternCost]] = None
 
     def load(self, yaml_data):
         """Load txtra provider template
@@ -48,6 +135,17 @@ class Template:
         self.category = yaml_data["info"]["category"]
         self.author = yaml_data["info"]["author"]
         self.rule = yaml_data["rule"]
+        self.patterns = self.compile()
+
+    def compile(self) -> List[re.Pattern]:
+        """Compile the regex patterns of the rule
+
+        Returns:
+            List[re.Pattern]: Compiled patterns, empty for non-regex rules
+        """
+        if self.rule["type"] == "regex":
+            return [re.compile(pattern) for pattern in self.rule["regex"]]
+        return []
 
     def loads(self, path: str):
         """Load multiple txtra provider templates
@@ -55,6 +153,8 @@ class Template:
         Args:
             path (str): txtra provider template directory  path
         """
+        import yaml
+
         with open(path, "r", encoding="utf-8") as yml:
             self.yaml_data = yaml.safe_load(yml)
         self.load(self.yaml_data)
@@ -69,13 +169,22 @@ class Template:
             Optional[re.Match]: If a match is found, re.match is returned. If not,
             return None.
         """
-        if self.rule["type"] == "regex":
-            for pattern in self.rule["regex"]:
-                m = re.search(pattern, value)
+        if self.costs is not None:
+            for pattern, cost in zip(self.patterns, self.costs):
+                m = cost.search(pattern, value)
                 if m:
                     return m
+            return None
+        for pattern in self.patterns:
+            m = pattern.search(value)
+            if m:
+                return m
         return None
 
+    def track_costs(self) -> None:
+        """Account the evaluations, hits and search time of each pattern in costs"""
+        self.costs = [PatternCost() for _ in self.patterns]
+
     def get_paramname(self) -> Optional[List[str]]:
         """Get the params parameter of the template
 
@@ -87,7 +196,7 @@ class Template:
         return None
 
 
-@dataclass
+@dataclass(slots=True)
 class Domain:
     """Domain class"""
 
@@ -95,6 +204,8 @@ class Domain:
 
     def __post_init__(self):
         if self.name[:4] == "http":
+            from urllib.parse import urlparse
+
             o = urlparse(self.name)
             if o.hostname is not None:
                 self.name = o.hostname
@@ -105,18 +216,58 @@ class Domain:
     def __repr__(self) -> str:
         return self.name
 
+def iter_domains(
+    lines: Iterable[str],
+    dedup: Optional["Deduplicator"] = None,
+    shard: Optional["Shard"] = None,
+) -> Iterator[Domain]:
+    """Lazily turn input lines into normalized, optionally deduplicated, domains
+
+    Lines are read one at a time, so work starts on the first line and
+    memory does not depend on the input size. Blank lines are skipped.
+
+    Args:
+        lines (Iterable[str]): Input lines, such as an open file or sys.stdin
+        dedup (Optional[Deduplicator]): Drops names already seen
+        shard (Optional[Shard]): Keeps only the names of this shard
+
+    Yields:
+        Domain: Domain of each non-blank line
+    """
+    from txtra.pipeline import normalize_domain
+
+    for line in lines:
+        name = normalize_domain(line)
+        if name is None:
+            continue
+        if shard is not None and name not in shard:
+            continue
+        if dedup is not None and not dedup.add(name):
+            continue
+        yield Domain(name)
+
+
 class MatchResult:
     """Represents a single match result for a TxtRecord."""
+
+    __slots__ = ("template", "token")
+
     def __init__(self, template: Template, token: str) -> None:
         self.template = template
         self.token = token
 
 class TxtRecord:
-    """txt record class"""
+    """txt record class
+
+    Records are kept for every domain of a run, so they have no instance
+    dict, and their value and source domain are shared through intern.
+    """
+
+    __slots__ = ("value", "source_domain", "is_matched", "matches", "is_spf", "include_domains", "token")
 
     def __init__(self, value: str, source_domain: Optional[str] = None) -> None:
-        self.value = value
-        self.source_domain = source_domain 
+        self.value = intern(value)
+        self.source_domain = intern(source_domain) if source_domain is not None else None
         self.is_matched: bool = False
         self.matches: List[MatchResult] = []
         self.is_spf = value.startswith("v=spf1")
@@ -133,37 +284,42 @@ class TxtRecord:
         for part in parts:
             if part.startswith("include:"):
                 domain = part.split(":", 1)[1]
-                domains.append(domain)
+                domains.append(intern(domain))
         return domains
 
     def scan(self, templates: List[Template]) -> List[MatchResult]:
         """Scans txt records to see if the value corresponds to the template
 
         Args:
-            templates (List[Template]): List of Template instances
+            templates (List[Template]): List of Template instances. A
+                TemplateIndex is matched through its compiled index.
 
         Returns:
             Optional[List[MatchResult]]: Applicable List[MatchResult]
         """
-        for template in templates:
-            m = template.match(self.value)
-            if m:
-                # self.template = template
-                # self.provider = self.template.name
-                # self.category = self.template.category
-                self.is_matched = True
-                try:
-                    self.token = m.group("token")
-                except IndexError:
-                    self.token = ""
-                match_result = MatchResult(template, self.token)
-                self.matches.append(match_result)
+        if isinstance(templates, TemplateIndex):
+            hits = templates.matches(self.value)
+        else:
+            hits = [(t, m) for t in templates if (m := t.match(self.value))]
+        for template, m in hits:
+            # self.template = template
+            # self.provider = self.template.name
+            # self.category = self.template.category
+            self.is_matched = True
+            try:
+                self.token = m.group("token")
+            except IndexError:
+                self.token = ""
+            match_result = MatchResult(template, self.token)
+            self.matches.append(match_result)
         return self.matches
 
 
 class TxtRecords:
     """collective class of txt record class"""
 
+    __slots__ = ("domain", "records", "is_matched", "scanned_domains")
+
     def __init__(self, domain: Domain) -> None:
         self.domain: Domain = domain
         self.records: List[TxtRecord] = []
@@ -173,18 +329,61 @@ class TxtRecords:
     def resolve(self) -> List[TxtRecord]:
         """Perform DNS resolution of txt records
 
+        Answers are shared through the process-wide resolution cache.
+
         Returns:
             List[TxtRecord]: txt record list
         """
+        from dns import resolver
+        from txtra.cache import shared_cache
+        from txtra.engine import txt_values
+
+        def lookup(name: str):
+            answers = resolver.resolve(name, "TXT")
+            return txt_values(answers), answers.rrset.ttl  # type:ignore
+
         try:
-            answers = resolver.resolve(self.domain.name, "TXT")
+            values = shared_cache().resolve_sync(self.domain.name, lookup)
         except resolver.LifetimeTimeout as e:
             raise resolver.LifetimeTimeout from e
-        for rdata in answers:  # type:ignore
-            for data in rdata.strings:
-                self.records.append(TxtRecord(data.decode("utf-8"), source_domain=self.domain.name))
+        for value in values:
+            self.records.append(TxtRecord(value, source_domain=self.domain.name))
         return self.records
 
+    async def resolve_async(self, txt_resolver: "AsyncTxtResolver") -> List[TxtRecord]:
+        """Perform DNS resolution of txt records asynchronously
+
+        Args:
+            txt_resolver (AsyncTxtResolver): Resolver shared by the running engine
+
+        Returns:
+            List[TxtRecord]: txt record list
+        """
+        for value in await txt_resolver.resolve(self.domain.name):
+            self.records.append(TxtRecord(value, source_domain=self.domain.name))
+        return self.records
+
+    def _include_targets(self, record: TxtRecord, base_domain: str) -> Iterator[str]:
+        """Yield the SPF include domains of a record that still need scanning
+
+        Args:
+            record (TxtRecord): Scanned txt record
+            base_domain (str): Base domain for SPF include validation
+
+        Yields:
+            str: Included domain sharing the base domain and not yet scanned
+        """
+        if not record.is_spf:
+            return
+        for include_domain in record.include_domains:
+            # Check if the include domain matches the base domain
+            if get_etldp1(include_domain) != base_domain:
+                continue
+            # Skip if we've already scanned this domain
+            if include_domain in self.scanned_domains:
+                continue
+            yield include_domain
+
     def scan(self, templates: List[Template], base_domain: Optional[str] = None) -> List[TxtRecord]:
         """Scans txt records to see if the value corresponds to the template
 
@@ -199,29 +398,68 @@ class TxtRecords:
 
         if str(self.domain) not in self.scanned_domains:
             self.scanned_domains.add(str(self.domain))
-            self.resolve()
+            if not self.records:
+                self.resolve()
 
-        for record in self.records:
+        # Included records are scanned by their own container, so only
+        # the records present before recursion are scanned here
+        for record in self.records[:]:
             record.scan(templates)
 
             # If this is an SPF record, check for includes
-            if record.is_spf:
-                for include_domain in record.include_domains:
-                    # Check if the include domain matches the base domain
-                    if get_etldp1(include_domain) == base_domain:
-                        # Skip if we've already scanned this domain
-                        if include_domain in self.scanned_domains:
-                            continue
-
-                        # Recursively scan the included domain
-                        included_records_container = TxtRecords(Domain(include_domain))
-                        try:
-                            # included_records.resolve()
-                            included_records_container.scanned_domains = self.scanned_domains
-                            included_records = included_records_container.scan(templates, base_domain)
-                            self.records.extend(included_records)
-                        except Exception as e:
-                            print(f"Failed to resolve included domain {include_domain}: {e}")
+            for include_domain in self._include_targets(record, base_domain):
+                # Recursively scan the included domain
+                included_records_container = TxtRecords(Domain(include_domain))
+                try:
+                    included_records_container.scanned_domains = self.scanned_domains
+                    included_records = included_records_container.scan(templates, base_domain)
+                    self.records.extend(included_records)
+                except Exception as e:
+                    print(f"Failed to resolve included domain {include_domain}: {e}", file=sys.stderr)
+        return self.records
+
+    async def scan_async(
+        self,
+        templates: List[Template],
+        txt_resolver: "AsyncTxtResolver",
+        base_domain: Optional[str] = None,
+    ) -> List[TxtRecord]:
+        """Asynchronous counterpart of scan, resolving SPF includes with txt_resolver
+
+        Args:
+            templates (List[Template]): List of Template instances
+            txt_resolver (AsyncTxtResolver): Resolver shared by the running engine
+            base_domain (Optional[str]): Base domain for SPF include validation
+        Returns:
+            List[TxtRecord]: All scanned TxtRecord instances, including those from included domains.
+        """
+        if base_domain is None:
+            base_domain = get_etldp1(str(self.domain))
+
+        if str(self.domain) not in self.scanned_domains:
+            self.scanned_domains.add(str(self.domain))
+            if not self.records:
+                await self.resolve_async(txt_resolver)
+
+        stats: Optional["RunStats"] = getattr(txt_resolver, "stats", None)
+        for record in self.records[:]:
+            if stats is None:
+                record.scan(templates)
+            else:
+                start = time.perf_counter()
+                record.scan(templates)
+                stats.observe("scan", time.perf_counter() - start)
+
+            for include_domain in self._include_targets(record, base_domain):
+                included_records_container = TxtRecords(Domain(include_domain))
+                try:
+                    included_records_container.scanned_domains = self.scanned_domains
+                    included_records = await included_records_container.scan_async(
+                        templates, txt_resolver, base_domain
+                    )
+                    self.records.extend(included_records)
+                except Exception as e:
+                    print(f"Failed to resolve included domain {include_domain}: {e}", file=sys.stderr)
         return self.records
 
     def __iter__(self):
@@ -232,30 +470,458 @@ class Txtra:
     """txtra class"""
 
     def __init__(self) -> None:
-        self.templates = self.load_templates()
+        self._templates: Optional[TemplateIndex] = None
+        # Requested before the templates load, attached to them by the templates property
+        self._scan_memo: Optional[ScanMemo] = None
+        self._track_costs = False
+        self.stats: Optional["RunStats"] = None
+        self.exporter: Optional["StatsExporter"] = None
+        # Lookup state of the process, kept across runs, see open_session
+        self.limiter: Optional["AdaptiveRateLimiter"] = None
+        self.upstreams: Optional["UpstreamPool"] = None
+        self.cache: Optional["TxtCache"] = None
+        self._qps_log: Optional[IO[str]] = None
+        self._session = False
+
+    @property
+    def templates(self) -> TemplateIndex:
+        """Provider templates, loaded on first use
+
+        The scan memo and the cost tracking opened before are attached to
+        them as they load.
+        """
+        if self._templates is None:
+            self._templates = self.load_templates()
+            if self._scan_memo is not None:
+                self._templates.use_memo(self._scan_memo)
+            if self._track_costs:
+                self._templates.track_costs()
+        return self._templates
+
+    @templates.setter
+    def templates(self, templates: TemplateIndex) -> None:
+        self._templates = templates
+
+    def load_templates(self) -> TemplateIndex:
+        """Load a templates and build their matching index
+
+        Parsed templates are read from a compiled bundle when one matches
+        the provider files, and the bundle is rebuilt otherwise.
+        """
+        from txtra import bundle
+
+        paths = self.provider_paths()
+        try:
+            digest = bundle.fingerprint(paths)
+        except OSError:
+            return self.build_templates(paths)
+
+        for bundle_path in bundle.bundle_paths():
+            entries = bundle.read_bundle(bundle_path, digest)
+            if entries is not None:
+                return self.templates_from_bundle(entries)
+
+        templates = self.build_templates(paths)
+        candidates = bundle.bundle_paths()
+        if candidates:
+            try:
+                bundle.write_bundle(candidates[-1], digest, self.bundle_entries(templates))
+            except (OSError, TypeError, ValueError):
+                pass
+        return templates
+
+    @staticmethod
+    def provider_paths() -> List["Path"]:
+        """Get the provider template files"""
+        from importlib import resources
 
-    def load_templates(self) -> List[Template]:
-        """Load a templates"""
-        templates = []
         provider_dir = resources.files('txtra') / 'provider'
-        for path in provider_dir.glob('*.yml'):
+        return sorted(provider_dir.glob('*.yml'), key=lambda p: p.name)
+
+    @staticmethod
+    def build_templates(paths: Iterable["Path"]) -> TemplateIndex:
+        """Parse provider template files
+
+        Templates with a pattern that fails the error checks of txtra.lint,
+        such as nested quantifiers or an invalid regex, are rejected with an
+        error message. Only accepted templates reach the bundle.
+        """
+        from txtra import lint
+
+        templates = []
+        for path in paths:
             _t = Template()
-            _t.loads(path)
+            try:
+                _t.loads(path)
+                findings = lint.lint_template(_t)
+            except re.error as e:
+                findings = [lint.invalid(e.pattern, e)]
+            errors = lint.errors(findings)
+            if errors:
+                for finding in errors:
+                    print(f"[ERR] Rejected template {_t.name} ({path.name}): {finding}", file=sys.stderr)
+                continue
             templates.append(_t)
-        return templates
+        return TemplateIndex(templates)
+
+    @staticmethod
+    def bundle_entries(templates: TemplateIndex) -> List[dict]:
+        """Serialize templates and their matcher data for a bundle"""
+        return [
+            {"data": t.yaml_data, "literals": literals}
+            for t, literals in zip(templates, templates.literals())
+        ]
+
+    @staticmethod
+    def templates_from_bundle(entries: List[dict]) -> TemplateIndex:
+        """Restore templates from bundle entries"""
+        templates = []
+        for entry in entries:
+            _t = Template()
+            _t.yaml_data = entry["data"]
+            _t.load(_t.yaml_data)
+            templates.append(_t)
+        return TemplateIndex(templates, literals=[entry["literals"] for entry in entries])
+
+    @classmethod
+    def compile_templates(cls, path: Optional["Path"] = None) -> "Path":
+        """Build the template bundle explicitly
+
+        Args:
+            path (Optional[Path]): Bundle file path. Defaults to the bundle
+                shipped next to the txtra package.
+
+        Returns:
+            Path: Written bundle path
+        """
+        from pathlib import Path
+        from txtra import bundle
+
+        paths = cls.provider_paths()
+        if path is None:
+            candidates = bundle.bundle_paths()
+            path = candidates[0] if candidates else Path(bundle.BUNDLE_NAME)
+        templates = cls.build_templates(paths)
+        bundle.write_bundle(path, bundle.fingerprint(paths), cls.bundle_entries(templates))
+        return path
+
+    async def _scan_domain(
+        self, domain: Domain, txt_resolver: "AsyncTxtResolver", no_scan: bool
+    ) -> TxtRecords:
+        """Resolve, and unless no_scan is set scan, a single domain"""
+        records = TxtRecords(domain=domain)
+        if no_scan:
+            await records.resolve_async(txt_resolver)
+        else:
+            await records.scan_async(self.templates, txt_resolver)
+        return records
+
+    async def _run(
+        self,
+        args,
+        domains: Iterable[Domain],
+        handler: Callable[[TxtRecords], None],
+        on_error: Optional[Callable[[str], None]] = None,
+        tick: Optional[Callable[[], None]] = None,
+    ) -> int:
+        import asyncio
+        from dns import resolver
+        from txtra.engine import AsyncTxtResolver, ScanEngine
+        from txtra.output import TICK_INTERVAL
+
+        self.open_session(args)
+        engine = ScanEngine(
+            concurrency=getattr(args, "concurrency", DEFAULT_CONCURRENCY),
+            resolver=AsyncTxtResolver(
+                cache=self.cache, limiter=self.limiter, upstreams=self.upstreams, stats=self.stats
+            ),
+        )
+        no_scan = args.no_scan
+        stats = self.stats
+        if self._scan_memo is not None:
+            self._scan_memo.stats = stats
+
+        async def worker(domain: Domain, txt_resolver: "AsyncTxtResolver") -> TxtRecords:
+            return await self._scan_domain(domain, txt_resolver, no_scan)
+
+        async def ticker(tick: Callable[[], None]) -> None:
+            while True:
+                await asyncio.sleep(TICK_INTERVAL)
+                tick()
+
+        ticking = asyncio.create_task(ticker(tick)) if tick is not None else None
+        checked = 0
+        try:
+            async for _, records, error in engine.run(domains, worker):
+                checked += 1
+                if stats is not None:
+                    if error is None:
+                        stats.count("domains")
+                    else:
+                        stats.domain_error(error)
+                if error is None:
+                    handler(records)
+                elif isinstance(error, resolver.LifetimeTimeout):
+                    continue
+                else:
+                    (on_error or self.report_error)(f"An unexpected error occurred: {error}")
+        finally:
+            if ticking is not None:
+                ticking.cancel()
+        return checked
+
+    @staticmethod
+    def report_error(message: str) -> None:
+        """Print a per-domain error message"""
+        print(message, file=sys.stderr)
+
+    def open_session(self, args) -> None:
+        """Build the lookup state shared by the runs of this process, once
+
+        The rate limiter keeps its adapted rate, the --qps-log stream stays
+        open and the nameserver pool keeps the health, RTT window and
+        adaptive timeout of each nameserver, so that the batches a worker
+        process runs one after the other pace their queries, avoid failing
+        nameservers and time out queries as a single run. The --cache
+        database is opened once per process too, rather than by every
+        batch of every worker. Calling it again is a no-op until
+        close_session.
+        """
+        if self._session:
+            return
+        self.limiter, self._qps_log = self.open_limiter(args)
+        self.upstreams = self.open_upstreams(args)
+        self.cache = self.open_cache(args)
+        self._session = True
+
+    def close_session(self) -> None:
+        """Release the lookup state built by open_session"""
+        if self._qps_log is not None and self._qps_log is not sys.stderr:
+            self._qps_log.close()
+        if self.cache is not None:
+            self.cache.close()
+        self.limiter = self._qps_log = self.upstreams = self.cache = None
+        self._session = False
+
+    def open_limiter(self, args) -> Tuple[Optional["AdaptiveRateLimiter"], Optional[IO[str]]]:
+        """Build the query rate limiter selected by --qps, if any
+
+        Returns:
+            Tuple[Optional[AdaptiveRateLimiter], Optional[IO[str]]]: The limiter
+            and the --qps-log stream it writes its per-second counters to
+        """
+        qps = getattr(args, "qps", None)
+        if qps is None:
+            return None, None
+        from txtra.ratelimit import AdaptiveRateLimiter, sample_writer
+
+        path = getattr(args, "qps_log", None)
+        if path is None:
+            return AdaptiveRateLimiter(qps), None
+        stream = sys.stderr if path == "-" else open(path, "a", encoding="utf-8")
+        return AdaptiveRateLimiter(qps, on_sample=sample_writer(stream)), stream
+
+    def open_upstreams(self, args) -> Optional["UpstreamPool"]:
+        """Build the nameserver pool of the process
+
+        The nameservers of --resolvers, or those of the system resolver
+        configuration, get adaptive timeouts and hedging. The system
+        nameservers keep their configured ports, and a whole lookup keeps
+        the lifetime of the system resolver; the other resolv.conf options,
+        such as search, rotate or timeout, do not apply.
+        """
+        from txtra.upstream import TimeoutPolicy, UpstreamPool, system_lifetime, system_nameservers
+
+        addresses = getattr(args, "resolvers", None)
+        lifetime = None
+        if not addresses:
+            addresses = system_nameservers()
+            lifetime = system_lifetime()
+        if not addresses:
+            return None
+        default = TimeoutPolicy()
+        policy = TimeoutPolicy(
+            minimum=getattr(args, "timeout_min", default.minimum),
+            maximum=getattr(args, "timeout_max", default.maximum),
+            factor=getattr(args, "timeout_factor", default.factor),
+        )
+        return UpstreamPool(
+            addresses,
+            strategy=getattr(args, "resolver_strategy", "least-outstanding"),
+            policy=policy,
+            hedge=not getattr(args, "no_hedge", False),
+            lifetime=lifetime,
+        )
+
+    def open_cache(self, args) -> Optional["TxtCache"]:
+        """Open the persistent TXT answer cache selected by --cache, if any"""
+        path = getattr(args, "cache", None)
+        if path is None:
+            return None
+        from txtra.cache import TxtCache, default_cache_path
+
+        return TxtCache(
+            path or default_cache_path(),
+            max_stale=getattr(args, "max_stale", 0),
+            refresh=getattr(args, "refresh", False),
+        )
+
+    def run(
+        self,
+        args,
+        domains: Iterable[Domain],
+        handler: Callable[[TxtRecords], None],
+        on_error: Optional[Callable[[str], None]] = None,
+        tick: Optional[Callable[[], None]] = None,
+    ) -> int:
+        """Resolve and scan domains concurrently
+
+        Args:
+            args (argparse.Namespace): Parsed command line arguments
+            domains (Iterable[Domain]): Domains to check, consumed lazily
+            handler (Callable[[TxtRecords], None]): Called with the records of
+                each domain as soon as it finishes, in completion order unless
+                --workers runs with --order input
+            on_error (Optional[Callable[[str], None]]): Called with the message
+                of each failed domain. Defaults to printing it on stderr.
+            tick (Optional[Callable[[], None]]): Called every TICK_INTERVAL
+                seconds while the run lasts, even when no domain finishes,
+                such as to flush buffered output
+
+        Returns:
+            int: Number of domains checked, failures included
+        """
+        if self.stats is not None:
+            handler, on_error, tick = self._counted(handler, on_error or self.report_error, tick)
+
+        if getattr(args, "workers", 1) > 1:
+            from txtra.workers import run_pool
+
+            return run_pool(
+                args, domains, handler, on_error=on_error or self.report_error, stats=self.stats, tick=tick
+            )
 
-    def stdout_mode(self, args, domains: List[Domain]):
+        import asyncio
+
+        self.open_session(args)
+        try:
+            return asyncio.run(self._run(args, domains, handler, on_error, tick=tick))
+        finally:
+            self.close_session()
+
+    def _counted(
+        self,
+        handler: Callable[[TxtRecords], None],
+        on_error: Callable[[str], None],
+        tick: Optional[Callable[[], None]],
+    ) -> Tuple[Callable[[TxtRecords], None], Callable[[str], None], Optional[Callable[[], None]]]:
+        """Wrap the callbacks of a run to count the written records and time the writes
+
+        With --stats-file, the tick also exports the statistics, so that the
+        file is rewritten every --stats-interval even while no domain
+        finishes, such as when lookups keep timing out.
+        """
+        stats, exporter = self.stats, self.exporter
+        assert stats is not None
+        write = stats.timed("write", handler)
+
+        def counted(records: TxtRecords) -> None:
+            stats.domain_records(records)
+            write(records)
+            if exporter is not None:
+                exporter.maybe_write()
+
+        def failed(message: str) -> None:
+            on_error(message)
+            if exporter is not None:
+                exporter.maybe_write()
+
+        if exporter is None:
+            return counted, failed, tick
+
+        def ticked() -> None:
+            if tick is not None:
+                tick()
+            exporter.maybe_write()
+
+        return counted, failed, ticked
+
+    def open_stats(self, args) -> None:
+        """Start collecting run statistics when --stats or --stats-file is given"""
+        if not (getattr(args, "stats", False) or getattr(args, "stats_file", None)):
+            return
+        from txtra.stats import JSON, RunStats, StatsExporter
+
+        self.stats = RunStats()
+        if getattr(args, "stats_file", None):
+            self.exporter = StatsExporter(
+                self.stats,
+                args.stats_file,
+                fmt=getattr(args, "stats_format", JSON),
+                interval=getattr(args, "stats_interval", 10.0),
+            )
+
+    def close_stats(self, args) -> None:
+        """Write the final statistics, and print their summary with --stats"""
+        if self.stats is None:
+            return
+        if self.exporter is not None:
+            self.exporter.write()
+        if getattr(args, "stats", False):
+            from txtra.stats import print_summary
+
+            print_summary(self.stats)
+
+    def open_scan_memo(self, args) -> None:
+        """Memoize the matches of repeated TXT values unless --no-scan-memo or --no-scan is given
+
+        The parent of a worker pool does not scan, each worker opens its own
+        memo. Templates that are not loaded yet get the memo when they load.
+        """
+        if getattr(args, "no_scan", False) or getattr(args, "no_scan_memo", False):
+            return
+        if getattr(args, "workers", 1) > 1:
+            return
+        self._scan_memo = ScanMemo(getattr(args, "scan_memo_size", SCAN_MEMO_SIZE))
+        if self._templates is not None:
+            self._templates.use_memo(self._scan_memo)
+
+    def track_template_costs(self) -> None:
+        """Measure the cost of each template pattern for --template-costs, once the templates load"""
+        self._track_costs = True
+        if self._templates is not None:
+            self._templates.track_costs()
+
+    def write_template_costs(self, path: str) -> None:
+        """Write the template cost ranking, '-' meaning standard error"""
+        from txtra.matcher import cost_report
+
+        report = "\n".join(cost_report(self.templates)) + "\n"
+        if path == "-":
+            sys.stderr.write(report)
+            return
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(report)
+        except OSError as e:
+            print(f"[ERR] Failed to write template costs: {e}", file=sys.stderr)
+            return
+        print(f"[INF] Template costs written to {path}", file=sys.stderr)
+
+    def stdout_mode(self, args, domains: Iterable[Domain]):
         """standard output mode"""
-        print(f"[INF] Check {len(domains)} domains")
+        from colorama import Fore
+
+        sized = isinstance(domains, Sized)
+        if sized:
+            print(f"[INF] Check {len(domains)} domains")
         print("[INF] No Scan Mode") if args.no_scan else ""
-        for domain in domains:
-            records = TxtRecords(domain=domain)
 
+        def write(records: TxtRecords):
             if args.no_scan:
                 for record in records:
                     print(Fore.YELLOW + f"[{records.domain}] " + f"{record.value}")
             else:
-                records.scan(templates=self.templates)
                 for record in records:
                     if record.is_matched:
                         for match in record.matches:
@@ -276,69 +942,65 @@ class Txtra:
                     else:
                         print(Fore.YELLOW + f"[{record.source_domain}] {record.value} ")
 
-    def csv_mode(self, args, domains: List[Domain], path="./output.csv"):
-        """csv mode"""
+        checked = self.run(args, domains, write)
+        if not sized:
+            print(f"[INF] Checked {checked} domains")
 
-        with open(path, "w", newline='', encoding='utf-8') as f:
-            w = csv.writer(f)
-            w.writerow(["Domain", "Source Domain", "Template", "Token", "Value"])
+    def csv_mode(self, args, domains: Iterable[Domain], path="./output.csv"):
+        """csv mode
 
-        for domain in domains:
-            records = TxtRecords(domain=domain)
+        Rows are streamed through one buffered handle as domains finish.
+        `-o -` writes to standard output.
+        """
+        from txtra.output import CsvSink
 
-            try:
-                records.resolve()
-            except resolver.LifetimeTimeout:
-                continue
-            except Exception as e:
-                print(f"An unexpected error occurred: {e}")
-                continue  # Optional: handle other exceptions and continue to the next iteration
+        self._stream(args, domains, CsvSink, getattr(args, "output", None) or path)
 
-            if args.no_scan:
-                with open(path, "a", newline='', encoding='utf-8') as f:
-                    w = csv.writer(f)
-                    for record in records:
-                        w.writerow([records.domain, "", "", "", record.value])
-            else:
-                records.scan(templates=self.templates)
-                with open(path, "a", newline='', encoding='utf-8') as f:
-                    w = csv.writer(f)
-                    for record in records:
-                        if record.is_matched:
-                            for match in record.matches:
-                                w.writerow(
-                                    [
-                                        records.domain,
-                                        record.source_domain,
-                                        match.template.name,
-                                        match.token,
-                                        record.value,
-                                    ]
-                                )
-                        else:
-                            w.writerow([records.domain, record.source_domain, "", "", record.value])
-    
-    def json_mode(self, args, domains: List[Domain], path="./output.json"):
+    def jsonl_mode(self, args, domains: Iterable[Domain], path="./output.jsonl"):
+        """json lines mode
+
+        One JSON object per domain is written as soon as the domain, its SPF
+        includes included, finishes, so memory does not grow with the input.
+        """
+        from txtra.output import JsonlSink
+
+        self._stream(args, domains, JsonlSink, getattr(args, "output", None) or path)
+
+    def _stream(self, args, domains: Iterable[Domain], sink_class, path: str) -> None:
+        """Run domains into a streaming sink, journaling progress with --checkpoint"""
+        checkpoint = self.open_checkpoint(args, path)
+        if checkpoint is not None:
+            domains = checkpoint.pending(domains)
+        try:
+            with sink_class(path, checkpoint=checkpoint) as sink:
+                self.run(args, domains, lambda records: sink.write(records, args.no_scan), tick=sink.maybe_flush)
+        finally:
+            if checkpoint is not None:
+                checkpoint.close()
+        if checkpoint is not None and checkpoint.skipped:
+            print(f"[INF] Skipped {checkpoint.skipped} domains finished by an earlier run", file=sys.stderr)
+
+    def open_checkpoint(self, args, output: str) -> Optional[Checkpoint]:
+        """Open the progress journal selected by --checkpoint, if any"""
+        path = getattr(args, "checkpoint", None)
+        if path is None:
+            return None
+        return Checkpoint(path, output, resume=getattr(args, "resume", False))
+
+    def json_mode(self, args, domains: Iterable[Domain], path="./output.json"):
         """json mode"""
-        output_json = {}
-        for domain in domains:
-            records = TxtRecords(domain=domain)
+        import json
 
-            try:
-                records.resolve()
-            except resolver.LifetimeTimeout:
-                continue
-            except Exception as e:
-                print(f"An unexpected error occurred: {e}")
-                continue  # Optional: handle other exceptions and continue to the next iteration
+        output_json = {}
 
+        def write(records: TxtRecords):
+            domain = records.domain
             if args.no_scan:
                 output_json[str(domain)] = {
                     'raw_records': [ record.value for record in records]
                 }
-                
+
             else:
-                records.scan(templates=self.templates)
                 output_json[str(domain)] = {
                     'raw_records': [ record.value for record in records]
                 }
@@ -364,8 +1026,13 @@ class Txtra:
                                 'records': []
                             }
                         output_json[record.source_domain]['raw_records'].append(record.value)
-                        
-        with open(path, 'w', encoding='utf-8') as f:
+
+        self.run(args, domains, write)
+
+        from txtra.output import open_output
+
+        path = getattr(args, "output", None) or path
+        with open_output(path, newline=None) as f:
             f.write(json.dumps(output_json))
 
 
@@ -399,7 +1066,228 @@ class Txtra:
                 --csv option.",
             action="store_true",
         )
-        # parser.add_argument('-o', 'Specify output file')
+        p.add_argument(
+            "--concurrency",
+            help=f"Number of domains resolved concurrently (default: {DEFAULT_CONCURRENCY})",
+            type=positive_int,
+            default=DEFAULT_CONCURRENCY,
+            metavar="N",
+        )
+        p.add_argument(
+            "--workers",
+            help="Number of processes scanning domain batches, each running \
+                --concurrency lookups (default: 1)",
+            type=positive_int,
+            default=1,
+            metavar="N",
+        )
+        p.add_argument(
+            "--order",
+            help="Order in which --workers results are written: as batches \
+                complete, or in input order (default: completion)",
+            choices=["completion", "input"],
+            default="completion",
+        )
+        p.add_argument(
+            "--qps",
+            help="Maximum DNS queries per second across all workers. The rate is \
+                halved while resolvers return SERVFAIL/REFUSED or time out, and \
+                ramps back up once they recover (default: unlimited)",
+            type=positive_float,
+            metavar="RATE",
+        )
+        p.add_argument(
+            "--qps-log",
+            help="Append per-second counters of issued, succeeded and failed \
+                queries to PATH as json lines, '-' for standard error",
+            metavar="PATH",
+        )
+        p.add_argument(
+            "--resolvers",
+            help="Spread queries over the nameservers listed in FILE, one \
+                'ip', 'ip:port' or 'ip#port' per line, instead of the system resolver",
+            type=resolvers_file,
+            metavar="FILE",
+        )
+        p.add_argument(
+            "--resolver-strategy",
+            help="How --resolvers are chosen: fewest outstanding queries, or \
+                weighted by observed latency (default: least-outstanding)",
+            choices=["least-outstanding", "latency"],
+            default="least-outstanding",
+        )
+        p.add_argument(
+            "--timeout-min",
+            help="Lower bound of the per-query timeout in seconds (default: 0.25)",
+            type=positive_float,
+            default=0.25,
+            metavar="SECONDS",
+        )
+        p.add_argument(
+            "--timeout-max",
+            help="Upper bound of the per-query timeout in seconds, also used \
+                until a resolver has answered enough queries (default: 3.0)",
+            type=positive_float,
+            default=3.0,
+            metavar="SECONDS",
+        )
+        p.add_argument(
+            "--timeout-factor",
+            help="Per-query timeout as a multiple of the p99 RTT of the \
+                resolver (default: 2.0)",
+            type=positive_float,
+            default=2.0,
+            metavar="FACTOR",
+        )
+        p.add_argument(
+            "--no-hedge",
+            help="Wait for the timeout of a slow query instead of sending a \
+                copy to another resolver after its p95 RTT",
+            action="store_true",
+        )
+        p.add_argument(
+            "--cache",
+            help="Cache TXT answers, including NXDOMAIN/NoAnswer, in an SQLite \
+                database across runs (default: ~/.cache/txtra/txt-cache.sqlite3)",
+            nargs="?",
+            const="",
+            metavar="PATH",
+        )
+        p.add_argument(
+            "--max-stale",
+            help="Serve cached answers up to SECONDS past their TTL (default: 0)",
+            type=float,
+            default=0,
+            metavar="SECONDS",
+        )
+        p.add_argument(
+            "--refresh",
+            help="Ignore cached answers and query again, still updating the cache",
+            action="store_true",
+        )
+        p.add_argument(
+            "--jsonl",
+            help="Output one json object per line and domain, written as each \
+                domain finishes. Cannot be used with --csv or --json.",
+            action="store_true",
+        )
+        p.add_argument(
+            "--no-dedup",
+            help="Keep duplicate domains of the input instead of dropping them",
+            action="store_true",
+        )
+        p.add_argument(
+            "--dedup-exact-limit",
+            help="Distinct domains tracked exactly before switching to a Bloom \
+                filter (default: 1000000)",
+            type=positive_int,
+            default=1_000_000,
+            metavar="N",
+        )
+        p.add_argument(
+            "--dedup-fp-rate",
+            help="False-positive rate of the Bloom filter, the largest share of \
+                unique domains it may drop (default: 0.001)",
+            type=probability,
+            default=0.001,
+            metavar="RATE",
+        )
+        p.add_argument(
+            "--shard",
+            help="Process only the I-th of N shares of the input (1 <= I <= N), \
+                chosen by a stable hash of each domain so that hosts reading the \
+                same input split it without overlap",
+            type=shard,
+            metavar="I/N",
+        )
+        p.add_argument(
+            "--checkpoint",
+            help="Journal the domains finished by a --csv/--jsonl run to PATH, \
+                so that an interrupted run can be resumed",
+            metavar="PATH",
+        )
+        p.add_argument(
+            "--resume",
+            help="Skip the domains journaled in --checkpoint and append to the \
+                existing output",
+            action="store_true",
+        )
+        p.add_argument(
+            "--stats",
+            help="Print counters and per-stage timings of the run on standard \
+                error when it ends",
+            action="store_true",
+        )
+        p.add_argument(
+            "--stats-file",
+            help="Write the counters and histograms of the run to PATH while it \
+                goes on, '-' for standard error",
+            metavar="PATH",
+        )
+        p.add_argument(
+            "--stats-format",
+            help="Format of --stats-file: JSON, or the Prometheus text exposition \
+                format for the node exporter textfile collector (default: json)",
+            choices=["json", "prometheus"],
+            default="json",
+        )
+        p.add_argument(
+            "--stats-interval",
+            help="Seconds between two writes of --stats-file (default: 10)",
+            type=positive_float,
+            default=10.0,
+            metavar="SECONDS",
+        )
+        p.add_argument(
+            "--profile",
+            help="Profile the run: write a cProfile dump to PATH and a report \
+                of CPU time and memory allocations per pipeline stage to PATH.txt",
+            metavar="PATH",
+        )
+        p.add_argument(
+            "--profile-top",
+            help="Functions and allocation sites listed per section of the \
+                --profile report (default: 25)",
+            type=positive_int,
+            default=25,
+            metavar="N",
+        )
+        p.add_argument(
+            "--no-profile-memory",
+            help="Leave allocation tracing out of --profile, which otherwise \
+                slows allocation-heavy runs down several times",
+            action="store_true",
+        )
+        p.add_argument(
+            "--no-scan-memo",
+            help="Run the templates on every record instead of reusing the \
+                matches of TXT values already scanned",
+            action="store_true",
+        )
+        p.add_argument(
+            "--scan-memo-size",
+            help=f"Distinct TXT values whose matches are remembered, least \
+                recently used first out (default: {SCAN_MEMO_SIZE})",
+            type=positive_int,
+            default=SCAN_MEMO_SIZE,
+            metavar="N",
+        )
+        p.add_argument(
+            "--template-costs",
+            help="Account the regex evaluations, hits and match time of every \
+                template pattern, and write a ranking of the most expensive \
+                templates to PATH when the run ends (default: standard error)",
+            nargs="?",
+            const="-",
+            metavar="PATH",
+        )
+        p.add_argument(
+            "-o",
+            "--output",
+            help="Output file for --csv/--json/--jsonl, '-' for standard output \
+                (default: ./output.csv, ./output.json or ./output.jsonl)",
+            metavar="PATH",
+        )
 
         if sys.stdin.isatty() and len(sys.argv) == 1:
             p.print_help()
@@ -407,29 +1295,202 @@ class Txtra:
 
         return p.parse_args(args)
 
+def compile_templates_command(argv: List[str]) -> int:
+    """`txtra compile-templates` subcommand"""
+    from pathlib import Path
+
+    p = argparse.ArgumentParser(
+        prog="txtra compile-templates",
+        description="Parse the provider templates into a bundle that later runs load instead of YAML",
+    )
+    p.add_argument(
+        "-o",
+        "--output",
+        help="Bundle file path. Point TXTRA_TEMPLATE_BUNDLE at it when it is not the default",
+    )
+    args = p.parse_args(argv)
+    try:
+        path = Txtra.compile_templates(args.output and Path(args.output))
+    except OSError as e:
+        print(f"[ERR] Failed to write template bundle: {e}", file=sys.stderr)
+        return 1
+    print(f"[INF] Template bundle written to {path}")
+    return 0
+
+
+def merge_command(argv: List[str]) -> int:
+    """`txtra merge` subcommand"""
+    from txtra import output
+
+    p = argparse.ArgumentParser(
+        prog="txtra merge",
+        description="Combine the CSV, JSON or JSON lines outputs of --shard runs into one file",
+    )
+    p.add_argument("files", nargs="+", help="Per-shard output files", metavar="FILE")
+    p.add_argument(
+        "-o",
+        "--output",
+        help="Merged file, '-' for standard output (default: -)",
+        default="-",
+        metavar="PATH",
+    )
+    p.add_argument(
+        "--format",
+        help="Format of the files (default: guessed from the file extension)",
+        choices=output.MERGE_FORMATS,
+    )
+    args = p.parse_args(argv)
+
+    fmt = args.format or output.detect_format(args.files[0])
+    if fmt is None:
+        p.error("cannot guess the format from the file extension, use --format")
+    merge = {"csv": output.merge_csv, "json": output.merge_json, "jsonl": output.merge_jsonl}[fmt]
+    try:
+        with output.open_output(args.output, newline="" if fmt == "csv" else None) as f:
+            count = merge(args.files, f)
+    except (OSError, ValueError) as e:
+        print(f"[ERR] Failed to merge: {e}", file=sys.stderr)
+        return 1
+    unit = "rows" if fmt == "csv" else "domains"
+    print(f"[INF] Merged {len(args.files)} files, {count} {unit}", file=sys.stderr)
+    return 0
+
+
+def lint_templates_command(argv: List[str]) -> int:
+    """`txtra lint-templates` subcommand"""
+    from pathlib import Path
+    import yaml
+    from txtra import lint
+
+    p = argparse.ArgumentParser(
+        prog="txtra lint-templates",
+        description="Check template patterns for catastrophic backtracking, unanchored leading wildcards "
+        "and missing literals. Templates with errors are rejected when templates are loaded",
+    )
+    p.add_argument(
+        "files",
+        nargs="*",
+        help="Template files (default: the provider templates)",
+        metavar="FILE",
+    )
+    p.add_argument("--strict", help="Also fail on warnings", action="store_true")
+    args = p.parse_args(argv)
+
+    paths = [Path(f) for f in args.files] or Txtra.provider_paths()
+    counts = {lint.ERROR: 0, lint.WARNING: 0}
+    for path in paths:
+        _t = Template()
+        try:
+            _t.loads(str(path))
+            findings = lint.lint_template(_t)
+        except re.error as e:
+            findings = [lint.invalid(e.pattern, e)]
+        except (OSError, KeyError, TypeError, yaml.YAMLError) as e:
+            print(f"{path}: {lint.ERROR}: load: {e}")
+            counts[lint.ERROR] += 1
+            continue
+        for finding in findings:
+            print(f"{path}: {_t.name}: {finding}")
+            counts[finding.severity] += 1
+    print(
+        f"[INF] {len(paths)} templates, {counts[lint.ERROR]} errors, {counts[lint.WARNING]} warnings",
+        file=sys.stderr,
+    )
+    if counts[lint.ERROR] or (args.strict and counts[lint.WARNING]):
+        return 1
+    return 0
+
+
+SUBCOMMANDS: Dict[str, Callable[[List[str]], int]] = {
+    "compile-templates": compile_templates_command,
+    "lint-templates": lint_templates_command,
+    "merge": merge_command,
+}
+
+
+def run_mode(txtra: Txtra, args: argparse.Namespace, domains: Iterable[Domain]) -> None:
+    """Run the output mode selected by the arguments"""
+    if args.csv:
+        txtra.csv_mode(args, domains)
+    elif args.json:
+        txtra.json_mode(args, domains)
+    elif args.jsonl:
+        txtra.jsonl_mode(args, domains)
+    else:
+        txtra.stdout_mode(args, domains)
+
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        sys.exit(SUBCOMMANDS[sys.argv[1]](sys.argv[2:]))
+
     txtra = Txtra()
+    # Templates are only loaded once a mode scans the first record
     args = txtra.argparse_setup(sys.argv[1:])
 
     if args.csv and args.json:
         print("`--csv` and `--json` options cannot be used together.")
         sys.exit(0)
+    if args.jsonl and (args.csv or args.json):
+        print("`--jsonl` cannot be used together with `--csv` or `--json`.")
+        sys.exit(0)
+
+    if args.timeout_min > args.timeout_max:
+        print("`--timeout-min` cannot be larger than `--timeout-max`.")
+        sys.exit(0)
+    if args.resume and not args.checkpoint:
+        print("`--resume` requires `--checkpoint`.")
+        sys.exit(0)
+    if args.checkpoint and not (args.csv or args.jsonl):
+        print("`--checkpoint` can only be used with `--csv` or `--jsonl`.")
+        sys.exit(0)
+    if args.checkpoint and args.output == "-":
+        print("`--checkpoint` cannot be used with `-o -`.")
+        sys.exit(0)
+    if args.profile and args.workers > 1:
+        print("`--profile` cannot be used with `--workers`.")
+        sys.exit(0)
+    if args.template_costs and args.workers > 1:
+        print("`--template-costs` cannot be used with `--workers`.")
+        sys.exit(0)
+
+    dedup = None
+    if not args.no_dedup:
+        from txtra.pipeline import Deduplicator
+
+        dedup = Deduplicator(exact_limit=args.dedup_exact_limit, fp_rate=args.dedup_fp_rate)
 
     if args.domain:
-        domains = [Domain(args.domain)]
+        domains = list(iter_domains([args.domain]))
     elif args.file is not None:
-        lines = args.file.read().splitlines()
-        domains = list(map(lambda v: Domain(v), lines))
+        domains = iter_domains(args.file, dedup, args.shard)
     elif not sys.stdin.isatty():
-        lines = sys.stdin.read().strip().splitlines()
-        domains = list(map(lambda v: Domain(v), lines))
-
-    if args.csv:
-        txtra.csv_mode(args, domains)
-    if args.json:
-        txtra.json_mode(args, domains)
-    else:
-        txtra.stdout_mode(args, domains)
+        domains = iter_domains(sys.stdin, dedup, args.shard)
+
+    txtra.open_stats(args)
+    txtra.open_scan_memo(args)
+    if args.template_costs:
+        txtra.track_template_costs()
+    profiler = None
+    if args.profile:
+        from txtra.profiling import Profiler
+
+        profiler = Profiler(args.profile, top=args.profile_top, memory=not args.no_profile_memory)
+    try:
+        if profiler is not None:
+            with profiler:
+                run_mode(txtra, args, domains)
+            print(f"[INF] Profile written to {profiler.path} and {profiler.report_path}", file=sys.stderr)
+        else:
+            run_mode(txtra, args, domains)
+    except CheckpointError as e:
+        print(f"[ERR] {e}", file=sys.stderr)
+        sys.exit(1)
+    if dedup is not None and not args.domain:
+        print(f"[INF] Dropped {dedup.dropped} duplicate domains", file=sys.stderr)
+    txtra.close_stats(args)
+    if args.template_costs:
+        txtra.write_template_costs(args.template_costs)
     sys.exit(0)
 
 if __name__ == "__main__":
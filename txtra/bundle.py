@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import tempfile
+
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+BUNDLE_VERSION = 3
+BUNDLE_ENV = "TXTRA_TEMPLATE_BUNDLE"
+BUNDLE_NAME = "templates.bundle.json"
+
+
+def fingerprint(paths: Sequence[Path]) -> str:
+    """Fingerprint provider template files by name, size and mtime
+
+    Args:
+        paths (Sequence[Path]): Provider template files
+
+    Returns:
+        str: Hex digest that changes whenever any file is added, removed or modified
+    """
+    h = hashlib.sha256(f"v{BUNDLE_VERSION}".encode())
+    for path in sorted(paths, key=lambda p: p.name):
+        st = os.stat(path)
+        h.update(f"\0{path.name}\0{st.st_size}\0{st.st_mtime_ns}".encode())
+    return h.hexdigest()
+
+
+def bundle_paths() -> List[Path]:
+    """Get the candidate bundle locations, in lookup order
+
+    The TXTRA_TEMPLATE_BUNDLE environment variable overrides the defaults.
+    Setting it to an empty string disables the bundle.
+
+    Returns:
+        List[Path]: Bundle file paths
+    """
+    override = os.environ.get(BUNDLE_ENV)
+    if override is not None:
+        return [Path(override)] if override else []
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return [
+        Path(__file__).resolve().parent / BUNDLE_NAME,
+        Path(cache_home) / "txtra" / BUNDLE_NAME,
+    ]
+
+
+def read_bundle(path: Path, digest: str) -> Optional[List[dict]]:
+    """Read a template bundle if it matches the provider fingerprint
+
+    Args:
+        path (Path): Bundle file path
+        digest (str): Expected provider fingerprint
+
+    Returns:
+        Optional[List[dict]]: Bundle entries, or None when the bundle is
+        missing, unreadable or stale
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            bundle = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(bundle, dict) or bundle.get("fingerprint") != digest:
+        return None
+    return bundle.get("templates")
+
+
+def write_bundle(path: Path, digest: str, entries: List[dict]) -> None:
+    """Atomically write a template bundle
+
+    Args:
+        path (Path): Bundle file path
+        digest (str): Provider fingerprint the entries were built from
+        entries (List[dict]): Bundle entries
+
+    Raises:
+        OSError: The bundle could not be written
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data = json.dumps(
+        {"version": BUNDLE_VERSION, "fingerprint": digest, "templates": entries},
+        ensure_ascii=False,
+    )
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".templates-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
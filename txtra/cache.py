@@ -0,0 +1,356 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+
+# Answer kinds stored in the cache
+ANSWER = 0
+NXDOMAIN = 1
+NOANSWER = 2
+
+# Used for negative answers that carry no SOA record
+DEFAULT_NEGATIVE_TTL = 300
+# Seconds a read or write waits for another connection to release the database
+LOCK_TIMEOUT = 5.0
+SHARED_CACHE_SIZE = 100_000
+
+
+def default_cache_path() -> str:
+    """Get the default TXT cache location under the user cache directory"""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "txtra", "txt-cache.sqlite3")
+
+
+class CacheEntry(NamedTuple):
+    """Cached TXT lookup result"""
+
+    kind: int
+    values: List[str]
+    expires: float
+
+
+class TxtCache:
+    """Persistent TTL-aware TXT answer cache backed by SQLite
+
+    Positive answers are kept for their TTL, and NXDOMAIN/NoAnswer results
+    for the negative TTL taken from the SOA record of the response. Calls
+    may come from any thread, such as those the async resolver runs them
+    in, and are serialized on one connection.
+
+    Several processes, such as --workers, may share the database: every
+    put commits at once, so the write lock is only held for one row, and
+    a database that stays locked degrades to a cache miss rather than an
+    error.
+
+    Args:
+        path (str): SQLite database path
+        max_stale (float): Seconds an expired entry may still be served
+        refresh (bool): Ignore cached entries but still store new answers
+        timeout (float): Seconds to wait for a lock held by another connection
+    """
+
+    def __init__(
+        self, path: str, max_stale: float = 0, refresh: bool = False, timeout: float = LOCK_TIMEOUT
+    ) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_stale = max_stale
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        # Reads and writes given up on a locked database
+        self.errors = 0
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # Committed rows survive a crash of the process, only a power loss may drop the last ones
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS txt ("
+            "name TEXT PRIMARY KEY, kind INTEGER NOT NULL, "
+            "answer TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+        self.db.commit()
+
+    @staticmethod
+    def key(name: str) -> str:
+        """Normalize a name into its cache key"""
+        return name.rstrip(".").lower()
+
+    def get(self, name: str) -> Optional[CacheEntry]:
+        """Look up a name
+
+        Args:
+            name (str): Domain name
+
+        Returns:
+            Optional[CacheEntry]: The cached result, or None when it is
+            missing, expired beyond max_stale or refresh is set
+        """
+        if self.refresh:
+            self.misses += 1
+            return None
+        with self._lock:
+            try:
+                row = self.db.execute(
+                    "SELECT kind, answer, expires FROM txt WHERE name = ?", (self.key(name),)
+                ).fetchone()
+            except sqlite3.OperationalError:
+                self.errors += 1
+                row = None
+            if row is None or row[2] + self.max_stale < time.time():
+                self.misses += 1
+                return None
+            self.hits += 1
+        kind, answer, expires = row
+        return CacheEntry(kind, json.loads(answer), expires)
+
+    def put(self, name: str, kind: int, values: List[str], ttl: float) -> None:
+        """Store a lookup result and commit it
+
+        The result is dropped when the database stays locked by another
+        process longer than the timeout.
+
+        Args:
+            name (str): Domain name
+            kind (int): ANSWER, NXDOMAIN or NOANSWER
+            values (List[str]): txt record strings of a positive answer
+            ttl (float): Seconds the result stays fresh
+        """
+        with self._lock:
+            try:
+                with self.db:
+                    self.db.execute(
+                        "INSERT OR REPLACE INTO txt (name, kind, answer, expires) VALUES (?, ?, ?, ?)",
+                        (self.key(name), kind, json.dumps(values), time.time() + ttl),
+                    )
+            except sqlite3.OperationalError:
+                self.errors += 1
+
+    def close(self) -> None:
+        with self._lock:
+            self.db.close()
+
+
+def negative_ttl(response) -> float:
+    """Get the negative caching TTL of a response
+
+    Args:
+        response (dns.message.Message): NXDOMAIN or NoAnswer response
+
+    Returns:
+        float: min(SOA TTL, SOA minimum), or DEFAULT_NEGATIVE_TTL without SOA
+    """
+    from dns import rdatatype
+
+    if response is not None:
+        for rrset in response.authority:
+            if rrset.rdtype == rdatatype.SOA:
+                return min([rrset.ttl] + [rdata.minimum for rdata in rrset])
+    return DEFAULT_NEGATIVE_TTL
+
+
+def error_ttl(error: Exception) -> Optional[float]:
+    """Get how long a lookup error may be cached
+
+    Args:
+        error (Exception): Error raised by a TXT lookup
+
+    Returns:
+        Optional[float]: Negative TTL for NXDOMAIN/NoAnswer, None for errors
+        that must not be cached such as timeouts
+    """
+    from dns import resolver
+
+    if isinstance(error, resolver.NXDOMAIN):
+        responses = list(error.responses().values())
+        return negative_ttl(responses[-1] if responses else None)
+    if isinstance(error, resolver.NoAnswer):
+        return negative_ttl(error.kwargs.get("response"))
+    return None
+
+
+def error_kind(error: Exception) -> Optional[int]:
+    """Get the cache kind of a lookup error, NXDOMAIN or NOANSWER, None for others"""
+    from dns import resolver
+
+    if isinstance(error, resolver.NXDOMAIN):
+        return NXDOMAIN
+    if isinstance(error, resolver.NoAnswer):
+        return NOANSWER
+    return None
+
+
+def negative_error(kind: int, name: str) -> Exception:
+    """Rebuild the error of a cached negative answer
+
+    Args:
+        kind (int): NXDOMAIN or NOANSWER
+        name (str): Domain name
+
+    Returns:
+        Exception: A fresh resolver.NXDOMAIN or resolver.NoAnswer for name
+    """
+    import dns.message
+    import dns.name
+    from dns import resolver
+
+    if kind == NXDOMAIN:
+        return resolver.NXDOMAIN(qnames=[dns.name.from_text(name)])
+    query = dns.message.make_query(name, "TXT")
+    return resolver.NoAnswer(response=dns.message.make_response(query))
+
+
+# A lookup yields its txt strings and their TTL, or the NXDOMAIN/NOANSWER
+# kind and remaining TTL of a negative answer replayed from a TxtCache
+Lookup = Tuple[Union[List[str], int], float]
+
+
+class ResolutionCache:
+    """Run-wide in-memory cache of TXT lookups with in-flight coalescing
+
+    Every resolution in the process goes through one instance, so a name
+    such as a shared SPF include is queried once per TTL no matter how many
+    domains reference it. Concurrent lookups of the same name wait on the
+    single outstanding query.
+
+    Negative answers are kept as their NXDOMAIN or NOANSWER kind, not as
+    the exception, whose traceback and responses would hold the frames and
+    messages of the lookup, and a fresh exception is raised on each replay.
+
+    Args:
+        maxsize (int): Maximum number of names kept, least recently used first out
+    """
+
+    def __init__(self, maxsize: int = SHARED_CACHE_SIZE) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries: "OrderedDict[str, Tuple[float, Union[List[str], int]]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def _get(self, key: str) -> Optional[Union[List[str], int]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, result = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def _put(self, key: str, result: Union[List[str], int, None], ttl: Optional[float]) -> None:
+        if result is None or ttl is None or ttl <= 0 or self.maxsize <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _replay(self, name: str, result: Union[List[str], int]) -> List[str]:
+        self.hits += 1
+        if isinstance(result, int):
+            raise negative_error(result, name)
+        return result
+
+    async def resolve(self, name: str, lookup: Callable[[str], Awaitable[Lookup]]) -> List[str]:
+        """Resolve a name through the cache
+
+        Args:
+            name (str): Domain name
+            lookup (Callable[[str], Awaitable[Lookup]]): Performs the actual
+                lookup on a miss
+
+        Returns:
+            List[str]: txt record strings
+        """
+        key = TxtCache.key(name)
+        result = self._get(key)
+        if result is not None:
+            return self._replay(name, result)
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            result = await asyncio.shield(pending)
+            if isinstance(result, int):
+                raise negative_error(result, name)
+            return result
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result, ttl = await lookup(name)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            kind = error_kind(e)
+            self._put(key, kind, error_ttl(e))
+            if kind is not None:
+                # Waiters raise their own copy rather than share this one
+                future.set_result(kind)
+            else:
+                future.set_exception(e)
+                # Mark the exception as retrieved when nobody else was waiting
+                future.exception()
+            raise
+        else:
+            self._put(key, result, ttl)
+            future.set_result(result)
+            if isinstance(result, int):
+                raise negative_error(result, name)
+            return result
+        finally:
+            del self._inflight[key]
+
+    def resolve_sync(self, name: str, lookup: Callable[[str], Lookup]) -> List[str]:
+        """Blocking counterpart of resolve, without coalescing
+
+        Args:
+            name (str): Domain name
+            lookup (Callable[[str], Lookup]): Performs the actual lookup on a miss
+
+        Returns:
+            List[str]: txt record strings
+        """
+        key = TxtCache.key(name)
+        result = self._get(key)
+        if result is not None:
+            return self._replay(name, result)
+
+        self.misses += 1
+        try:
+            result, ttl = lookup(name)
+        except Exception as e:
+            self._put(key, error_kind(e), error_ttl(e))
+            raise
+        self._put(key, result, ttl)
+        if isinstance(result, int):
+            raise negative_error(result, name)
+        return result
+
+    def clear(self) -> None:
+        """Drop every cached result"""
+        self._entries.clear()
+
+
+_shared: Optional[ResolutionCache] = None
+
+
+def shared_cache() -> ResolutionCache:
+    """Get the process-wide resolution cache"""
+    global _shared
+    if _shared is None:
+        _shared = ResolutionCache()
+    return _shared
@@ -0,0 +1,141 @@
+import os
+
+from typing import IO, Iterable, Iterator, List, Set, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from txtra.__main__ import Domain
+
+JOURNAL_HEADER = "#txtra-checkpoint"
+JOURNAL_VERSION = 1
+# Prefix of the line that commits the domains listed before it
+COMMIT = "@"
+
+
+class CheckpointError(Exception):
+    """The checkpoint journal cannot be used to resume the run"""
+
+
+class Checkpoint:
+    """Append-only progress journal of a streaming run
+
+    Domains are journaled once their output has been written, in blocks
+    that end with the output size at the moment the block was committed:
+
+        #txtra-checkpoint 1 /abs/path/output.csv
+        example.com
+        example.org
+        @4096
+
+    A sink commits a block every time it flushes, after the output itself
+    is on disk. On resume, only committed blocks count: the output is
+    truncated back to the last committed size, which drops the rows of any
+    domain that finished after it, and those domains are scanned again.
+    Completion order therefore does not matter, and no domain is lost or
+    written twice.
+
+    Args:
+        path (str): Journal file path
+        output (str): Output file the journal describes
+        resume (bool): Continue an existing journal instead of starting over
+
+    Raises:
+        CheckpointError: The journal belongs to another output or is corrupt
+    """
+
+    def __init__(self, path: str, output: str, resume: bool = False) -> None:
+        self.path = path
+        self.output = os.path.abspath(output)
+        self.done: Set[str] = set()
+        self.offset = 0
+        self.skipped = 0
+        self._pending: List[str] = []
+
+        if resume and os.path.exists(path):
+            end = self._load()
+            self.file: IO[str] = open(path, "r+", encoding="utf-8", newline="\n")
+            self.file.seek(end)
+            self.file.truncate()
+        else:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.file = open(path, "w", encoding="utf-8", newline="\n")
+            self.file.write(f"{JOURNAL_HEADER} {JOURNAL_VERSION} {self.output}\n")
+            self._sync()
+
+    @property
+    def resuming(self) -> bool:
+        """Whether an earlier run already committed output"""
+        return self.offset > 0
+
+    def _load(self) -> int:
+        """Read the committed blocks, returning the byte position after the last one"""
+        block: List[str] = []
+        end = 0
+        with open(self.path, "rb") as f:
+            header = f.readline().decode("utf-8").rstrip("\n").split(" ", 2)
+            if len(header) != 3 or header[0] != JOURNAL_HEADER or header[1] != str(JOURNAL_VERSION):
+                raise CheckpointError(f"{self.path}: not a txtra checkpoint")
+            if header[2] != self.output:
+                raise CheckpointError(f"{self.path}: checkpoint of another output, {header[2]}")
+            end = f.tell()
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    # Torn final line
+                    break
+                line = raw.decode("utf-8").rstrip("\n")
+                if line.startswith(COMMIT):
+                    try:
+                        self.offset = int(line[len(COMMIT):])
+                    except ValueError:
+                        raise CheckpointError(f"{self.path}: corrupt commit line {line!r}") from None
+                    self.done.update(block)
+                    block = []
+                    end = f.tell()
+                else:
+                    block.append(line)
+
+        if self.offset:
+            try:
+                size = os.path.getsize(self.output)
+            except OSError:
+                size = -1
+            if size < self.offset:
+                raise CheckpointError(
+                    f"{self.output} is shorter than its checkpoint, it cannot be resumed"
+                )
+        return end
+
+    def pending(self, domains: Iterable["Domain"]) -> Iterator["Domain"]:
+        """Yield the domains not committed by an earlier run"""
+        for domain in domains:
+            if domain.name in self.done:
+                self.skipped += 1
+                continue
+            yield domain
+
+    def add(self, name: str) -> None:
+        """Record a domain whose output has been written, uncommitted until the next flush"""
+        self._pending.append(name)
+
+    def commit(self, offset: int) -> None:
+        """Commit the pending domains once the output is durable up to offset
+
+        Args:
+            offset (int): Output size in bytes after the flush
+        """
+        if not self._pending and offset == self.offset:
+            return
+        for name in self._pending:
+            self.file.write(name + "\n")
+        self.file.write(f"{COMMIT}{offset}\n")
+        self._sync()
+        self._pending = []
+        self.offset = offset
+
+    def _sync(self) -> None:
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self) -> None:
+        self.file.close()
@@ -0,0 +1,314 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+from typing import (
+    TYPE_CHECKING,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Generic,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+import dns.exception
+from dns import asyncresolver, resolver
+
+from txtra.cache import (
+    ANSWER,
+    NOANSWER,
+    NXDOMAIN,
+    Lookup,
+    ResolutionCache,
+    TxtCache,
+    error_ttl,
+    shared_cache,
+)
+from txtra.stats import RESOLVE
+
+if TYPE_CHECKING:
+    from txtra.ratelimit import AdaptiveRateLimiter
+    from txtra.stats import RunStats
+    from txtra.upstream import UpstreamPool
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def txt_values(answers) -> List[str]:
+    """Decode the txt strings of a dnspython answer
+
+    Args:
+        answers (dns.resolver.Answer): TXT answer
+
+    Returns:
+        List[str]: Decoded txt record strings
+    """
+    values = []
+    for rdata in answers:
+        for data in rdata.strings:
+            values.append(data.decode("utf-8"))
+    return values
+
+
+class AsyncTxtResolver:
+    """Asynchronous TXT record resolver built on dns.asyncresolver
+
+    Lookups go through the run-wide resolution cache first, then the
+    persistent answer cache, then the network.
+
+    Args:
+        cache (Optional[TxtCache]): Persistent answer cache consulted before
+            querying and updated with every answer, including NXDOMAIN and
+            NoAnswer. Its SQLite calls run in a thread, off the event loop.
+        shared (Optional[ResolutionCache]): In-memory cache shared by every
+            lookup of the run. Defaults to the process-wide instance.
+        limiter (Optional[AdaptiveRateLimiter]): Paces the queries that reach
+            the network and is told whether each one succeeded
+        upstreams (Optional[UpstreamPool]): Nameservers to spread the queries
+            over instead of the system resolver
+        stats (Optional[RunStats]): Counts lookups, cache hits and query
+            outcomes, and times every lookup
+    """
+
+    def __init__(
+        self,
+        cache: Optional[TxtCache] = None,
+        shared: Optional[ResolutionCache] = None,
+        limiter: Optional["AdaptiveRateLimiter"] = None,
+        upstreams: Optional["UpstreamPool"] = None,
+        stats: Optional["RunStats"] = None,
+    ) -> None:
+        self.resolver = upstreams if upstreams is not None else asyncresolver.Resolver()
+        self.cache = cache
+        self.shared = shared if shared is not None else shared_cache()
+        self.limiter = limiter
+        self.stats = stats
+
+    async def resolve(self, name: str) -> List[str]:
+        """Resolve the txt records of a name
+
+        Args:
+            name (str): Domain name
+
+        Raises:
+            resolver.NXDOMAIN: The name does not exist, possibly from a cache
+            resolver.NoAnswer: The name has no txt records, possibly from a cache
+
+        Returns:
+            List[str]: Decoded txt record strings
+        """
+        stats = self.stats
+        if stats is None:
+            return await self.shared.resolve(name, self._lookup)
+
+        stats.count("lookups")
+        missed = False
+
+        async def lookup(name: str) -> Lookup:
+            nonlocal missed
+            missed = True
+            return await self._lookup(name)
+
+        start = time.perf_counter()
+        try:
+            return await self.shared.resolve(name, lookup)
+        finally:
+            stats.observe(RESOLVE, time.perf_counter() - start)
+            if not missed:
+                # Answered, or joined, by the run-wide cache
+                stats.count("cache_hits")
+
+    async def _lookup(self, name: str) -> Lookup:
+        """Resolve a name missing from the run-wide cache
+
+        A negative answer of the persistent cache is returned as its kind
+        with the remaining TTL, so the run-wide cache keeps it no longer
+        than the persistent one would.
+        """
+        cache = self.cache
+        if cache is not None:
+            entry = await asyncio.to_thread(cache.get, name)
+            if entry is not None:
+                if self.stats is not None:
+                    self.stats.count("cache_hits")
+                ttl = max(entry.expires - time.time(), 0)
+                return (entry.values if entry.kind == ANSWER else entry.kind), ttl
+
+        try:
+            answers = await self._query(name)
+        except resolver.NXDOMAIN as e:
+            if cache is not None:
+                await asyncio.to_thread(cache.put, name, NXDOMAIN, [], error_ttl(e))
+            raise
+        except resolver.NoAnswer as e:
+            if cache is not None:
+                await asyncio.to_thread(cache.put, name, NOANSWER, [], error_ttl(e))
+            raise
+
+        values = txt_values(answers)
+        ttl = answers.rrset.ttl  # type:ignore
+        if cache is not None:
+            await asyncio.to_thread(cache.put, name, ANSWER, values, ttl)
+        return values, ttl
+
+    async def _query(self, name: str):
+        """Send one TXT query, counting its outcome when stats are collected"""
+        stats = self.stats
+        if stats is None:
+            return await self._send(name)
+        stats.count("queries")
+        try:
+            return await self._send(name)
+        except resolver.NXDOMAIN:
+            stats.count("query_nxdomain")
+            raise
+        except resolver.NoAnswer:
+            stats.count("query_noanswer")
+            raise
+        except resolver.LifetimeTimeout:
+            stats.count("query_timeouts")
+            raise
+        except resolver.NoNameservers:
+            stats.count("query_servfail")
+            raise
+
+    async def _send(self, name: str):
+        """Send one TXT query, paced and accounted by the rate limiter"""
+        if self.limiter is None:
+            return await self.resolver.resolve(name, "TXT")
+        await self.limiter.acquire()
+        try:
+            answers = await self.resolver.resolve(name, "TXT")
+        except (resolver.NXDOMAIN, resolver.NoAnswer):
+            # Authoritative negative answers are healthy responses
+            self.limiter.record(True)
+            raise
+        except dns.exception.DNSException:
+            # SERVFAIL/REFUSED from every nameserver, timeouts
+            self.limiter.record(False)
+            raise
+        self.limiter.record(True)
+        return answers
+
+
+def _hand_over(entry, inputs: asyncio.Queue, loop: asyncio.AbstractEventLoop, stop: threading.Event) -> bool:
+    """Put an entry into the input queue from the reader thread, waiting while it is full
+
+    Returns:
+        bool: False once the run has stopped and the entry was dropped
+    """
+    try:
+        future = asyncio.run_coroutine_threadsafe(inputs.put(entry), loop)
+    except RuntimeError:
+        # Event loop already closed
+        return False
+    while True:
+        try:
+            future.result(timeout=0.1)
+            return True
+        except concurrent.futures.TimeoutError:
+            if stop.is_set():
+                future.cancel()
+                return False
+        except concurrent.futures.CancelledError:
+            return False
+
+
+def _read_input(
+    iterator, inputs: asyncio.Queue, loop: asyncio.AbstractEventLoop, stop: threading.Event, done: object
+) -> None:
+    """Reader thread of ScanEngine.run, moving input items into the bounded input queue"""
+    try:
+        for item in iterator:
+            if stop.is_set() or not _hand_over((item, None), inputs, loop, stop):
+                return
+    except Exception as e:
+        # Failure while reading the input itself
+        _hand_over((done, e), inputs, loop, stop)
+    else:
+        _hand_over((done, None), inputs, loop, stop)
+
+
+class ScanEngine(Generic[T, R]):
+    """Bounded-concurrency asyncio engine
+
+    A reader thread moves items from the input iterable into a bounded
+    queue, a fixed number of worker tasks pull them from it and push
+    results into another bounded queue, so neither the input nor the
+    pending results are ever fully materialized and a slow input, such as
+    stdin, never blocks the event loop.
+    """
+
+    def __init__(
+        self,
+        concurrency: int,
+        resolver: Optional[AsyncTxtResolver] = None,
+    ) -> None:
+        if concurrency < 1:
+            raise ValueError("concurrency must be a positive integer")
+        self.concurrency = concurrency
+        self.resolver = resolver if resolver is not None else AsyncTxtResolver()
+
+    async def run(
+        self,
+        items: Iterable[T],
+        worker: Callable[[T, AsyncTxtResolver], Awaitable[R]],
+    ) -> AsyncIterator[Tuple[T, Optional[R], Optional[Exception]]]:
+        """Run worker over items, yielding results in completion order
+
+        Args:
+            items (Iterable[T]): Input items, consumed lazily
+            worker (Callable[[T, AsyncTxtResolver], Awaitable[R]]): Coroutine
+                function called once per item
+
+        Yields:
+            Tuple[T, Optional[R], Optional[Exception]]: The item, the worker
+            result and the exception raised by the worker, if any
+        """
+        loop = asyncio.get_running_loop()
+        inputs: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency)
+        stop = threading.Event()
+        done = object()
+        # Reading the input may block, e.g. on stdin; only the reader thread waits for it
+        reader = threading.Thread(
+            target=_read_input, args=(iter(items), inputs, loop, stop, done), name="txtra-input", daemon=True
+        )
+
+        async def consume() -> None:
+            while True:
+                item, error = await inputs.get()
+                if item is done:
+                    # Leave the end of the input for the other consumers
+                    await inputs.put((done, error))
+                    await queue.put((done, None, error))
+                    return
+                try:
+                    result = await worker(item, self.resolver)
+                except Exception as e:
+                    await queue.put((item, None, e))
+                else:
+                    await queue.put((item, result, None))
+
+        tasks = [asyncio.create_task(consume()) for _ in range(self.concurrency)]
+        reader.start()
+        try:
+            remaining = len(tasks)
+            while remaining:
+                entry = await queue.get()
+                if entry[0] is done:
+                    if entry[2] is not None:
+                        raise entry[2]
+                    remaining -= 1
+                    continue
+                yield entry
+        finally:
+            stop.set()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,325 @@
+import re
+import re._parser as sre_parse
+import string
+
+from typing import FrozenSet, Iterator, List, NamedTuple
+
+from txtra.matcher import required_literal
+
+ERROR = "error"
+WARNING = "warning"
+
+# Repeats with a larger maximum backtrack like unbounded ones
+LARGE_REPEAT = 32
+
+# Characters are code points; non-ASCII characters all share one code point
+_OTHER = 128
+_ALL = frozenset(range(_OTHER + 1))
+_DIGITS = frozenset(map(ord, string.digits))
+_SPACE = frozenset(map(ord, string.whitespace))
+_WORD = frozenset(map(ord, string.ascii_letters + string.digits + "_")) | {_OTHER}
+_CATEGORIES = {
+    sre_parse.CATEGORY_DIGIT: _DIGITS,
+    sre_parse.CATEGORY_NOT_DIGIT: _ALL - _DIGITS,
+    sre_parse.CATEGORY_WORD: _WORD,
+    sre_parse.CATEGORY_NOT_WORD: (_ALL - _WORD) | {_OTHER},
+    sre_parse.CATEGORY_SPACE: _SPACE,
+    sre_parse.CATEGORY_NOT_SPACE: _ALL - _SPACE,
+}
+_REPEATS = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT)
+_ANCHORS = (sre_parse.AT_BEGINNING, sre_parse.AT_BEGINNING_STRING)
+
+
+class Finding(NamedTuple):
+    """A risky construct found in a template pattern"""
+
+    severity: str
+    check: str
+    pattern: str
+    message: str
+
+    def __str__(self) -> str:
+        return f"{self.severity}: {self.check}: {self.message}: {self.pattern}"
+
+
+def _code(c: int) -> int:
+    return c if c < _OTHER else _OTHER
+
+
+def _charset(items) -> FrozenSet[int]:
+    chars = set()
+    negate = False
+    for op, av in items:
+        if op is sre_parse.NEGATE:
+            negate = True
+        elif op is sre_parse.LITERAL:
+            chars.add(_code(av))
+        elif op is sre_parse.RANGE:
+            low, high = av
+            chars.update(range(min(low, _OTHER), min(high, _OTHER) + 1))
+        elif op is sre_parse.CATEGORY:
+            chars |= _CATEGORIES.get(av, _ALL)
+    if negate:
+        return (_ALL - chars) | {_OTHER}
+    return frozenset(chars)
+
+
+def _alphabet(items) -> FrozenSet[int]:
+    """Characters a sequence of parsed items can consume"""
+    chars: FrozenSet[int] = frozenset()
+    for op, av in items:
+        if op is sre_parse.LITERAL:
+            chars |= {_code(av)}
+        elif op in (sre_parse.NOT_LITERAL, sre_parse.ANY):
+            chars |= _ALL
+        elif op is sre_parse.IN:
+            chars |= _charset(av)
+        elif op is sre_parse.BRANCH:
+            for branch in av[1]:
+                chars |= _alphabet(branch)
+        elif op is sre_parse.SUBPATTERN:
+            chars |= _alphabet(av[3])
+        elif op in _REPEATS or op is sre_parse.POSSESSIVE_REPEAT:
+            chars |= _alphabet(av[2])
+        elif op is sre_parse.ATOMIC_GROUP:
+            chars |= _alphabet(av)
+        elif op is sre_parse.GROUPREF:
+            chars |= _ALL
+    return chars
+
+
+def _min_width(items) -> int:
+    """Length of the shortest string a sequence of parsed items matches"""
+    width = 0
+    for op, av in items:
+        if op in (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.ANY, sre_parse.IN):
+            width += 1
+        elif op is sre_parse.BRANCH:
+            width += min(_min_width(branch) for branch in av[1])
+        elif op is sre_parse.SUBPATTERN:
+            width += _min_width(av[3])
+        elif op in _REPEATS or op is sre_parse.POSSESSIVE_REPEAT:
+            width += av[0] * _min_width(av[2])
+        elif op is sre_parse.ATOMIC_GROUP:
+            width += _min_width(av)
+    return width
+
+
+def _max_width(items) -> int:
+    """Length of the longest string a sequence of parsed items matches, capped at MAXREPEAT"""
+    width = 0
+    for op, av in items:
+        if op in (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.ANY, sre_parse.IN):
+            width += 1
+        elif op is sre_parse.BRANCH:
+            width += max(_max_width(branch) for branch in av[1])
+        elif op is sre_parse.SUBPATTERN:
+            width += _max_width(av[3])
+        elif op in _REPEATS or op is sre_parse.POSSESSIVE_REPEAT:
+            width += av[1] * _max_width(av[2])
+        elif op is sre_parse.ATOMIC_GROUP:
+            width += _max_width(av)
+        elif op is sre_parse.GROUPREF:
+            width += sre_parse.MAXREPEAT
+    return min(width, sre_parse.MAXREPEAT)
+
+
+def _unbounded(op, av) -> bool:
+    """Whether an item is a repeat the regex engine may backtrack into at length"""
+    return op in _REPEATS and (av[1] is sre_parse.MAXREPEAT or av[1] >= LARGE_REPEAT)
+
+
+def _flatten(items) -> list:
+    """Sequence of items with the groups expanded in place"""
+    flat = []
+    for op, av in items:
+        if op is sre_parse.SUBPATTERN:
+            flat.extend(_flatten(av[3]))
+        else:
+            flat.append((op, av))
+    return flat
+
+
+def _children(op, av) -> Iterator[list]:
+    if op is sre_parse.SUBPATTERN:
+        yield av[3]
+    elif op is sre_parse.BRANCH:
+        yield from av[1]
+    elif op in _REPEATS or op is sre_parse.POSSESSIVE_REPEAT:
+        yield av[2]
+    elif op is sre_parse.ATOMIC_GROUP:
+        yield av
+    elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+        yield av[1]
+
+
+class _Analyzer:
+    def __init__(self, pattern: str, ignorecase: bool) -> None:
+        self.pattern = pattern
+        self.ignorecase = ignorecase
+        self.findings: List[Finding] = []
+
+    def add(self, severity: str, check: str, message: str) -> None:
+        finding = Finding(severity, check, self.pattern, message)
+        if finding not in self.findings:
+            self.findings.append(finding)
+
+    def alphabet(self, items) -> FrozenSet[int]:
+        chars = _alphabet(items)
+        if self.ignorecase:
+            chars |= {ord(chr(c).swapcase()) for c in chars if chr(c) in string.ascii_letters}
+        return chars
+
+    def walk(self, items) -> None:
+        self.adjacent(items)
+        for op, av in items:
+            if _unbounded(op, av):
+                self.nested(av[2])
+            for child in _children(op, av):
+                self.walk(child)
+
+    def nested(self, body) -> None:
+        """Flag a repeated group that can split the same string in many ways
+
+        In (a+)+, (\\w+\\.?)+ or (a|aa)+ an item of variable length can hand
+        characters over to the next iteration, and every partition of a long
+        run is tried before the match fails. A mandatory item the variable
+        one cannot consume, the dot of (\\w+\\.)+, fixes the partition.
+        """
+        flat = _flatten(body)
+        for k, item in enumerate(flat):
+            if item[0] in (sre_parse.ATOMIC_GROUP, sre_parse.POSSESSIVE_REPEAT):
+                # Never backtracked into, its length is decided once
+                continue
+            if _min_width([item]) == _max_width([item]):
+                continue
+            chars = self.alphabet([item])
+            separated = any(
+                j != k and _min_width([other]) and not self.alphabet([other]) & chars
+                for j, other in enumerate(flat)
+            )
+            if not separated:
+                self.add(
+                    ERROR,
+                    "nested-quantifier",
+                    "repeated group of variable length with no separator, backtracking is exponential on a long run",
+                )
+                return
+
+    def first(self, items) -> FrozenSet[int]:
+        """Characters the first consumed character of a sequence can be"""
+        chars: FrozenSet[int] = frozenset()
+        for item in _flatten(items):
+            chars |= self.alphabet([item])
+            if _min_width([item]):
+                break
+        return chars
+
+    def last(self, items) -> FrozenSet[int]:
+        """Characters the last consumed character of a sequence can be"""
+        return self.first(reversed(_flatten(items)))
+
+    def adjacent(self, items) -> None:
+        """Flag consecutive repeats that can trade characters, such as \\d+\\s*\\d+
+
+        Each split of a run between the repeats is tried, which is
+        quadratic in the run length, more with further repeats.
+        """
+        tails: FrozenSet[int] = frozenset()
+        for op, av in _flatten(items):
+            if _unbounded(op, av):
+                if tails & self.first(av[2]):
+                    self.add(
+                        WARNING,
+                        "adjacent-quantifiers",
+                        "consecutive repeats share characters, backtracking is polynomial on a long run",
+                    )
+                last = self.last(av[2])
+                tails = tails | last if not _min_width([(op, av)]) else last
+            elif _min_width([(op, av)]):
+                tails = frozenset()
+
+    def leading(self, items) -> None:
+        """Flag unanchored patterns that start with an unbounded repeat
+
+        re.search retries the pattern at every offset, and each attempt
+        runs the repeat to the end of the run, so a long run of its
+        characters without the rest of the pattern is quadratic.
+        """
+        for op, av in _flatten(items):
+            if op is sre_parse.AT and av in _ANCHORS:
+                return
+            if op is sre_parse.ASSERT_NOT or op is sre_parse.ASSERT:
+                # A lookaround such as (?<![a-z]) limits the start offsets
+                return
+            if _unbounded(op, av):
+                wildcard = len(self.alphabet(av[2])) > len(_ALL) // 2
+                self.add(
+                    WARNING,
+                    "leading-wildcard",
+                    f"unanchored pattern starts with a {'wildcard' if wildcard else 'character class'} repeat, "
+                    "search is quadratic on a long run of its characters",
+                )
+                return
+            if _min_width([(op, av)]):
+                return
+
+
+def invalid(pattern, error: Exception) -> Finding:
+    """Finding of a pattern that does not compile"""
+    return Finding(ERROR, "invalid", str(pattern), f"does not compile: {error}")
+
+
+def lint_pattern(pattern: str) -> List[Finding]:
+    """Statically analyse a template pattern for catastrophic backtracking
+
+    Checks, by severity:
+        error: the pattern does not compile (invalid), or a repeated group
+            can split the same run in many ways (nested-quantifier)
+        warning: consecutive repeats can trade characters
+            (adjacent-quantifiers), the unanchored pattern starts with an
+            unbounded repeat (leading-wildcard), or no literal is required,
+            so the TemplateIndex prefilter cannot skip the pattern
+            (no-literal)
+
+    Args:
+        pattern (str): Regular expression of a template rule
+
+    Returns:
+        List[Finding]: Findings, empty for a clean pattern
+    """
+    try:
+        compiled = re.compile(pattern)
+        tree = sre_parse.parse(pattern)
+    except (re.error, TypeError, RecursionError) as e:
+        return [invalid(pattern, e)]
+
+    analyzer = _Analyzer(pattern, bool(compiled.flags & re.IGNORECASE))
+    analyzer.walk(tree)
+    analyzer.leading(tree)
+    if not required_literal(compiled):
+        analyzer.add(WARNING, "no-literal", "no required literal, the regex runs on every record")
+    return analyzer.findings
+
+
+def lint_template(template) -> List[Finding]:
+    """Analyse the regex patterns of a template rule
+
+    Args:
+        template (Template): Loaded template
+
+    Returns:
+        List[Finding]: Findings of all its patterns
+    """
+    rule = getattr(template, "rule", None) or {}
+    if rule.get("type") != "regex":
+        return []
+    findings = []
+    for pattern in rule.get("regex") or []:
+        findings.extend(lint_pattern(pattern))
+    return findings
+
+
+def errors(findings: List[Finding]) -> List[Finding]:
+    """Findings severe enough to reject a template"""
+    return [finding for finding in findings if finding.severity == ERROR]
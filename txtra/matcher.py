@@ -0,0 +1,290 @@
+import hashlib
+import re
+import re._parser as sre_parse
+import time
+
+from collections import OrderedDict
+from typing import Any, Iterable, List, Optional, Sequence, Tuple
+
+SCAN_MEMO_SIZE = 65536
+
+
+def required_literal(pattern: re.Pattern) -> str:
+    """Get the longest literal substring every match of a pattern must contain
+
+    The literal is read from the re parser output, so escapes such as \\x41,
+    \\u0041, \\N{...} or octal ones are decoded the way the regex engine
+    decodes them. Runs of literals are followed into groups without flags;
+    character classes, alternations and repeats end a run. The result is
+    conservative: an empty string means no prefilter is possible.
+
+    Args:
+        pattern (re.Pattern): Compiled pattern
+
+    Returns:
+        str: Required literal, or an empty string
+    """
+    if pattern.flags & re.IGNORECASE or not isinstance(pattern.pattern, str):
+        return ""
+    try:
+        items = sre_parse.parse(pattern.pattern, pattern.flags)
+    except (re.error, RecursionError):
+        return ""
+
+    runs: List[str] = []
+    current: List[str] = []
+
+    def walk(items) -> None:
+        for op, av in items:
+            if op is sre_parse.LITERAL:
+                current.append(chr(av))
+            elif op is sre_parse.SUBPATTERN and not av[1] and not av[2]:
+                # A group without inline flags is matched in sequence
+                walk(av[3])
+            else:
+                if current:
+                    runs.append("".join(current))
+                current.clear()
+
+    walk(items)
+    if current:
+        runs.append("".join(current))
+    return max(runs, key=len, default="")
+
+
+class PatternCost:
+    """Evaluation counters of one template pattern
+
+    Attributes:
+        evaluations (int): Regex searches run
+        filtered (int): Records ruled out by the required literal, no search run
+        hits (int): Searches that matched
+        seconds (float): Cumulative time of the searches
+    """
+
+    __slots__ = ("evaluations", "filtered", "hits", "seconds")
+
+    def __init__(self) -> None:
+        self.evaluations = 0
+        self.filtered = 0
+        self.hits = 0
+        self.seconds = 0.0
+
+    def search(self, pattern: re.Pattern, value: str) -> Optional[re.Match]:
+        """Search value with pattern, accounting the search"""
+        start = time.perf_counter()
+        m = pattern.search(value)
+        self.seconds += time.perf_counter() - start
+        self.evaluations += 1
+        if m:
+            self.hits += 1
+        return m
+
+
+def cost_report(templates: Iterable, top: Optional[int] = None) -> List[str]:
+    """Rank templates by the cost of their patterns
+
+    Args:
+        templates (Iterable[Template]): Templates whose costs were tracked
+        top (Optional[int]): Rows per ranking, all by default
+
+    Returns:
+        List[str]: Report lines: templates by total match time, by time per
+        hit (evaluated templates that never hit first), then every pattern
+    """
+    rows = []
+    for template in templates:
+        costs = getattr(template, "costs", None)
+        if not costs:
+            continue
+        seconds = sum(cost.seconds for cost in costs)
+        evaluations = sum(cost.evaluations for cost in costs)
+        hits = sum(cost.hits for cost in costs)
+        rows.append((template, seconds, evaluations, hits))
+
+    def per_hit(row) -> float:
+        return row[1] / row[3] if row[3] else float("inf")
+
+    def line(row) -> str:
+        template, seconds, evaluations, hits = row
+        per_eval = f"{seconds / evaluations * 1e6:9.2f}" if evaluations else f"{'-':>9}"
+        hit_cost = f"{seconds / hits * 1e6:9.2f}" if hits else f"{'-':>9}"
+        return f"{template.name[:32]:<32} {seconds:9.4f} {evaluations:11d} {hits:8d} {per_eval} {hit_cost}"
+
+    header = f"{'template':<32} {'seconds':>9} {'evaluations':>11} {'hits':>8} {'us/eval':>9} {'us/hit':>9}"
+    lines = ["== Templates by total match time ==", header]
+    lines += [line(row) for row in sorted(rows, key=lambda row: row[1], reverse=True)[:top]]
+    lines += ["", "== Templates by match time per hit ==", header]
+    evaluated = [row for row in rows if row[2]]
+    lines += [line(row) for row in sorted(evaluated, key=lambda row: (per_hit(row), row[1]), reverse=True)[:top]]
+
+    lines += ["", "== Patterns ==", f"{'template':<32} {'seconds':>9} {'evaluations':>11} {'filtered':>9} {'hits':>8}  pattern"]
+    for template, _, _, _ in sorted(rows, key=lambda row: row[1], reverse=True)[:top]:
+        for pattern, cost in zip(template.patterns, template.costs):
+            lines.append(
+                f"{template.name[:32]:<32} {cost.seconds:9.4f} {cost.evaluations:11d} "
+                f"{cost.filtered:9d} {cost.hits:8d}  {pattern.pattern}"
+            )
+    return lines
+
+
+class ScanMemo:
+    """Bounded LRU memo of the template matches of TXT values
+
+    The same records, such as the SPF values of the large mail providers,
+    show up across huge numbers of domains. Matches are keyed by the
+    fingerprint of the template set and the value, so one memo may serve
+    several indexes without mixing their results.
+
+    Args:
+        maxsize (int): Maximum number of values kept, least recently used first out
+
+    Attributes:
+        hits (int): Lookups answered from the memo
+        misses (int): Lookups that had to run the templates
+        stats (Optional[RunStats]): Also receives the hits and misses, as the
+            scan_memo_hits and scan_memo_misses counters
+    """
+
+    def __init__(self, maxsize: int = SCAN_MEMO_SIZE) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.stats: Optional[Any] = None
+        self._entries: "OrderedDict[Tuple[str, str], tuple]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, fingerprint: str, value: str) -> Optional[tuple]:
+        """Get the memoized matches of a value, None when unknown"""
+        key = (fingerprint, value)
+        hits = self._entries.get(key)
+        if hits is None:
+            self.misses += 1
+            if self.stats is not None:
+                self.stats.count("scan_memo_misses")
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        if self.stats is not None:
+            self.stats.count("scan_memo_hits")
+        return hits
+
+    def put(self, fingerprint: str, value: str, hits: tuple) -> None:
+        if self.maxsize <= 0:
+            return
+        self._entries[(fingerprint, value)] = hits
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+class TemplateIndex(list):
+    """List of templates with a compiled matching index
+
+    The index is built once from the templates given at construction. Each
+    pattern is paired with its required literal, so a cheap substring test
+    rules out most patterns before the regex engine runs.
+    """
+
+    def __init__(
+        self, templates: Iterable = (), literals: Optional[Sequence[Sequence[str]]] = None
+    ) -> None:
+        super().__init__(templates)
+        if literals is None:
+            literals = self.literals()
+        self._index = tuple(
+            (template, tuple(zip(template_literals, template.patterns)))
+            for template, template_literals in zip(self, literals)
+        )
+        self._tracked: Optional[tuple] = None
+        self.memo: Optional[ScanMemo] = None
+        self.fingerprint = self._fingerprint()
+
+    def _fingerprint(self) -> str:
+        """Digest of the names and patterns of the templates, in order"""
+        h = hashlib.sha256()
+        for template in self:
+            h.update(f"\0{template.name}".encode())
+            for pattern in template.patterns:
+                h.update(f"\0{pattern.flags}:{pattern.pattern}".encode())
+        return h.hexdigest()
+
+    def use_memo(self, memo: Optional[ScanMemo]) -> None:
+        """Answer matches for repeated values from memo, None to stop"""
+        self.memo = memo
+
+    def track_costs(self) -> None:
+        """Start accounting the evaluations, hits and search time of every pattern
+
+        Counters are kept in the costs attribute of each template, one
+        PatternCost per pattern, and cost_report ranks them.
+        """
+        for template in self:
+            template.track_costs()
+        self._tracked = tuple(
+            (template, tuple((literal, pattern, cost) for (literal, pattern), cost in zip(checks, template.costs)))
+            for template, checks in self._index
+        )
+
+    def literals(self) -> List[List[str]]:
+        """Get the required literal of every pattern, per template
+
+        Returns:
+            List[List[str]]: Literals in template and pattern order
+        """
+        return [[required_literal(p) for p in template.patterns] for template in self]
+
+    def matches(self, value: str) -> List[Tuple[object, re.Match]]:
+        """Match a txt record value against every indexed template
+
+        Args:
+            value (str): txt record value
+
+        Values seen before are answered from memo when one is set.
+
+        Returns:
+            List[Tuple[Template, re.Match]]: Matching templates in template
+            order, each with the match of its first matching pattern
+        """
+        memo = self.memo
+        if memo is not None:
+            cached = memo.get(self.fingerprint, value)
+            if cached is not None:
+                return list(cached)
+            hits = self._match(value)
+            memo.put(self.fingerprint, value, tuple(hits))
+            return hits
+        return self._match(value)
+
+    def _match(self, value: str) -> List[Tuple[object, re.Match]]:
+        if self._tracked is not None:
+            return self._tracked_matches(value)
+        hits = []
+        for template, checks in self._index:
+            for literal, pattern in checks:
+                if literal in value:
+                    m = pattern.search(value)
+                    if m:
+                        hits.append((template, m))
+                        break
+        return hits
+
+    def _tracked_matches(self, value: str) -> List[Tuple[object, re.Match]]:
+        """matches, accounting every pattern in its PatternCost"""
+        hits = []
+        for template, checks in self._tracked:  # type: ignore
+            for literal, pattern, cost in checks:
+                if literal not in value:
+                    cost.filtered += 1
+                    continue
+                m = cost.search(pattern, value)
+                if m:
+                    hits.append((template, m))
+                    break
+        return hits
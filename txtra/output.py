@@ -0,0 +1,304 @@
+import csv
+import json
+import os
+import sys
+import time
+
+from typing import IO, TYPE_CHECKING, Iterable, Iterator, List, Optional
+
+if TYPE_CHECKING:
+    from txtra.checkpoint import Checkpoint
+
+CSV_HEADER = ["Domain", "Source Domain", "Template", "Token", "Value"]
+
+# Buffered output is flushed once this many characters are pending or this
+# many seconds have passed since the last flush, whichever comes first
+FLUSH_SIZE = 256 * 1024
+FLUSH_INTERVAL = 1.0
+# Seconds between two calls of the tick callback of a run, which flushes idle sinks
+TICK_INTERVAL = 0.25
+BUFFER_SIZE = 1024 * 1024
+
+
+def open_output(path: str, newline: str = "", offset: int = 0) -> IO[str]:
+    """Open an output stream, "-" meaning standard output
+
+    Args:
+        path (str): Output file path or "-"
+        newline (str): newline argument of open()
+        offset (int): Keep the first offset bytes of an existing file and
+            append after them, instead of truncating it
+
+    Returns:
+        IO[str]: Buffered text stream. Closing it leaves stdout open.
+    """
+    if offset:
+        f = open(path, "r+", newline=newline, encoding="utf-8", buffering=BUFFER_SIZE)
+        f.seek(offset)
+        f.truncate()
+        return f
+    if path == "-":
+        sys.stdout.flush()
+        return open(
+            sys.stdout.fileno(), "w", newline=newline, encoding="utf-8",
+            buffering=BUFFER_SIZE, closefd=False,
+        )
+    return open(path, "w", newline=newline, encoding="utf-8", buffering=BUFFER_SIZE)
+
+
+def csv_rows(records, no_scan: bool) -> Iterator[List[str]]:
+    """Format the records of one domain as CSV rows
+
+    Args:
+        records (TxtRecords): Resolved, and unless no_scan is set scanned, records
+        no_scan (bool): Only raw values were resolved
+
+    Yields:
+        List[str]: Row matching CSV_HEADER
+    """
+    domain = str(records.domain)
+    for record in records:
+        if no_scan:
+            yield [domain, "", "", "", record.value]
+        elif record.is_matched:
+            for match in record.matches:
+                yield [domain, record.source_domain, match.template.name, match.token, record.value]
+        else:
+            yield [domain, record.source_domain, "", "", record.value]
+
+
+class StreamSink:
+    """Buffered output sink kept open for the whole run
+
+    Args:
+        path (str): Output file path, or "-" for standard output
+        flush_size (int): Pending characters that trigger a flush
+        flush_interval (float): Seconds after which pending output is flushed
+        checkpoint (Optional[Checkpoint]): Journal committed on every flush.
+            When it resumes an earlier run, the output is continued from
+            its last committed size.
+    """
+
+    newline: str = ""
+
+    def __init__(
+        self,
+        path: str,
+        flush_size: int = FLUSH_SIZE,
+        flush_interval: float = FLUSH_INTERVAL,
+        checkpoint: Optional["Checkpoint"] = None,
+    ) -> None:
+        self.path = path
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.checkpoint = checkpoint
+        self.file = open_output(path, newline=self.newline, offset=checkpoint.offset if checkpoint else 0)
+        self._pending = 0
+        self._dirty = False
+        self._last_flush = time.monotonic()
+
+    @property
+    def resumed(self) -> bool:
+        """Whether the output continues an earlier run"""
+        return self.checkpoint is not None and self.checkpoint.resuming
+
+    def write(self, records, no_scan: bool) -> None:
+        """Write the output of one domain
+
+        Args:
+            records (TxtRecords): Records of a finished domain
+            no_scan (bool): Only raw values were resolved
+        """
+        size = self.emit(records, no_scan)
+        if self.checkpoint is not None:
+            self.checkpoint.add(str(records.domain))
+        self._written(size)
+
+    def emit(self, records, no_scan: bool) -> int:
+        """Format the output of one domain into the buffer
+
+        Returns:
+            int: Number of characters written
+        """
+        raise NotImplementedError
+
+    def _written(self, size: int) -> None:
+        """Account for written characters and flush when a threshold is reached"""
+        self._pending += size
+        self._dirty = True
+        if self._pending >= self.flush_size:
+            self.flush()
+        else:
+            self.maybe_flush()
+
+    def maybe_flush(self) -> None:
+        """Flush output written since the last flush once flush_interval has passed
+
+        Called after every write and periodically by the run, so output
+        does not wait for the next domain when the input goes quiet.
+        """
+        if self._dirty and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        self.file.flush()
+        if self.checkpoint is not None:
+            os.fsync(self.file.fileno())
+            self.checkpoint.commit(self.file.tell())
+        self._pending = 0
+        self._dirty = False
+        self._last_flush = time.monotonic()
+
+    def close(self) -> None:
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class CsvSink(StreamSink):
+    """Streaming CSV writer keeping one buffered handle open for the whole run"""
+
+    def __init__(self, path: str, **kwargs) -> None:
+        super().__init__(path, **kwargs)
+        self.writer = csv.writer(self.file)
+        if not self.resumed:
+            self._pending += self.writer.writerow(CSV_HEADER)
+
+    def emit(self, records, no_scan: bool) -> int:
+        size = 0
+        for row in csv_rows(records, no_scan):
+            size += self.writer.writerow(row)
+        return size
+
+
+def jsonl_object(records, no_scan: bool) -> dict:
+    """Build the self-contained JSON object of one domain
+
+    Args:
+        records (TxtRecords): Resolved, and unless no_scan is set scanned, records
+        no_scan (bool): Only raw values were resolved
+
+    Returns:
+        dict: {"domain", "raw_records"} plus, when scanned, "records" holding
+        every match with the domain it was found on
+    """
+    obj = {
+        "domain": str(records.domain),
+        "raw_records": [record.value for record in records],
+    }
+    if not no_scan:
+        obj["records"] = [
+            {
+                "source_domain": record.source_domain,
+                "name": match.template.name,
+                "token": match.token,
+                "value": record.value,
+            }
+            for record in records
+            for match in record.matches
+        ]
+    return obj
+
+
+class JsonlSink(StreamSink):
+    """NDJSON writer emitting one object per domain as soon as it finishes"""
+
+    newline = "\n"
+
+    def emit(self, records, no_scan: bool) -> int:
+        return self.file.write(json.dumps(jsonl_object(records, no_scan)) + "\n")
+
+
+MERGE_FORMATS = ("csv", "json", "jsonl")
+
+
+def detect_format(path: str) -> Optional[str]:
+    """Guess the output format of a file from its extension"""
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    return extension if extension in MERGE_FORMATS else None
+
+
+def merge_csv(paths: Iterable[str], out: IO[str]) -> int:
+    """Concatenate csv_mode outputs, keeping a single header
+
+    Args:
+        paths (Iterable[str]): Per-shard CSV files
+        out (IO[str]): Destination opened with newline=""
+
+    Raises:
+        ValueError: A file does not start with CSV_HEADER
+
+    Returns:
+        int: Number of rows written, header excluded
+    """
+    writer = csv.writer(out)
+    writer.writerow(CSV_HEADER)
+    rows = 0
+    for path in paths:
+        with open(path, newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            if next(reader, None) != CSV_HEADER:
+                raise ValueError(f"{path}: not a txtra CSV output")
+            for row in reader:
+                writer.writerow(row)
+                rows += 1
+    return rows
+
+
+def merge_jsonl(paths: Iterable[str], out: IO[str]) -> int:
+    """Concatenate jsonl_mode outputs
+
+    Args:
+        paths (Iterable[str]): Per-shard JSON lines files
+        out (IO[str]): Destination
+
+    Returns:
+        int: Number of domains written
+    """
+    count = 0
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    out.write(line if line.endswith("\n") else line + "\n")
+                    count += 1
+    return count
+
+
+def merge_json(paths: Iterable[str], out: IO[str]) -> int:
+    """Combine json_mode outputs into one object
+
+    A name present in several files, such as an SPF include shared by
+    domains of different shards, gets the union of their records.
+
+    Args:
+        paths (Iterable[str]): Per-shard JSON files
+        out (IO[str]): Destination
+
+    Raises:
+        ValueError: A file is not a json_mode object
+
+    Returns:
+        int: Number of names written
+    """
+    merged: dict = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError(f"{path}: not a txtra JSON output")
+        for name, entry in data.items():
+            target = merged.get(name)
+            if target is None:
+                merged[name] = entry
+                continue
+            for key, values in entry.items():
+                existing = target.setdefault(key, [])
+                existing.extend(value for value in values if value not in existing)
+    out.write(json.dumps(merged))
+    return len(merged)
@@ -0,0 +1,247 @@
+import hashlib
+import math
+import re
+
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Set
+
+# Distinct names kept in an exact set before switching to a Bloom filter
+DEFAULT_EXACT_LIMIT = 1_000_000
+DEFAULT_FP_RATE = 0.001
+
+# Characters IDNA 2003 maps away (ß to ss, ς to σ) but IDNA 2008 keeps, the UTS #46 deviations
+_DEVIATIONS = frozenset("\u00df\u03c2\u200c\u200d")
+_DEVIATION_SPLIT = re.compile("([\u00df\u03c2\u200c\u200d])")
+_LABEL_SPLIT = re.compile("[.\u3002\uff0e\uff61]")
+
+
+def _label_to_ascii(label: str) -> str:
+    """ACE form of one label, keeping the deviation characters as IDNA 2008 does"""
+    if label.isascii():
+        return label
+    if _DEVIATIONS.isdisjoint(label):
+        return label.encode("idna").decode("ascii")
+    from encodings.idna import nameprep
+
+    pieces = _DEVIATION_SPLIT.split(label)
+    label = "".join(piece if piece in _DEVIATIONS else nameprep(piece) for piece in pieces)
+    ace = "xn--" + label.encode("punycode").decode("ascii")
+    if len(ace) > 63:
+        raise UnicodeError("label too long")
+    return ace
+
+
+def normalize_domain(value: str) -> Optional[str]:
+    """Normalize one input line into a domain name
+
+    Surrounding whitespace and trailing dots are stripped, URLs are reduced
+    to their host name, the name is lowercased and internationalized names
+    are converted to their IDNA (punycode) form. The conversion is the
+    stdlib IDNA 2003 one, except that labels with ß, ς, ZWJ or ZWNJ keep
+    those characters as IDNA 2008 registries do, so Straße.de becomes
+    xn--strae-oqa.de rather than strasse.de. Other IDNA 2008 differences,
+    such as the symbols it no longer allows, are not checked.
+
+    Args:
+        value (str): Raw input line
+
+    Returns:
+        Optional[str]: Normalized name, or None for lines without a name
+    """
+    name = value.strip()
+    if "://" in name or name.startswith("//"):
+        from urllib.parse import urlsplit
+
+        try:
+            host = urlsplit(name if "://" in name else "http:" + name).hostname
+        except ValueError:
+            host = None
+        name = host or ""
+    name = name.rstrip(".").lower()
+    if not name:
+        return None
+    if not name.isascii():
+        try:
+            if _DEVIATIONS.isdisjoint(name):
+                name = name.encode("idna").decode("ascii")
+            else:
+                name = ".".join(_label_to_ascii(label) for label in _LABEL_SPLIT.split(name))
+        except UnicodeError:
+            # Left as is, the lookup reports the invalid name
+            pass
+    return name
+
+
+class Shard(NamedTuple):
+    """One share of the input, index counted from 1"""
+
+    index: int
+    count: int
+
+    def __contains__(self, name: str) -> bool:
+        return shard_of(name, self.count) == self.index - 1
+
+
+def parse_shard(value: str) -> Shard:
+    """Parse a shard selector such as "2/8"
+
+    Args:
+        value (str): "I/N" with 1 <= I <= N
+
+    Raises:
+        ValueError: The selector is malformed or out of range
+
+    Returns:
+        Shard: Parsed selector
+    """
+    index, sep, count = value.partition("/")
+    if not (sep and index.isdigit() and count.isdigit()):
+        raise ValueError(f"expected I/N: '{value}'")
+    shard = Shard(int(index), int(count))
+    if not 1 <= shard.index <= shard.count:
+        raise ValueError(f"shard index must be between 1 and {shard.count}: '{value}'")
+    return shard
+
+
+def shard_of(name: str, count: int) -> int:
+    """Get the 0-based shard of a normalized name
+
+    The hash is stable across processes, hosts and Python versions, unlike
+    hash(), so every host reading the same input agrees on the split.
+
+    Args:
+        name (str): Normalized domain name
+        count (int): Number of shards
+
+    Returns:
+        int: Shard number in range(count)
+    """
+    digest = hashlib.blake2b(name.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings
+
+    Args:
+        capacity (int): Number of items the filter is sized for
+        fp_rate (float): False-positive rate at capacity
+    """
+
+    def __init__(self, capacity: int, fp_rate: float) -> None:
+        self.capacity = capacity
+        self.size = max(8, math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str) -> Iterator[int]:
+        """Yield the bit positions of an item using double hashing"""
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item: str) -> bool:
+        """Add an item
+
+        Args:
+            item (str): Item to add
+
+        Returns:
+            bool: False when the item was (probably) already present
+        """
+        new = False
+        for bit in self._positions(item):
+            byte, mask = bit >> 3, 1 << (bit & 7)
+            if not self.bits[byte] & mask:
+                self.bits[byte] |= mask
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[bit >> 3] & (1 << (bit & 7)) for bit in self._positions(item))
+
+
+class ScalableBloomFilter:
+    """Bloom filter that grows with the stream
+
+    Each new stage doubles the capacity and halves the false-positive rate of
+    the previous one, so the overall rate stays below fp_rate however many
+    items are added.
+
+    Args:
+        initial_capacity (int): Capacity of the first stage
+        fp_rate (float): Overall false-positive rate bound
+    """
+
+    def __init__(self, initial_capacity: int, fp_rate: float) -> None:
+        self.fp_rate = fp_rate
+        self.filters: List[BloomFilter] = [BloomFilter(initial_capacity, fp_rate / 2)]
+
+    def add(self, item: str) -> bool:
+        """Add an item, returning False when it was (probably) already present"""
+        if any(item in f for f in self.filters):
+            return False
+        last = self.filters[-1]
+        if last.count >= last.capacity:
+            last = BloomFilter(last.capacity * 2, self.fp_rate / 2 ** (len(self.filters) + 1))
+            self.filters.append(last)
+        last.add(item)
+        return True
+
+
+class Deduplicator:
+    """Drop repeated names from a stream
+
+    Names are tracked in an exact set until exact_limit distinct names have
+    been seen, then in a scalable Bloom filter, which may drop a small
+    fraction (at most fp_rate) of unique names in exchange for bounded memory.
+
+    Args:
+        exact_limit (int): Distinct names tracked exactly
+        fp_rate (float): False-positive rate of the Bloom filter
+    """
+
+    def __init__(
+        self, exact_limit: int = DEFAULT_EXACT_LIMIT, fp_rate: float = DEFAULT_FP_RATE
+    ) -> None:
+        self.exact_limit = exact_limit
+        self.fp_rate = fp_rate
+        self.seen: Optional[Set[str]] = set()
+        self.bloom: Optional[ScalableBloomFilter] = None
+        self.dropped = 0
+
+    def add(self, name: str) -> bool:
+        """Record a name
+
+        Args:
+            name (str): Normalized name
+
+        Returns:
+            bool: True the first time a name is seen
+        """
+        if self.bloom is not None:
+            if self.bloom.add(name):
+                return True
+            self.dropped += 1
+            return False
+
+        if name in self.seen:
+            self.dropped += 1
+            return False
+        self.seen.add(name)
+        if len(self.seen) > self.exact_limit:
+            self.bloom = ScalableBloomFilter(max(self.exact_limit, 1) * 2, self.fp_rate)
+            for seen in self.seen:
+                self.bloom.add(seen)
+            self.seen = None
+        return True
+
+    def unique(self, names: Iterable[str]) -> Iterator[str]:
+        """Yield the names not seen before"""
+        for name in names:
+            if self.add(name):
+                yield name
@@ -0,0 +1,297 @@
+import ast
+import cProfile
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+
+from collections import defaultdict
+from functools import lru_cache
+from typing import IO, Dict, List, Optional, Tuple
+
+# Pipeline stages the profile is grouped by
+RESOLVE = "resolve"
+WAIT = "io wait"
+LOOP = "event loop"
+SCAN = "scan"
+ETLDP1 = "etldp1"
+OUTPUT = "output"
+TEMPLATES = "templates"
+OTHER = "other"
+STAGES = (RESOLVE, WAIT, LOOP, SCAN, ETLDP1, OUTPUT, TEMPLATES, OTHER)
+
+# Stage of a source file, by path fragment, first match wins
+PATH_STAGES: Tuple[Tuple[str, str], ...] = (
+    ("txtra/matcher.py", SCAN),
+    ("txtra/suffix.py", ETLDP1),
+    ("txtra/output.py", OUTPUT),
+    ("txtra/stats.py", OUTPUT),
+    ("txtra/engine.py", RESOLVE),
+    ("txtra/cache.py", RESOLVE),
+    ("txtra/upstream.py", RESOLVE),
+    ("txtra/ratelimit.py", RESOLVE),
+    ("txtra/bundle.py", TEMPLATES),
+    ("/dns/", RESOLVE),
+    ("/socket.py", RESOLVE),
+    ("/selectors.py", WAIT),
+    ("/asyncio/", LOOP),
+    ("/csv.py", OUTPUT),
+    ("/json/", OUTPUT),
+    ("/colorama/", OUTPUT),
+    ("/yaml/", TEMPLATES),
+    ("/re/", TEMPLATES),
+)
+# Stage of the functions of txtra/__main__.py, by name
+MAIN_STAGES: Dict[str, str] = {
+    "get_etldp1": ETLDP1,
+    "_include_targets": ETLDP1,
+    "scan": SCAN,
+    "scan_async": SCAN,
+    "_scan_domain": SCAN,
+    "_extract_include_domains": SCAN,
+    "resolve": RESOLVE,
+    "resolve_async": RESOLVE,
+    "write": OUTPUT,
+    "load_templates": TEMPLATES,
+    "build_templates": TEMPLATES,
+    "templates_from_bundle": TEMPLATES,
+    "load": TEMPLATES,
+    "loads": TEMPLATES,
+    "compile": TEMPLATES,
+}
+
+TOP = 25
+TRACE_FRAMES = 1
+
+
+def _builtin_stage(name: str) -> Optional[str]:
+    """Stage of a C function, from its pstats name such as "<method 'search' of 're.Pattern' objects>"
+
+    None for generic builtins, whose time belongs to the stage of their callers.
+    """
+    if "re.Pattern" in name:
+        return SCAN
+    if "select.epoll" in name or "select.select" in name or "select.poll" in name:
+        return WAIT
+    if "_socket.socket" in name:
+        return RESOLVE
+    if "_csv" in name:
+        return OUTPUT
+    return None
+
+
+def classify(filename: str, name: str, lineno: int = 0) -> str:
+    """Get the pipeline stage of a function or allocation site
+
+    Args:
+        filename (str): Source file, "~" for C functions as reported by cProfile
+        name (str): Function name, empty when only the line is known
+        lineno (int): Line number, used to find the function when name is empty
+
+    Returns:
+        str: One of STAGES
+    """
+    if filename == "~":
+        return _builtin_stage(name) or OTHER
+    path = filename.replace("\\", "/")
+    if path.endswith("txtra/__main__.py"):
+        if not name and lineno:
+            name = function_at(filename, lineno)
+        return MAIN_STAGES.get(name, OTHER)
+    for fragment, stage in PATH_STAGES:
+        if fragment in path:
+            return stage
+    return OTHER
+
+
+@lru_cache(maxsize=None)
+def _function_ranges(filename: str) -> Tuple[Tuple[int, int, str], ...]:
+    try:
+        with open(filename, "r", encoding="utf-8") as f:
+            tree = ast.parse(f.read())
+    except (OSError, SyntaxError, ValueError):
+        return ()
+    return tuple(
+        (node.lineno, node.end_lineno or node.lineno, node.name)
+        for node in ast.walk(tree)
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+    )
+
+
+def function_at(filename: str, lineno: int) -> str:
+    """Name of the innermost function of a file containing a line, "" outside of any"""
+    best: Optional[Tuple[int, int, str]] = None
+    for start, end, name in _function_ranges(filename):
+        if start <= lineno <= end and (best is None or start >= best[0]):
+            best = (start, end, name)
+    return best[2] if best else ""
+
+
+def _short(filename: str, lineno: int, name: str) -> str:
+    if filename == "~":
+        return name
+    parts = filename.replace("\\", "/").split("/")
+    return f"{'/'.join(parts[-2:])}:{lineno}({name})"
+
+
+def attribute(function: Tuple[str, int, str], entry: tuple) -> List[Tuple[str, float]]:
+    """Split the self time of a profiled function between stages
+
+    Functions of no stage, such as dict.get or the enum and contextlib
+    helpers of dnspython, are charged to the stages of their callers, in
+    proportion of the time spent under each.
+
+    Args:
+        function (Tuple[str, int, str]): pstats key: file, line and name
+        entry (tuple): pstats entry: primitive calls, calls, self time,
+            cumulative time and callers
+
+    Returns:
+        List[Tuple[str, float]]: Stages and their share of the self time
+    """
+    filename, _, name = function
+    tottime, callers = entry[2], entry[4]
+    stage = classify(filename, name)
+    if stage != OTHER or not callers:
+        return [(stage, tottime)]
+    shares: Dict[str, float] = defaultdict(float)
+    for (caller_file, _, caller_name), caller_entry in callers.items():
+        shares[classify(caller_file, caller_name)] += caller_entry[2]
+    total = sum(shares.values())
+    if not total:
+        return [(OTHER, tottime)]
+    return [(stage, tottime * share / total) for stage, share in shares.items()]
+
+
+class Profiler:
+    """Profile a run with cProfile and tracemalloc
+
+    The pstats dump is written to path, and a text report next to it at
+    path + ".txt": CPU time by pipeline stage, the most expensive functions
+    of each stage, and the largest live allocations at the end of the run,
+    also by stage.
+
+    Args:
+        path (str): pstats dump path
+        top (int): Functions and allocation sites listed per section
+        frames (int): Frames kept per allocation. One frame, the default,
+            keeps the tracemalloc overhead low and is enough to group
+            allocations by stage.
+        memory (bool): Trace allocations. tracemalloc slows allocation-heavy
+            runs down several times more than cProfile does.
+    """
+
+    def __init__(self, path: str, top: int = TOP, frames: int = TRACE_FRAMES, memory: bool = True) -> None:
+        self.path = path
+        self.top = top
+        self.frames = frames
+        self.memory = memory
+        self.profile = cProfile.Profile()
+        self.snapshot: Optional[tracemalloc.Snapshot] = None
+        self.peak = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self._start = (0.0, 0.0)
+
+    @property
+    def report_path(self) -> str:
+        return self.path + ".txt"
+
+    def __enter__(self) -> "Profiler":
+        if self.memory:
+            tracemalloc.start(self.frames)
+        self._start = (time.perf_counter(), time.process_time())
+        self.profile.enable()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.profile.disable()
+        self.wall = time.perf_counter() - self._start[0]
+        self.cpu = time.process_time() - self._start[1]
+        if self.memory:
+            self.snapshot = tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(False, tracemalloc.__file__)]
+            )
+            self.peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self.write()
+
+    def stage_times(self) -> Dict[str, float]:
+        """Self time of the profiled functions, summed per stage"""
+        totals: Dict[str, float] = defaultdict(float)
+        for function, entry in pstats.Stats(self.profile).stats.items():  # type: ignore
+            for stage, seconds in attribute(function, entry):
+                totals[stage] += seconds
+        return totals
+
+    def stage_allocations(self) -> Dict[str, Tuple[int, int]]:
+        """Size and block count of the live allocations, summed per stage"""
+        totals: Dict[str, List[int]] = defaultdict(lambda: [0, 0])
+        if self.snapshot is not None:
+            for stat in self.snapshot.statistics("lineno"):
+                frame = stat.traceback[0]
+                total = totals[classify(frame.filename, "", frame.lineno)]
+                total[0] += stat.size
+                total[1] += stat.count
+        return {stage: (size, count) for stage, (size, count) in totals.items()}
+
+    def write(self) -> None:
+        """Write the pstats dump and the text report"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.profile.dump_stats(self.path)
+        with open(self.report_path, "w", encoding="utf-8") as f:
+            self.report(f)
+
+    def report(self, out: IO[str]) -> None:
+        stats = pstats.Stats(self.profile, stream=out)
+        entries = stats.stats.items()  # type: ignore
+        out.write(f"txtra profile: {' '.join(sys.argv[1:])}\n")
+        out.write(f"wall {self.wall:.3f}s, cpu {self.cpu:.3f}s")
+        if self.memory:
+            out.write(f", peak traced memory {self.peak / 2**20:.1f} MiB")
+        out.write("\n")
+        out.write(f"pstats dump: {self.path}\n\n")
+
+        times = self.stage_times()
+        profiled = sum(times.values()) or 1.0
+        out.write("== CPU time by stage (self time) ==\n")
+        out.write(f"{'stage':<12} {'seconds':>9} {'share':>7}\n")
+        for stage in sorted(times, key=times.get, reverse=True):  # type: ignore
+            out.write(f"{stage:<12} {times[stage]:9.3f} {times[stage] / profiled:7.1%}\n")
+
+        by_stage: Dict[str, list] = defaultdict(list)
+        for function, entry in entries:
+            _, ncalls, _, cumtime, _ = entry
+            for stage, seconds in attribute(function, entry):
+                by_stage[stage].append((seconds, cumtime, ncalls, _short(*function)))
+        out.write("\n== Top functions by self time, per stage ==\n")
+        for stage in STAGES:
+            functions = sorted(by_stage.get(stage, ()), reverse=True)[:self.top]
+            if not functions:
+                continue
+            out.write(f"[{stage}]\n")
+            out.write(f"  {'tottime':>9} {'cumtime':>9} {'ncalls':>9}  function\n")
+            for tottime, cumtime, ncalls, label in functions:
+                out.write(f"  {tottime:9.4f} {cumtime:9.4f} {ncalls:9d}  {label}\n")
+
+        if self.snapshot is not None:
+            allocations = self.stage_allocations()
+            out.write(f"\n== Live allocations at the end of the run by stage (tracemalloc, {self.frames} frame) ==\n")
+            out.write(f"{'stage':<12} {'KiB':>10} {'blocks':>9}\n")
+            for stage in sorted(allocations, key=lambda s: allocations[s][0], reverse=True):
+                size, count = allocations[stage]
+                out.write(f"{stage:<12} {size / 1024:10.1f} {count:9d}\n")
+            out.write(f"\n== Top {self.top} allocation sites ==\n")
+            for stat in self.snapshot.statistics("lineno")[:self.top]:
+                frame = stat.traceback[0]
+                stage = classify(frame.filename, "", frame.lineno)
+                out.write(
+                    f"{stat.size / 1024:10.1f} KiB {stat.count:8d} blocks  [{stage}] "
+                    f"{_short(frame.filename, frame.lineno, function_at(frame.filename, frame.lineno) or '-')}\n"
+                )
+
+        out.write("\n== Top functions by cumulative time ==\n")
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import time
+
+from collections import deque
+from typing import IO, Callable, Deque, NamedTuple, Optional
+
+# Share of failed queries in a window above which the rate is cut
+ERROR_THRESHOLD = 0.05
+# Completed queries a window needs before its error share is trusted
+MIN_SAMPLES = 5
+# Multiplicative decrease and additive increase, as a share of the maximum rate
+DECREASE_FACTOR = 0.5
+INCREASE_STEP = 0.1
+# The rate never drops below this share of the maximum rate
+MIN_RATE_SHARE = 0.01
+HISTORY_SIZE = 300
+
+
+class TokenBucket:
+    """Token bucket shared by every query of the process
+
+    Tokens are reserved ahead of time, so waiters are served in arrival
+    order and each sleeps exactly once.
+
+    Args:
+        rate (float): Tokens added per second
+        burst (float): Tokens that may accumulate while idle
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate / 10)
+        self.tokens = self.burst
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def set_rate(self, rate: float) -> None:
+        """Change the refill rate, keeping the tokens earned so far"""
+        self._refill(time.monotonic())
+        self.rate = rate
+        self.burst = max(1.0, rate / 10)
+
+    async def acquire(self) -> None:
+        """Wait for one token"""
+        self._refill(time.monotonic())
+        self.tokens -= 1
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+class RateSample(NamedTuple):
+    """Query counters of one window"""
+
+    time: float
+    rate: float
+    issued: int
+    succeeded: int
+    failed: int
+
+
+class AdaptiveRateLimiter:
+    """Global query rate limit that backs off when the resolvers struggle
+
+    Each one-second window counts the queries issued, succeeded and failed
+    (SERVFAIL, REFUSED, timeouts). When the failed share of a window goes
+    over ERROR_THRESHOLD the rate is halved, and every clean window adds
+    back a tenth of the maximum rate, up to max_rate.
+
+    Args:
+        max_rate (float): Queries per second, as given by --qps
+        on_sample (Optional[Callable[[RateSample], None]]): Called with the
+            counters of every finished window
+    """
+
+    def __init__(
+        self, max_rate: float, on_sample: Optional[Callable[[RateSample], None]] = None
+    ) -> None:
+        self.max_rate = max_rate
+        self.min_rate = max_rate * MIN_RATE_SHARE
+        self.bucket = TokenBucket(max_rate)
+        self.on_sample = on_sample
+        self.history: Deque[RateSample] = deque(maxlen=HISTORY_SIZE)
+        self.issued = self.succeeded = self.failed = 0
+        self._window = time.monotonic()
+        self._issued = self._succeeded = self._failed = 0
+
+    @property
+    def rate(self) -> float:
+        """Current queries per second"""
+        return self.bucket.rate
+
+    async def acquire(self) -> None:
+        """Wait until a query may be sent, and count it as issued"""
+        self._roll()
+        await self.bucket.acquire()
+        self.issued += 1
+        self._issued += 1
+
+    def record(self, ok: bool) -> None:
+        """Count the outcome of a query
+
+        Args:
+            ok (bool): The upstream answered, NXDOMAIN and NoAnswer included
+        """
+        self._roll()
+        if ok:
+            self.succeeded += 1
+            self._succeeded += 1
+        else:
+            self.failed += 1
+            self._failed += 1
+
+    def _roll(self) -> None:
+        """Close the current window once a second has passed and adapt the rate"""
+        now = time.monotonic()
+        if now - self._window < 1:
+            return
+        sample = RateSample(time.time(), self.rate, self._issued, self._succeeded, self._failed)
+        self.history.append(sample)
+        if self.on_sample is not None:
+            self.on_sample(sample)
+
+        completed = self._succeeded + self._failed
+        if completed >= MIN_SAMPLES and self._failed / completed > ERROR_THRESHOLD:
+            self.bucket.set_rate(max(self.min_rate, self.rate * DECREASE_FACTOR))
+        elif self._failed == 0 and self.rate < self.max_rate:
+            self.bucket.set_rate(min(self.max_rate, self.rate + self.max_rate * INCREASE_STEP))
+        self._window = now
+        self._issued = self._succeeded = self._failed = 0
+
+
+def sample_writer(stream: IO[str]) -> Callable[[RateSample], None]:
+    """Build an on_sample callback writing one JSON object per line to stream"""
+
+    def write(sample: RateSample) -> None:
+        stream.write(json.dumps(sample._asdict()) + "\n")
+        stream.flush()
+
+    return write
@@ -0,0 +1,370 @@
+import json
+import os
+import sys
+import time
+
+from bisect import bisect_left
+from collections import Counter
+from typing import IO, Callable, Dict, List, Optional, Sequence, TypeVar
+
+T = TypeVar("T")
+
+RESOLVE = "resolve"
+SCAN = "scan"
+WRITE = "write"
+STAGES = (RESOLVE, SCAN, WRITE)
+
+JSON = "json"
+PROMETHEUS = "prometheus"
+FORMATS = (JSON, PROMETHEUS)
+
+# Upper bounds of the histogram buckets, as in Prometheus "le" labels
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DEPTH_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10)
+
+# Counters, in summary and export order
+COUNTERS = (
+    "domains",
+    "domains_failed",
+    "domains_timed_out",
+    "domains_nxdomain",
+    "lookups",
+    "cache_hits",
+    "queries",
+    "query_timeouts",
+    "query_servfail",
+    "query_nxdomain",
+    "query_noanswer",
+    "records",
+    "matches",
+    "scan_memo_hits",
+    "scan_memo_misses",
+)
+DESCRIPTIONS = {
+    "domains": "Input domains checked, failures included",
+    "domains_failed": "Input domains that failed with an error other than a timeout or NXDOMAIN",
+    "domains_timed_out": "Input domains whose lookup timed out",
+    "domains_nxdomain": "Input domains that do not exist",
+    "lookups": "TXT lookups, SPF includes included",
+    "cache_hits": "Lookups answered by the run-wide or persistent cache",
+    "queries": "TXT queries sent to the network",
+    "query_timeouts": "Queries that timed out",
+    "query_servfail": "Queries answered with SERVFAIL or REFUSED by every nameserver",
+    "query_nxdomain": "Queries answered with NXDOMAIN",
+    "query_noanswer": "Queries answered without TXT records",
+    "records": "TXT records written",
+    "matches": "Template matches written",
+    "scan_memo_hits": "Record scans answered by the memo of repeated TXT values",
+    "scan_memo_misses": "Record scans that ran the templates",
+}
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense
+
+    Args:
+        bounds (Sequence[float]): Increasing bucket upper bounds, +Inf implied
+    """
+
+    def __init__(self, bounds: Sequence[float]) -> None:
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: "Histogram") -> None:
+        """Add the observations of a histogram with the same bounds"""
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def cumulative(self) -> List[int]:
+        """Observations at or below each bound, +Inf last"""
+        total, out = 0, []
+        for count in self.counts:
+            total += count
+            out.append(total)
+        return out
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate a quantile by interpolating within its bucket
+
+        Args:
+            q (float): Quantile between 0 and 1
+
+        Returns:
+            Optional[float]: Estimate, None without observations
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        lower, seen = 0.0, 0
+        for bound, count in zip(self.bounds + (self.max,), self.counts):
+            if count and seen + count >= rank:
+                upper = min(bound, self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.max
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "buckets": {_le(bound): count for bound, count in zip(self.bounds + (float("inf"),), self.cumulative())},
+        }
+
+
+def _le(bound: float) -> str:
+    return "+Inf" if bound == float("inf") else f"{bound:g}"
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class RunStats:
+    """Counters and histograms of one run
+
+    Worker processes collect their own RunStats per batch, merged into the
+    one of the parent.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        self.counters: Counter = Counter()
+        self.templates: Counter = Counter()
+        self.stages: Dict[str, Histogram] = {stage: Histogram(TIME_BUCKETS) for stage in STAGES}
+        self.include_depth = Histogram(DEPTH_BUCKETS)
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] += n
+
+    def observe(self, stage: str, seconds: float) -> None:
+        self.stages[stage].observe(seconds)
+
+    def timed(self, stage: str, func: Callable[..., T]) -> Callable[..., T]:
+        """Wrap func so that every call is observed under stage"""
+
+        def wrapper(*args, **kwargs) -> T:
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.observe(stage, time.perf_counter() - start)
+
+        return wrapper
+
+    def domain_error(self, error: BaseException) -> None:
+        """Count an input domain that failed"""
+        from dns import resolver
+
+        self.count("domains")
+        if isinstance(error, resolver.LifetimeTimeout):
+            self.count("domains_timed_out")
+        elif isinstance(error, resolver.NXDOMAIN):
+            self.count("domains_nxdomain")
+        else:
+            self.count("domains_failed")
+
+    def domain_records(self, records) -> None:
+        """Count the records, matches and SPF include depth of a finished domain
+
+        The depth is the longest chain of includes followed from the input
+        domain to a name that had records.
+
+        Args:
+            records (TxtRecords): Records of the domain and its includes
+        """
+        children: Dict[str, List[str]] = {}
+        sources = set()
+        for record in records:
+            self.count("records")
+            sources.add(record.source_domain)
+            for match in record.matches:
+                self.count("matches")
+                self.templates[match.template.name] += 1
+            if record.include_domains:
+                children.setdefault(record.source_domain, []).extend(record.include_domains)
+
+        depth, level, seen = 0, [str(records.domain)], {str(records.domain)}
+        while level:
+            following = []
+            for name in level:
+                for child in children.get(name, ()):
+                    if child in sources and child not in seen:
+                        seen.add(child)
+                        following.append(child)
+            if following:
+                depth += 1
+            level = following
+        self.include_depth.observe(depth)
+
+    def merge(self, other: "RunStats") -> None:
+        """Add the counters and histograms of another run, such as a worker batch"""
+        self.counters.update(other.counters)
+        self.templates.update(other.templates)
+        for stage, histogram in other.stages.items():
+            self.stages[stage].merge(histogram)
+        self.include_depth.merge(other.include_depth)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def as_dict(self) -> dict:
+        """Snapshot for the JSON export"""
+        return {
+            "time": time.time(),
+            "elapsed_seconds": self.elapsed,
+            "counters": {name: self.counters[name] for name in COUNTERS},
+            "template_matches": dict(self.templates.most_common()),
+            "stage_seconds": {stage: histogram.as_dict() for stage, histogram in self.stages.items()},
+            "spf_include_depth": self.include_depth.as_dict(),
+        }
+
+    def prometheus(self) -> str:
+        """Snapshot in the Prometheus text exposition format"""
+        lines = [
+            "# HELP txtra_elapsed_seconds Seconds since the run started",
+            "# TYPE txtra_elapsed_seconds gauge",
+            f"txtra_elapsed_seconds {self.elapsed:.3f}",
+        ]
+        for name in COUNTERS:
+            metric = f"txtra_{name}_total"
+            lines += [
+                f"# HELP {metric} {DESCRIPTIONS[name]}",
+                f"# TYPE {metric} counter",
+                f"{metric} {self.counters[name]}",
+            ]
+        lines += [
+            "# HELP txtra_template_matches_total Template matches written, per template",
+            "# TYPE txtra_template_matches_total counter",
+        ]
+        for name, count in sorted(self.templates.items()):
+            lines.append(f'txtra_template_matches_total{{template="{_label(name)}"}} {count}')
+
+        lines += [
+            "# HELP txtra_stage_seconds Seconds spent per lookup, record scan and domain write",
+            "# TYPE txtra_stage_seconds histogram",
+        ]
+        for stage, histogram in self.stages.items():
+            lines += self._histogram_lines("txtra_stage_seconds", histogram, f'stage="{stage}",')
+        lines += [
+            "# HELP txtra_spf_include_depth Longest chain of SPF includes followed per domain",
+            "# TYPE txtra_spf_include_depth histogram",
+        ]
+        lines += self._histogram_lines("txtra_spf_include_depth", self.include_depth)
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _histogram_lines(metric: str, histogram: Histogram, labels: str = "") -> List[str]:
+        bounds = histogram.bounds + (float("inf"),)
+        lines = [
+            f'{metric}_bucket{{{labels}le="{_le(bound)}"}} {count}'
+            for bound, count in zip(bounds, histogram.cumulative())
+        ]
+        suffix = f"{{{labels.rstrip(',')}}}" if labels else ""
+        lines.append(f"{metric}_sum{suffix} {histogram.sum:.6f}")
+        lines.append(f"{metric}_count{suffix} {histogram.count}")
+        return lines
+
+    def summary(self, top: int = 5) -> List[str]:
+        """Human-readable end-of-run summary lines"""
+        c = self.counters
+        elapsed = self.elapsed
+        rate = c["domains"] / elapsed if elapsed > 0 else 0.0
+        hit_rate = c["cache_hits"] / c["lookups"] if c["lookups"] else 0.0
+        scans = c["scan_memo_hits"] + c["scan_memo_misses"]
+        memo_rate = c["scan_memo_hits"] / scans if scans else 0.0
+        lines = [
+            f"{c['domains']} domains in {elapsed:.1f}s ({rate:.1f}/s): {c['domains_failed']} failed, "
+            f"{c['domains_timed_out']} timed out, {c['domains_nxdomain']} NXDOMAIN",
+            f"{c['lookups']} lookups, {c['cache_hits']} cache hits ({hit_rate:.1%}), {c['queries']} queries: "
+            f"{c['query_timeouts']} timeouts, {c['query_servfail']} SERVFAIL/REFUSED, "
+            f"{c['query_nxdomain']} NXDOMAIN, {c['query_noanswer']} without TXT",
+            f"{c['records']} records, {c['matches']} matches, "
+            f"SPF include depth max {self.include_depth.max:g}",
+        ]
+        if scans:
+            lines.append(f"{scans} record scans, {c['scan_memo_hits']} answered by the scan memo ({memo_rate:.1%})")
+        for stage, histogram in self.stages.items():
+            if histogram.count:
+                p50, p99 = histogram.quantile(0.5), histogram.quantile(0.99)
+                lines.append(
+                    f"{stage}: {histogram.count} x, {histogram.sum:.2f}s total, "
+                    f"p50 {p50 * 1000:.2f}ms, p99 {p99 * 1000:.2f}ms, max {histogram.max * 1000:.2f}ms"
+                )
+        if self.templates:
+            ranked = ", ".join(f"{name} {count}" for name, count in self.templates.most_common(top))
+            lines.append(f"top templates: {ranked}")
+        return lines
+
+
+class StatsExporter:
+    """Periodically write RunStats to a file for monitoring to scrape
+
+    The file is replaced atomically, so a reader never sees a partial
+    snapshot. It suits the textfile collector of the Prometheus node
+    exporter as well as ad-hoc JSON polling.
+
+    Args:
+        stats (RunStats): Statistics of the run
+        path (str): Output file, '-' for standard error
+        fmt (str): JSON or PROMETHEUS
+        interval (float): Minimum seconds between two writes
+    """
+
+    def __init__(self, stats: RunStats, path: str, fmt: str = JSON, interval: float = 10.0) -> None:
+        if fmt not in FORMATS:
+            raise ValueError(f"unknown stats format: '{fmt}'")
+        self.stats = stats
+        self.path = path
+        self.fmt = fmt
+        self.interval = interval
+        self._written = time.monotonic()
+
+    def render(self) -> str:
+        if self.fmt == PROMETHEUS:
+            return self.stats.prometheus()
+        return json.dumps(self.stats.as_dict()) + "\n"
+
+    def maybe_write(self) -> None:
+        """Write a snapshot when interval has passed since the last one"""
+        if time.monotonic() - self._written >= self.interval:
+            self.write()
+
+    def write(self) -> None:
+        """Write a snapshot now"""
+        self._written = time.monotonic()
+        text = self.render()
+        if self.path == "-":
+            sys.stderr.write(text)
+            sys.stderr.flush()
+            return
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            # Monitoring must not abort the run
+            print(f"[ERR] Failed to write stats: {e}", file=sys.stderr)
+
+
+def print_summary(stats: RunStats, stream: Optional[IO[str]] = None) -> None:
+    """Print the summary of a run with the [INF] prefix"""
+    stream = stream if stream is not None else sys.stderr
+    for line in stats.summary():
+        print(f"[INF] Stats: {line}", file=stream)
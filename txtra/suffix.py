@@ -0,0 +1,158 @@
+import re
+
+from typing import Dict, Iterable, List, Optional
+
+PSL_FILE = "public_suffix_list.dat"
+
+# Marks a node as the end of a rule: True for a normal or wildcard rule,
+# False for an exception rule ("!")
+_END = ""
+_IPV4 = re.compile(r"\d{1,3}(?:\.\d{1,3}){3}")
+
+
+class SuffixTrie:
+    """Public Suffix List rules stored as a trie of reversed labels"""
+
+    def __init__(self, rules: Iterable[str] = (), version: str = "") -> None:
+        self.root: Dict[str, dict] = {}
+        self.version = version
+        for rule in rules:
+            self.add(rule)
+
+    def add(self, rule: str) -> None:
+        """Add a Public Suffix List rule
+
+        Args:
+            rule (str): Rule such as "co.uk", "*.ck" or "!www.ck"
+        """
+        exception = rule.startswith("!")
+        if exception:
+            rule = rule[1:]
+        node = self.root
+        for label in reversed(rule.lower().split(".")):
+            node = node.setdefault(label, {})
+        node[_END] = not exception
+
+    def suffix_length(self, labels: List[str]) -> int:
+        """Get the number of labels that form the public suffix
+
+        Args:
+            labels (List[str]): Lowercase domain labels
+
+        Returns:
+            int: Public suffix length in labels, 0 when no rule matches
+        """
+        best = 0
+        exception = 0
+        stack = [(self.root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            if depth:
+                end = node.get(_END)
+                if end is True:
+                    best = max(best, depth)
+                elif end is False:
+                    exception = max(exception, depth)
+            if depth == len(labels):
+                continue
+            label = labels[-1 - depth]
+            for key in (label, "*"):
+                child = node.get(key)
+                if child is not None:
+                    stack.append((child, depth + 1))
+        if exception:
+            # An exception rule makes its leftmost label registrable
+            return exception - 1
+        return best
+
+    def registered_domain(self, domain: str) -> str:
+        """Get eTLD+1 from domain
+
+        Matching is case-insensitive and ignores a trailing dot. A domain
+        without a known suffix yields its last label, and an IPv4 address is
+        returned unchanged.
+
+        Args:
+            domain (str): Domain name
+
+        Returns:
+            str: eTLD+1 domain
+        """
+        name = domain.strip().rstrip(".").lower()
+        if _IPV4.fullmatch(name):
+            return name
+        labels = [label for label in name.split(".") if label]
+        if not labels:
+            return ""
+        length = self.suffix_length(labels)
+        if length == 0:
+            return labels[-1]
+        return ".".join(labels[-length - 1:])
+
+
+def parse_rules(text: str, private: bool = False) -> SuffixTrie:
+    """Parse Public Suffix List data
+
+    Unicode rules are also added in their IDNA form, since names in DNS
+    answers are punycode.
+
+    Args:
+        text (str): Contents of public_suffix_list.dat
+        private (bool): Include the PRIVATE DOMAINS section
+
+    Returns:
+        SuffixTrie: Trie holding the rules
+    """
+    version = ""
+    trie = SuffixTrie()
+    in_private = False
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("//"):
+            if line.startswith("// VERSION:"):
+                version = line.split(":", 1)[1].strip()
+            elif "===BEGIN PRIVATE DOMAINS===" in line:
+                in_private = True
+            elif "===END PRIVATE DOMAINS===" in line:
+                in_private = False
+            continue
+        if not line or (in_private and not private):
+            continue
+        rule = line.split()[0]
+        trie.add(rule)
+        if not rule.isascii():
+            try:
+                trie.add(_to_ascii(rule))
+            except UnicodeError:
+                pass
+    trie.version = version
+    return trie
+
+
+def _to_ascii(rule: str) -> str:
+    prefix = "!" if rule.startswith("!") else ""
+    labels = rule.lstrip("!").split(".")
+    return prefix + ".".join(
+        label if label == "*" or label.isascii() else label.encode("idna").decode("ascii")
+        for label in labels
+    )
+
+
+_trie: Optional[SuffixTrie] = None
+
+
+def default_trie() -> SuffixTrie:
+    """Get the trie built from the bundled Public Suffix List snapshot
+
+    The snapshot ships with txtra and is never refreshed over the network.
+
+    Returns:
+        SuffixTrie: ICANN section of the bundled snapshot
+    """
+    global _trie
+    if _trie is None:
+        from importlib import resources
+
+        text = (resources.files("txtra") / "data" / PSL_FILE).read_text(encoding="utf-8")
+        _trie = parse_rules(text)
+    return _trie
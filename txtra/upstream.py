@@ -0,0 +1,401 @@
+import asyncio
+import ipaddress
+import random
+import sys
+import time
+
+from collections import deque
+from typing import Collection, Deque, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from dns import asyncresolver, resolver
+
+DEFAULT_PORT = 53
+# Queries sent for one lookup, the hedged or retried one included
+MAX_ATTEMPTS = 2
+# RTT samples kept per upstream, samples needed before they are trusted,
+# and new samples after which the percentiles are recomputed
+RTT_WINDOW = 512
+RTT_MIN_SAMPLES = 20
+RTT_REFRESH = 32
+# Errors after which a lookup is hedged or retried on another upstream
+RETRYABLE = (resolver.LifetimeTimeout, resolver.NoNameservers)
+# Consecutive timeouts after which an upstream is ejected
+EJECT_AFTER = 3
+EJECT_MIN = 5.0
+EJECT_MAX = 60.0
+# Weight of the newest sample in the smoothed RTT
+RTT_ALPHA = 0.2
+
+LEAST_OUTSTANDING = "least-outstanding"
+LATENCY = "latency"
+STRATEGIES = (LEAST_OUTSTANDING, LATENCY)
+
+Address = Tuple[str, int]
+
+
+def parse_address(value: str) -> Address:
+    """Parse a nameserver address
+
+    Accepted forms are "ip", "ip:port", "ip#port" and "[ipv6]:port".
+
+    Args:
+        value (str): Nameserver address
+
+    Raises:
+        ValueError: The address is not an IP address with an optional port
+
+    Returns:
+        Address: IP address and port
+    """
+    host, port = value.strip(), str(DEFAULT_PORT)
+    if "#" in host:
+        host, port = host.split("#", 1)
+    elif host.startswith("["):
+        host, sep, rest = host[1:].partition("]")
+        if not sep or (rest and not rest.startswith(":")):
+            raise ValueError(f"invalid nameserver address: '{value}'")
+        port = rest[1:] or port
+    elif host.count(":") == 1:
+        host, port = host.split(":")
+    try:
+        address = ipaddress.ip_address(host)
+        number = int(port)
+    except ValueError:
+        raise ValueError(f"invalid nameserver address: '{value}'") from None
+    if not 0 < number < 65536:
+        raise ValueError(f"invalid nameserver port: '{value}'")
+    return str(address), number
+
+
+def parse_resolvers(lines: Iterable[str]) -> List[Address]:
+    """Parse a nameserver list, one address per line
+
+    Blank lines and lines starting with "#" are skipped.
+
+    Args:
+        lines (Iterable[str]): Lines of the --resolvers file
+
+    Raises:
+        ValueError: A line is not a nameserver address
+
+    Returns:
+        List[Address]: Nameserver addresses, in file order
+    """
+    addresses = []
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            addresses.append(parse_address(line))
+    return addresses
+
+
+class TimeoutPolicy(NamedTuple):
+    """Bounds of the adaptive per-query timeout
+
+    The timeout of a query is the p99 RTT of its upstream times factor,
+    kept between minimum and maximum. maximum is used until the upstream
+    has answered RTT_MIN_SAMPLES queries.
+    """
+
+    minimum: float = 0.25
+    maximum: float = 3.0
+    factor: float = 2.0
+
+
+class Upstream:
+    """One nameserver with its load, RTT distribution and health
+
+    Args:
+        address (Address): Nameserver IP address and port
+        policy (TimeoutPolicy): Per-query timeout bounds
+    """
+
+    def __init__(self, address: Address, policy: TimeoutPolicy = TimeoutPolicy()) -> None:
+        self.address = address
+        self.policy = policy
+        self.resolver = asyncresolver.Resolver(configure=False)
+        self.resolver.nameservers = [address[0]]
+        self.resolver.port = address[1]
+        self.resolver.timeout = policy.maximum
+        self.outstanding = 0
+        self.rtts: Deque[float] = deque(maxlen=RTT_WINDOW)
+        self.srtt: Optional[float] = None
+        self._sorted: Optional[List[float]] = None
+        self._fresh = 0
+        self.timeouts = 0
+        self.ejected_until = 0.0
+        self.backoff = EJECT_MIN
+        self.queries = 0
+        self.failures = 0
+
+    def __str__(self) -> str:
+        host, port = self.address
+        return f"{host}#{port}" if port != DEFAULT_PORT else host
+
+    def observe(self, rtt: float) -> None:
+        """Add an RTT sample"""
+        self.rtts.append(rtt)
+        self._fresh += 1
+        if self._fresh >= RTT_REFRESH:
+            self._sorted = None
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Get an RTT percentile, None until enough samples were observed
+
+        Args:
+            q (float): Percentile between 0 and 1
+
+        Returns:
+            Optional[float]: RTT in seconds
+        """
+        if len(self.rtts) < RTT_MIN_SAMPLES:
+            return None
+        if self._sorted is None:
+            self._sorted = sorted(self.rtts)
+            self._fresh = 0
+        return self._sorted[min(int(q * len(self._sorted)), len(self._sorted) - 1)]
+
+    def timeout(self) -> float:
+        """Seconds the next query may take"""
+        p99 = self.percentile(0.99)
+        if p99 is None:
+            return self.policy.maximum
+        return min(max(p99 * self.policy.factor, self.policy.minimum), self.policy.maximum)
+
+    def hedge_delay(self) -> float:
+        """Seconds after which a query is duplicated to another upstream
+
+        The p95 RTT, so that about one query in twenty is hedged. Until the
+        percentiles are known, the query is only retried once it times out.
+        """
+        p95 = self.percentile(0.95)
+        if p95 is None:
+            return self.timeout()
+        return min(max(p95, self.policy.minimum), self.timeout())
+
+    def available(self, now: float) -> bool:
+        """Whether a query may be sent
+
+        Once its ejection ends, an upstream is probed with a single query
+        at a time until one succeeds.
+        """
+        if not self.ejected_until:
+            return True
+        return now >= self.ejected_until and self.outstanding == 0
+
+    def answered(self, rtt: float) -> None:
+        """Account for a response, negative answers included"""
+        self.observe(rtt)
+        self.srtt = rtt if self.srtt is None else self.srtt + RTT_ALPHA * (rtt - self.srtt)
+        self.timeouts = 0
+        if self.ejected_until:
+            print(f"[INF] Resolver {self} is back", file=sys.stderr)
+        self.ejected_until = 0.0
+        self.backoff = EJECT_MIN
+
+    def timed_out(self, timeout: float, now: float) -> None:
+        """Account for a timeout, ejecting the upstream when they keep coming
+
+        The timeout is recorded as an RTT sample, so that a rising share
+        of timeouts pushes the p99, and with it the next timeouts, up.
+        """
+        self.observe(timeout)
+        self.failures += 1
+        self.timeouts += 1
+        if self.ejected_until:
+            # Failed probe
+            self.backoff = min(self.backoff * 2, EJECT_MAX)
+        elif self.timeouts < EJECT_AFTER:
+            return
+        self.ejected_until = now + self.backoff
+        print(f"[INF] Resolver {self} ejected for {self.backoff:g}s after {self.timeouts} timeouts", file=sys.stderr)
+
+
+def system_nameservers() -> List[Address]:
+    """Get the nameservers of the system resolver configuration
+
+    Returns:
+        List[Address]: Nameservers of /etc/resolv.conf with their configured
+        ports, empty when there is no usable configuration or it lists a
+        nameserver the pool cannot query, such as a DNS-over-HTTPS one
+    """
+    import dns.nameserver
+
+    try:
+        system = resolver.Resolver()
+    except resolver.NoResolverConfiguration:
+        return []
+    addresses = []
+    for ns in system.nameservers:
+        if isinstance(ns, str):
+            addresses.append((ns, system.nameserver_ports.get(ns, system.port)))
+        elif isinstance(ns, dns.nameserver.Do53Nameserver):
+            addresses.append((ns.address, ns.port))
+        else:
+            return []
+    return addresses
+
+
+def system_lifetime() -> float:
+    """Get the time the system resolver allows a whole lookup, dnspython's 5 s lifetime"""
+    try:
+        return resolver.Resolver().lifetime
+    except resolver.NoResolverConfiguration:
+        return resolver.Resolver(configure=False).lifetime
+
+
+class UpstreamPool:
+    """Spread queries over several nameservers
+
+    Each query goes to the upstream with the fewest outstanding queries,
+    or to one drawn with a probability inversely proportional to its
+    smoothed RTT, and may take as long as that upstream's adaptive timeout.
+
+    When no response came after the p95 RTT of the upstream, the query is
+    hedged: a copy goes to another upstream and the first response wins.
+    A query that fails fast with SERVFAIL/REFUSED is retried right away.
+    An upstream that keeps timing out is ejected for a backoff that
+    doubles on every failed probe, up to EJECT_MAX seconds.
+
+    Args:
+        addresses (Sequence[Address]): Nameservers
+        strategy (str): LEAST_OUTSTANDING or LATENCY
+        policy (TimeoutPolicy): Per-query timeout bounds
+        hedge (bool): Hedge slow queries instead of waiting for their timeout
+        lifetime (Optional[float]): Seconds a whole lookup may take, hedges
+            and retries included, unbounded by default
+    """
+
+    def __init__(
+        self,
+        addresses: Sequence[Address],
+        strategy: str = LEAST_OUTSTANDING,
+        policy: TimeoutPolicy = TimeoutPolicy(),
+        hedge: bool = True,
+        lifetime: Optional[float] = None,
+    ) -> None:
+        if not addresses:
+            raise ValueError("at least one nameserver is required")
+        if strategy not in STRATEGIES:
+            raise ValueError(f"unknown strategy: '{strategy}'")
+        self.upstreams = [Upstream(address, policy) for address in addresses]
+        self.strategy = strategy
+        self.hedge = hedge
+        self.lifetime = lifetime
+        self.hedged = 0
+        self.retried = 0
+
+    def pick(self, exclude: Collection[Upstream] = ()) -> Upstream:
+        """Choose the upstream of the next query
+
+        Args:
+            exclude (Collection[Upstream]): Upstreams already tried for the query
+
+        Returns:
+            Upstream: Chosen upstream. When every candidate is ejected, the
+            one whose ejection ends first.
+        """
+        now = time.monotonic()
+        candidates = [u for u in self.upstreams if u not in exclude] or self.upstreams
+        ready = [u for u in candidates if u.available(now)]
+        if not ready:
+            return min(candidates, key=lambda u: u.ejected_until)
+
+        if self.strategy == LATENCY:
+            known = [u.srtt for u in ready if u.srtt is not None]
+            # Upstreams without samples are weighted like the fastest one
+            default = min(known) if known else 1.0
+            weights = [1 / max(u.srtt if u.srtt is not None else default, 1e-4) for u in ready]
+            return random.choices(ready, weights)[0]
+
+        fewest = min(u.outstanding for u in ready)
+        return random.choice([u for u in ready if u.outstanding == fewest])
+
+    async def _attempt(self, upstream: Upstream, name: str, rdtype: str) -> resolver.Answer:
+        """Send one query to one upstream within its adaptive timeout"""
+        timeout = upstream.timeout()
+        upstream.queries += 1
+        upstream.outstanding += 1
+        start = time.monotonic()
+        try:
+            answers = await upstream.resolver.resolve(name, rdtype, lifetime=timeout)
+        except (resolver.NXDOMAIN, resolver.NoAnswer):
+            upstream.answered(time.monotonic() - start)
+            raise
+        except resolver.LifetimeTimeout:
+            upstream.timed_out(timeout, time.monotonic())
+            raise
+        except resolver.NoNameservers:
+            # SERVFAIL/REFUSED usually comes from the domain, not the
+            # upstream, so it does not count towards ejection
+            upstream.failures += 1
+            raise
+        finally:
+            upstream.outstanding -= 1
+        upstream.answered(time.monotonic() - start)
+        return answers
+
+    async def resolve(self, name: str, rdtype: str = "TXT") -> resolver.Answer:
+        """Resolve a name through the pool
+
+        Args:
+            name (str): Domain name
+            rdtype (str): Record type
+
+        Raises:
+            resolver.NXDOMAIN: The name does not exist
+            resolver.NoAnswer: The name has no records of the type
+            resolver.LifetimeTimeout: Every attempt timed out, or the
+                lookup outlived the lifetime of the pool
+            resolver.NoNameservers: Every attempt failed with SERVFAIL/REFUSED
+
+        Returns:
+            resolver.Answer: First answer of any upstream
+        """
+        if self.lifetime is None:
+            return await self._resolve(name, rdtype)
+        try:
+            async with asyncio.timeout(self.lifetime):
+                return await self._resolve(name, rdtype)
+        except TimeoutError:
+            raise resolver.LifetimeTimeout(timeout=self.lifetime, errors=[]) from None
+
+    async def _resolve(self, name: str, rdtype: str) -> resolver.Answer:
+        tried: List[Upstream] = []
+        pending: Set[asyncio.Future] = set()
+
+        def launch() -> Upstream:
+            upstream = self.pick(tried)
+            tried.append(upstream)
+            pending.add(asyncio.ensure_future(self._attempt(upstream, name, rdtype)))
+            return upstream
+
+        first = launch()
+        hedge_delay: Optional[float] = first.hedge_delay() if self.hedge else None
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED
+                )
+                hedge_delay = None
+                if not done:
+                    self.hedged += 1
+                    launch()
+                    continue
+
+                for task in done:
+                    if isinstance(task.exception(), RETRYABLE):
+                        error = task.exception()
+                # An answer wins over NXDOMAIN and NoAnswer, which are final too
+                final = [task for task in done if not isinstance(task.exception(), RETRYABLE)]
+                if final:
+                    return min(final, key=lambda task: task.exception() is not None).result()
+                if not pending and len(tried) < MAX_ATTEMPTS:
+                    self.retried += 1
+                    launch()
+            assert error is not None
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
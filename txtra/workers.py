@@ -0,0 +1,223 @@
+import argparse
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, wait
+from itertools import islice
+from typing import TYPE_CHECKING, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+if TYPE_CHECKING:
+    from txtra.__main__ import Domain, Template, Txtra, TxtRecords
+    from txtra.stats import RunStats
+
+BATCH_SIZE = 256
+# Batches submitted per worker ahead of the one being merged
+PREFETCH = 2
+
+ORDER_COMPLETION = "completion"
+ORDER_INPUT = "input"
+
+# State of a pool worker process, set once by init_worker
+_txtra: Optional["Txtra"] = None
+_args: Optional[argparse.Namespace] = None
+
+
+def batches(domains: Iterable["Domain"], size: int = BATCH_SIZE) -> Iterator[List["Domain"]]:
+    """Split domains into lists of at most size items, consuming them lazily"""
+    iterator = iter(domains)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def worker_args(args: argparse.Namespace) -> argparse.Namespace:
+    """Copy the arguments for a worker, which runs its batches in-process
+
+    Open input streams are left out, since they cannot be pickled.
+    """
+    copy = argparse.Namespace(**{key: value for key, value in vars(args).items() if key != "file"})
+    copy.workers = 1
+    if getattr(args, "qps", None) is not None:
+        # Every worker paces its own share of the global rate
+        copy.qps = args.qps / args.workers
+    return copy
+
+
+def init_worker(args: argparse.Namespace) -> None:
+    """Pool initializer: load the templates and open the lookup state once per worker process"""
+    global _txtra, _args
+    from multiprocessing.util import Finalize
+    from txtra.__main__ import Txtra
+
+    _txtra = Txtra()
+    if not args.no_scan:
+        _txtra.templates
+        _txtra.open_scan_memo(args)
+    if getattr(args, "stats", False) or getattr(args, "stats_file", None):
+        from txtra.stats import RunStats
+
+        _txtra.stats = RunStats()
+    # Shared by the batches of the process and released when it exits
+    _txtra.open_session(args)
+    Finalize(_txtra, _txtra.close_session, exitpriority=10)
+    _args = args
+
+
+def detach(records: List["TxtRecords"]) -> List["TxtRecords"]:
+    """Replace matched templates by name-only copies before pickling
+
+    Sinks only need the name of a matched template, so the rule, raw YAML
+    and compiled patterns are not sent back to the parent.
+    """
+    from txtra.__main__ import Template
+
+    stubs: Dict[str, "Template"] = {}
+    for container in records:
+        for record in container:
+            for match in record.matches:
+                t = match.template
+                stub = stubs.get(t.name)
+                if stub is None:
+                    stub = stubs[t.name] = Template(t.name, t.author, t.category)
+                match.template = stub
+    return records
+
+
+def scan_batch(
+    batch: List["Domain"],
+) -> Tuple[int, List["TxtRecords"], List[str], Optional["RunStats"]]:
+    """Resolve and scan one batch inside a worker process
+
+    Error messages are returned rather than printed, so that lines of
+    concurrent workers do not interleave.
+
+    Args:
+        batch (List[Domain]): Domains of the batch
+
+    Returns:
+        Tuple[int, List[TxtRecords], List[str], Optional[RunStats]]: Number
+        of domains checked, the records of the successful ones in batch
+        order, the error messages of the failed ones and the statistics of
+        the batch when they are collected
+    """
+    import asyncio
+
+    assert _txtra is not None and _args is not None, "init_worker was not called"
+    stats = None
+    if _txtra.stats is not None:
+        from txtra.stats import RunStats
+
+        # Written records are counted by the parent, the lookups here
+        stats = _txtra.stats = RunStats()
+    position = {id(domain): i for i, domain in enumerate(batch)}
+    results: List[Tuple[int, "TxtRecords"]] = []
+    errors: List[str] = []
+    checked = asyncio.run(_txtra._run(
+        _args,
+        batch,
+        lambda records: results.append((position[id(records.domain)], records)),
+        on_error=errors.append,
+    ))
+    results.sort(key=lambda entry: entry[0])
+    return checked, detach([records for _, records in results]), errors, stats
+
+
+def run_pool(
+    args: argparse.Namespace,
+    domains: Iterable["Domain"],
+    handler: Callable[["TxtRecords"], None],
+    on_error: Callable[[str], None],
+    executor: Optional[Executor] = None,
+    stats: Optional["RunStats"] = None,
+    tick: Optional[Callable[[], None]] = None,
+) -> int:
+    """Resolve and scan domains across a pool of worker processes
+
+    Domains are sent to the workers in batches, and each worker runs its own
+    asyncio engine over them. Results are merged back into handler by the
+    calling process, either as batches complete or in input order.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments, with
+            workers and order set
+        domains (Iterable[Domain]): Domains to check, consumed lazily
+        handler (Callable[[TxtRecords], None]): Called with the records of
+            each domain in the calling process
+        on_error (Callable[[str], None]): Called with the message of each
+            failed domain in the calling process
+        executor (Optional[Executor]): Pool to run batches on. Defaults to a
+            process pool of args.workers processes.
+        stats (Optional[RunStats]): Receives the statistics of every batch
+        tick (Optional[Callable[[], None]]): Called every TICK_INTERVAL
+            seconds while waiting on the workers
+
+    Returns:
+        int: Number of domains checked, failures included
+    """
+    from txtra.output import TICK_INTERVAL
+
+    workers = args.workers
+    in_order = getattr(args, "order", ORDER_COMPLETION) == ORDER_INPUT
+    own_executor = executor is None
+    if executor is None:
+        from concurrent.futures import ProcessPoolExecutor
+
+        executor = ProcessPoolExecutor(
+            max_workers=workers, initializer=init_worker, initargs=(worker_args(args),)
+        )
+
+    checked = 0
+    pending: Deque[Future] = deque()
+    running: Set[Future] = set()
+
+    def merge(future: Future) -> None:
+        nonlocal checked
+        count, results, errors, batch_stats = future.result()
+        checked += count
+        if stats is not None and batch_stats is not None:
+            stats.merge(batch_stats)
+        for message in errors:
+            on_error(message)
+        for records in results:
+            handler(records)
+
+    def ready(futures: Iterable[Future]) -> Set[Future]:
+        """Wait for the first of futures to finish, ticking meanwhile"""
+        while True:
+            timeout = TICK_INTERVAL if tick is not None else None
+            finished, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            if finished:
+                return finished
+            tick()  # type: ignore
+
+    def drain() -> None:
+        """Merge the next batch, or every finished batch in completion order"""
+        if in_order:
+            ready([pending[0]])
+            merge(pending.popleft())
+            return
+        finished = ready(running)
+        for future in finished:
+            running.discard(future)
+            merge(future)
+
+    try:
+        for batch in batches(domains, BATCH_SIZE):
+            future = executor.submit(scan_batch, batch)
+            if in_order:
+                pending.append(future)
+            else:
+                running.add(future)
+            while len(pending) + len(running) >= workers * PREFETCH:
+                drain()
+        while pending or running:
+            drain()
+    except BaseException:
+        for future in (*pending, *running):
+            future.cancel()
+        raise
+    finally:
+        if own_executor:
+            executor.shutdown(wait=True, cancel_futures=True)
+    return checked